@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import atexit
+import threading
+import logging
+
+# 各接口自适应批次大小的持久化文件
+BATCH_SIZE_FILE = "batch_sizes.json"
+
+# 两次写文件的最短间隔（秒），退出时再保存一次
+SAVE_INTERVAL = 10
+
+_state = None
+_state_lock = threading.Lock()
+_last_save = 0.0
+_dirty = False          # 有未保存的请求记录
+_exit_hook = False      # 是否已注册退出时保存
+
+def _load_state():
+    """读取持久化的批次大小（调用方持有 _state_lock）"""
+    global _state
+    if _state is None:
+        _state = {}
+        if os.path.exists(BATCH_SIZE_FILE):
+            try:
+                with open(BATCH_SIZE_FILE, "r", encoding="utf-8") as f:
+                    _state = json.load(f)
+            except Exception as e:
+                logging.warning(f"读取批次大小缓存 {BATCH_SIZE_FILE} 失败，使用默认值: {e}")
+    return _state
+
+def _save_state(force=False):
+    """只在有控制器记录过请求时写文件，只导入模块或没有请求时不创建文件"""
+    global _last_save, _dirty
+    with _state_lock:
+        if not _dirty or (not force and time.time() - _last_save < SAVE_INTERVAL):
+            return
+        tmp_path = f"{BATCH_SIZE_FILE}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(_state, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, BATCH_SIZE_FILE)
+            _last_save = time.time()
+            _dirty = False
+        except Exception as e:
+            logging.warning(f"保存批次大小缓存 {BATCH_SIZE_FILE} 失败: {e}")
+
+# ============== 自适应批次大小 ==============
+class BatchSizer:
+    """
+    单个接口（如某个因子类型的 get_factor）的自适应批次大小
+
+    请求耗时低于目标且响应不大时按 growth 倍数增大批次；请求超时、失败或响应过大时减半。
+    按批次大小记录吞吐量（股票数/秒）的滑动平均，吞吐量最高的批次大小会持久化，下次运行从该值开始。
+    """
+
+    def __init__(self, key, initial=100, min_size=10, max_size=5000, target_seconds=5.0,
+                 max_cells=2000000, growth=1.25):
+        """
+        Args:
+            key (str): 接口标识，例如 "get_factor:alpha101"
+            initial (int): 没有历史记录时的批次大小
+            target_seconds (float): 单次请求的目标耗时，超过 2 倍时缩小批次
+            max_cells (int): 单次响应的单元格上限，超过时缩小批次
+            growth (float): 请求顺利时的增长倍数
+        """
+        self.key = key
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_cells = max_cells
+        self.growth = growth
+        self._lock = threading.Lock()
+        self._rates = {}    # 批次大小 -> 吞吐量滑动平均
+
+        with _state_lock:
+            saved = _load_state().get(key, {})
+        self.best_size = saved.get("best_size")
+        self.best_rate = saved.get("best_rate", 0.0)
+        self._size = self._clamp(self.best_size or saved.get("size") or initial)
+
+    def _clamp(self, size):
+        return int(max(self.min_size, min(self.max_size, size)))
+
+    @property
+    def size(self):
+        return self._size
+
+    def _resize(self, size, reason):
+        # 调用方持有锁
+        size = self._clamp(size)
+        if size != self._size:
+            logging.info(f"📐 {self.key} 批次大小 {self._size} → {size}（{reason}）")
+            self._size = size
+
+    def _persist(self):
+        global _dirty, _exit_hook
+        with _state_lock:
+            _load_state()[self.key] = {"size": self._size, "best_size": self.best_size,
+                                       "best_rate": round(self.best_rate, 3)}
+            _dirty = True
+            # 第一次记录请求后才注册退出时保存
+            if not _exit_hook:
+                atexit.register(_save_state, True)
+                _exit_hook = True
+        _save_state()
+
+    def observe(self, batch, elapsed, n_cells=None):
+        """
+        记录一次成功的请求
+
+        Args:
+            batch (int): 本次请求的股票数量
+            elapsed (float): 请求耗时（秒），不含限速等待
+            n_cells (int): 响应的单元格数量
+        """
+        with self._lock:
+            # 吞吐量按请求时的批次大小统计
+            rate = batch / max(elapsed, 1e-3)
+            avg = self._rates.get(batch)
+            avg = rate if avg is None else 0.7 * avg + 0.3 * rate
+            self._rates[batch] = avg
+            if batch == self._size and avg > self.best_rate:
+                self.best_size, self.best_rate = batch, avg
+
+            if elapsed > 2 * self.target_seconds:
+                self._resize(self._size // 2, f"耗时 {elapsed:.1f}s")
+            elif n_cells is not None and n_cells > self.max_cells:
+                self._resize(self._size // 2, f"响应 {n_cells} 个单元格")
+            elif (batch >= self._size and elapsed < self.target_seconds
+                  and (n_cells is None or n_cells < self.max_cells // 2)):
+                # 末尾不满的批次耗时偏低，不作为增大的依据
+                self._resize(max(self._size + 1, self._size * self.growth), "请求顺利")
+        self._persist()
+
+    def failure(self, error=None):
+        """请求失败（超时、连接断开等）时批次减半"""
+        with self._lock:
+            self._resize(self._size // 2, f"请求失败: {error}" if error else "请求失败")
+        self._persist()
+
+    def split(self, items):
+        """按当前批次大小切分列表"""
+        size = self._size
+        return [items[i:i+size] for i in range(0, len(items), size)]
+
+_sizers = {}
+_sizers_lock = threading.Lock()
+
+def get_batch_sizer(key, initial=100, **options):
+    """返回进程内共享的接口批次大小控制器"""
+    with _sizers_lock:
+        if key not in _sizers:
+            _sizers[key] = BatchSizer(key, initial, **options)
+        return _sizers[key]
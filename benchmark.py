@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+import multiprocessing
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# 基准测试结果的保存目录，每次运行一个 JSON 文件，便于前后对比
+RESULTS_DIR = "benchmark_results"
+
+# 宽表转长表基准的数据规模：全市场股票 × 交易日 × 因子
+TRANSFORM_SHAPE = (5000, 1, 100)
+
+# 默认参数：日常运行为一周，回补为一个季度
+DEFAULT_OPTIONS = {
+    "stocks": 1000,
+    "factors": 20,
+    "latency": 0.05,
+    "seconds_per_mcell": 0.5,
+    "workers": 4,
+    "window": 20,
+    "jobs": 1,
+    "rate": 1000,
+    "cache": True,
+    "db_url": None,
+    "daily_start": "2024-06-03",
+    "daily_end": "2024-06-07",
+    "backfill_start": "2024-04-01",
+    "backfill_end": "2024-06-28",
+    "keep_workdir": False,
+}
+
+# ============== 测试数据 ==============
+def make_factor_frame(n_stocks=5000, n_days=1, n_factors=100, inf_ratio=0.001, nan_ratio=0.02, seed=0):
+    """生成与 rqdatac.get_factor 返回格式相同的数据：index 为 (order_book_id, date)，每个因子一列"""
+    rng = np.random.default_rng(seed)
+    stocks = [f"{i:06d}.XSHE" for i in range(n_stocks)]
+    dates = pd.bdate_range("2024-01-02", periods=n_days)
+    index = pd.MultiIndex.from_product([stocks, dates], names=["order_book_id", "date"])
+    values = rng.standard_normal((len(index), n_factors))
+    values[rng.random(values.shape) < inf_ratio] = np.inf
+    values[rng.random(values.shape) < nan_ratio] = np.nan
+    return pd.DataFrame(values, index=index, columns=[f"factor_{i}" for i in range(n_factors)])
+
+# ============== 宽表转长表 ==============
+def melt_to_long(df, logger):
+    """原来的转换方式：reset_index().melt()，inf 替换为 None（factor_value 变为 object）后 dropna"""
+    df_long = df.reset_index().melt(id_vars=["order_book_id", "date"],
+                                    var_name="factor_name", value_name="factor_value")
+    df_long["factor_value"] = df_long["factor_value"].replace([float("inf"), float("-inf")], None)
+    return df_long.dropna(subset=["order_book_id", "date", "factor_name"])
+
+def numpy_to_long(df, logger):
+    """当前的转换方式：to_long_frame 直接展开值矩阵，clean_factor_data 在 float64 上处理 inf"""
+    from factor_schema import to_long_frame
+    from factor_engine import clean_factor_data
+    return clean_factor_data(to_long_frame(df), logger)
+
+def _measure(func, df, logger, repeat):
+    """返回 (最短耗时秒数, 峰值内存字节数, 结果)"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(df, logger)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(df, logger)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+def bench_transform(n_stocks=5000, n_days=1, n_factors=100, repeat=3):
+    """对比 melt 与 NumPy 两种宽表转长表的耗时、峰值内存和结果内存"""
+    logger = logging.getLogger("benchmark")
+    df = make_factor_frame(n_stocks, n_days, n_factors)
+
+    rows = []
+    for name, func in [("melt", melt_to_long), ("numpy", numpy_to_long)]:
+        seconds, peak, result = _measure(func, df, logger, repeat)
+        rows.append({
+            "方式": name,
+            "行数": len(result),
+            "耗时(ms)": round(seconds * 1000, 1),
+            "峰值内存(MB)": round(peak / 1e6, 1),
+            "结果内存(MB)": round(result.memory_usage(deep=True).sum() / 1e6, 1),
+            "factor_value 类型": str(result["factor_value"].dtype),
+        })
+    report = pd.DataFrame(rows).set_index("方式")
+    speedup = report.loc["melt", "耗时(ms)"] / max(report.loc["numpy", "耗时(ms)"], 1e-3)
+    title = f"宽表转长表: {n_stocks} 只股票 × {n_days} 个交易日 × {n_factors} 个因子，NumPy 加速 {speedup:.1f} 倍"
+    return title, report
+
+# ============== 本地数据库 ==============
+class LocalDB:
+    """基准测试使用的数据库，默认为工作目录中的 SQLite 文件，也可以指定一个空的 MySQL 库"""
+
+    def __init__(self, url):
+        from sqlalchemy import create_engine
+        connect_args = {"timeout": 60} if url.startswith("sqlite") else {"local_infile": True}
+        self.engine = create_engine(url, connect_args=connect_args)
+
+    def count(self, tables):
+        from sqlalchemy import inspect
+        inspector = inspect(self.engine)
+        return sum(int(pd.read_sql(f"SELECT COUNT(*) AS n FROM {t}", con=self.engine)["n"][0])
+                   for t in tables if inspector.has_table(t))
+
+    def drop(self, tables):
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            for table in tables:
+                conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+# ============== 场景 ==============
+def _factor_jobs(options):
+    import factor_engine
+    return factor_engine.build_jobs(factor_engine.FACTOR_JOBS[:options["jobs"]])
+
+def _factor_tables(options):
+    import factor_engine
+    return [config["table_name"] for config in factor_engine.FACTOR_JOBS[:options["jobs"]]]
+
+def scenario_transform(db, options):
+    """宽表转长表（不访问接口和数据库）"""
+    title, report = bench_transform(*TRANSFORM_SHAPE)
+    logging.getLogger("benchmark").info(title)
+    return {
+        "rows": int(report.loc["numpy", "行数"]),
+        "seconds": report.loc["numpy", "耗时(ms)"] / 1000,
+        "phases": {f"{name}_ms": float(report.loc[name, "耗时(ms)"]) for name in report.index},
+    }
+
+def scenario_factor_daily(db, options):
+    """逐日入库：run_factor_jobs 流水线模式，每个交易日全市场"""
+    import factor_engine
+    jobs = _factor_jobs(options)
+    factor_engine.run_factor_jobs(db, jobs, options["daily_start"], options["daily_end"],
+                                  batch_workers=options["workers"], pipeline=True)
+    return {"rows": db.count([job.target_table for job in jobs])}
+
+def scenario_factor_backfill(db, options):
+    """回补：多日窗口请求，每个因子类型依次处理"""
+    jobs = _factor_jobs(options)
+    for job in jobs:
+        job.fetch_and_insert_factors(db, options["backfill_start"], options["backfill_end"],
+                                     batch_workers=options["workers"], window_size=options["window"], pipeline=True)
+    return {"rows": db.count([job.target_table for job in jobs])}
+
+def _stock_price_main(db, start, end, options, window_size=1):
+    import stock_price
+    stock_price.DataBase_Position = lambda: db
+    stock_price.daily_polling_main(start.replace("-", ""), end.replace("-", ""),
+                                   fetch_workers=options["workers"], window_size=window_size)
+    return {"rows": db.count(["stock_price"])}
+
+def scenario_price_daily(db, options):
+    """stock_price 按天轮询"""
+    return _stock_price_main(db, options["daily_start"], options["daily_end"], options)
+
+def scenario_price_backfill(db, options):
+    """stock_price 多日窗口回补"""
+    return _stock_price_main(db, options["backfill_start"], options["backfill_end"], options, options["window"])
+
+def scenario_stock_info(db, options):
+    """stock_info 全量同步、部分股票状态变化后的增量同步、无变化的同步"""
+    import rddata
+    import rq_api
+    import fake_rqdatac
+    phases = {}
+    for phase, version in [("initial", 0), ("changed", 1), ("unchanged", 1)]:
+        fake_rqdatac.configure(instrument_version=version)
+        rq_api.get_cache().enabled = False   # 同一天内的 all_instruments 会命中缓存，这里每次都请求
+        started = time.perf_counter()
+        rddata.load_data_to_mysql(rddata.get_all_instruments(), "stock_info", db)
+        phases[f"{phase}_seconds"] = round(time.perf_counter() - started, 3)
+    return {"rows": db.count(["stock_info"]), "phases": phases}
+
+SCENARIOS = {
+    "transform": (scenario_transform, lambda options: []),
+    "factor_daily": (scenario_factor_daily, _factor_tables),
+    "factor_backfill": (scenario_factor_backfill, _factor_tables),
+    "price_daily": (scenario_price_daily, lambda options: ["stock_price"]),
+    "price_backfill": (scenario_price_backfill, lambda options: ["stock_price"]),
+    "stock_info": (scenario_stock_info, lambda options: ["stock_info"]),
+}
+
+# ============== 运行单个场景（子进程） ==============
+def _peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位为 KB，macOS 为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+def run_scenario(name, options):
+    """
+    在独立的工作目录中运行一个场景：模拟的 rqdatac、全新的缓存文件和数据库
+
+    Returns:
+        dict: 耗时、写入行数、接口调用次数与耗时、峰值内存、各流水线阶段的统计和 metrics 模块的指标
+    """
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    os.chdir(workdir)
+    logging.basicConfig(level=logging.INFO, filename=os.path.join(workdir, "benchmark.log"),
+                        format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+
+    import fake_rqdatac
+    fake_rqdatac.install()
+    fake_rqdatac.configure(n_stocks=options["stocks"], n_factors=options["factors"],
+                           latency=options["latency"], seconds_per_mcell=options["seconds_per_mcell"])
+    import rq_api
+    rq_api._limiter = rq_api.SharedRateLimiter(rate=options["rate"])
+    rq_api.get_cache().enabled = options["cache"]
+    import metrics
+    from pipeline import add_listener
+    stages = []
+    add_listener(lambda pipeline, snapshot: stages.extend({"pipeline": pipeline, **s} for s in snapshot))
+
+    func, tables = SCENARIOS[name]
+    db = LocalDB(options["db_url"] or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}")
+    if options["db_url"]:
+        db.drop(tables(options))
+    baseline_rss = _peak_rss_mb()
+
+    started = time.perf_counter()
+    result = func(db, options)
+    elapsed = result.pop("seconds", time.perf_counter() - started)
+
+    result.update({
+        "scenario": name,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(result["rows"] / max(elapsed, 1e-9), 1),
+        "api_calls": dict(fake_rqdatac.calls),
+        "api_seconds": {k: round(v, 3) for k, v in fake_rqdatac.seconds.items()},
+        "api_cells": dict(fake_rqdatac.cells),
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": stages,
+        "metrics": metrics.get_registry().to_dict(),
+    })
+    if not options["keep_workdir"]:
+        shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        result["workdir"] = workdir
+    return result
+
+def _run_isolated(name, options):
+    """每个场景在新的进程中运行，进程内的单例（限速器、股票池、覆盖索引）和峰值内存互不影响"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_scenario, (name, options))
+
+# ============== 报告 ==============
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def summary_table(results):
+    rows = []
+    for r in results:
+        rows.append({
+            "场景": r["scenario"],
+            "耗时(s)": r["seconds"],
+            "行数": r["rows"],
+            "行/秒": r["rows_per_second"],
+            "接口调用": sum(r["api_calls"].values()),
+            "接口耗时(s)": round(sum(r["api_seconds"].values()), 2),
+            "峰值内存(MB)": r["peak_rss_mb"],
+        })
+    return pd.DataFrame(rows).set_index("场景")
+
+def stage_table(results):
+    rows = [{"场景": r["scenario"], **s} for r in results for s in r["stages"]]
+    if not rows:
+        return None
+    columns = ["场景", "pipeline", "stage", "processed", "rows", "errors", "busy_seconds"]
+    return pd.DataFrame(rows)[columns].groupby(["场景", "pipeline", "stage"], sort=False).sum()
+
+def compare_table(results, previous):
+    """与上一次结果对比吞吐量，ratio > 1 表示本次更快"""
+    before = {r["scenario"]: r for r in previous["results"]}
+    rows = []
+    for r in results:
+        old = before.get(r["scenario"])
+        if old is None:
+            continue
+        rows.append({
+            "场景": r["scenario"],
+            "之前 行/秒": old["rows_per_second"],
+            "本次 行/秒": r["rows_per_second"],
+            "ratio": round(r["rows_per_second"] / max(old["rows_per_second"], 1e-9), 2),
+            "接口调用变化": sum(r["api_calls"].values()) - sum(old["api_calls"].values()),
+            "峰值内存变化(MB)": round(r["peak_rss_mb"] - old["peak_rss_mb"], 1),
+        })
+    return pd.DataFrame(rows).set_index("场景") if rows else None
+
+def latest_result(directory):
+    files = sorted(f for f in os.listdir(directory) if f.endswith(".json")) if os.path.isdir(directory) else []
+    return os.path.join(directory, files[-1]) if files else None
+
+# ============== 主程序 ==============
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='入库流程的端到端性能基准测试（模拟 rqdatac + 本地数据库）')
+    parser.add_argument('--scenarios', type=str, nargs='*', choices=list(SCENARIOS),
+                        help='要运行的场景，默认全部')
+    parser.add_argument('--stocks', type=int, default=DEFAULT_OPTIONS["stocks"], help='模拟的全市场股票数量')
+    parser.add_argument('--factors', type=int, default=DEFAULT_OPTIONS["factors"], help='每个因子类型的因子数量')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_OPTIONS["jobs"], help='参与测试的因子类型数量')
+    parser.add_argument('--latency', type=float, default=DEFAULT_OPTIONS["latency"], help='每次请求的模拟延迟（秒）')
+    parser.add_argument('--seconds-per-mcell', type=float, default=DEFAULT_OPTIONS["seconds_per_mcell"],
+                        help='每百万个返回单元格的模拟传输时间（秒）')
+    parser.add_argument('--workers', type=int, default=DEFAULT_OPTIONS["workers"], help='并发获取的批次/交易日数量')
+    parser.add_argument('--window', type=int, default=DEFAULT_OPTIONS["window"], help='回补场景每次请求的交易日数量')
+    parser.add_argument('--rate', type=float, default=DEFAULT_OPTIONS["rate"], help='模拟接口的限速（次/秒）')
+    parser.add_argument('--no-cache', action='store_true', help='关闭 rqdatac 响应缓存')
+    parser.add_argument('--db-url', type=str, default=None,
+                        help='SQLAlchemy 连接串，需指向空的测试库（会删除场景用到的表），默认使用临时 SQLite 文件')
+    parser.add_argument('--daily', type=str, nargs=2, metavar=('START', 'END'),
+                        default=[DEFAULT_OPTIONS["daily_start"], DEFAULT_OPTIONS["daily_end"]], help='日常场景的日期范围')
+    parser.add_argument('--backfill', type=str, nargs=2, metavar=('START', 'END'),
+                        default=[DEFAULT_OPTIONS["backfill_start"], DEFAULT_OPTIONS["backfill_end"]],
+                        help='回补场景的日期范围')
+    parser.add_argument('--output-dir', type=str, default=RESULTS_DIR, help='结果保存目录')
+    parser.add_argument('--compare', type=str, default=None, help='对比的历史结果文件，默认为目录中最新的一个')
+    parser.add_argument('--keep-workdir', action='store_true', help='保留各场景的临时工作目录（日志、数据库）')
+    args = parser.parse_args()
+
+    options = dict(DEFAULT_OPTIONS, stocks=args.stocks, factors=args.factors, jobs=args.jobs, latency=args.latency,
+                   seconds_per_mcell=args.seconds_per_mcell, workers=args.workers, window=args.window,
+                   rate=args.rate, cache=not args.no_cache, db_url=args.db_url, keep_workdir=args.keep_workdir,
+                   daily_start=args.daily[0], daily_end=args.daily[1],
+                   backfill_start=args.backfill[0], backfill_end=args.backfill[1])
+    output_dir = os.path.abspath(args.output_dir)
+    previous_path = args.compare or latest_result(output_dir)
+
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        print(f"▶ {name} ...", flush=True)
+        results.append(_run_isolated(name, options))
+
+    pd.set_option("display.width", 200)
+    print("\n" + summary_table(results).to_string())
+    stages = stage_table(results)
+    if stages is not None:
+        print("\n各阶段统计:\n" + stages.to_string())
+    if previous_path:
+        with open(previous_path, "r", encoding="utf-8") as f:
+            comparison = compare_table(results, json.load(f))
+        if comparison is not None:
+            print(f"\n与 {os.path.basename(previous_path)} 对比:\n" + comparison.to_string())
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"created": datetime.now().isoformat(timespec="seconds"), "revision": _git_revision(),
+                   "options": options, "results": results}, f, ensure_ascii=False, indent=2, default=str)
+    print(f"\n结果已保存到 {path}")
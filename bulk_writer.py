@@ -0,0 +1,252 @@
+import os
+import time
+import tempfile
+import logging
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+import metrics
+
+# 写入方式："load_data" 使用 LOAD DATA LOCAL INFILE 流式导入，"insert" 使用多行 INSERT
+WRITE_METHOD = "load_data"
+
+# 每个 LOAD DATA 文件 / executemany 批次包含的行数
+LOAD_CHUNKSIZE = 200000
+INSERT_CHUNKSIZE = 5000
+
+# 主键冲突处理：None 直接插入（冲突报错），"ignore" 跳过已存在的行，"update" 用新数据覆盖已存在的行
+ON_DUPLICATE_MODES = (None, "ignore", "update")
+
+# MySQL 服务端禁止 LOCAL INFILE 时的错误码（1148、3948、2068），出现后自动回退到 INSERT
+_LOCAL_INFILE_ERRORS = ("1148", "3948", "2068", "local infile", "LOCAL INFILE")
+_load_data_disabled = False
+
+# 主键冲突的错误码
+_DUPLICATE_KEY = 1062
+
+# 已确认有主键的表 {(连接串, 表名)}
+_keyed_tables = set()
+
+@contextmanager
+def _transaction(bind):
+    """engine 时开启新事务；已有连接时直接使用调用方的连接和事务"""
+    if isinstance(bind, Connection):
+        yield bind
+        return
+    with bind.begin() as conn:
+        yield conn
+
+# ============== 函数：整理待写入数据 ==============
+def _prepare_frame(df):
+    """日期列转为字符串，非有限浮点值（inf/nan）统一视为 NULL"""
+    df = df.copy()
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            # 纯日期写为 'YYYY-MM-DD'，与 DATE 列的比较结果在各数据库中一致
+            fmt = "%Y-%m-%d" if (series.dropna() == series.dropna().dt.normalize()).all() else "%Y-%m-%d %H:%M:%S"
+            df[col] = series.dt.strftime(fmt)
+        elif pd.api.types.is_bool_dtype(series):
+            df[col] = series.astype("int8")
+        elif pd.api.types.is_float_dtype(series):
+            df[col] = series.where(np.isfinite(series))
+    return df
+
+def _escape_text(series):
+    """转义 LOAD DATA 默认格式中的反斜杠、制表符和换行符"""
+    return (series.str.replace("\\", "\\\\", regex=False)
+                  .str.replace("\t", "\\t", regex=False)
+                  .str.replace("\n", "\\n", regex=False))
+
+# ============== 函数：LOAD DATA LOCAL INFILE 写入 ==============
+def _load_chunks(conn, df, table_name, chunksize, modifier=""):
+    """
+    将数据分块写成 TSV 临时文件，逐块通过 LOAD DATA LOCAL INFILE 导入 table_name
+
+    LOCAL 导入时主键冲突和类型转换错误只产生警告（冲突行被跳过、数据被截断），因此每块导入后检查
+    SHOW WARNINGS 和导入行数，有问题时抛出 ValueError 使整个事务回滚；IGNORE 模式下只允许主键冲突的警告
+    """
+    ignore = modifier.strip() == "IGNORE"
+    columns = ", ".join(f"`{col}`" for col in df.columns)
+    text_columns = [col for col in df.columns if not pd.api.types.is_numeric_dtype(df[col])]
+
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        if text_columns:
+            chunk = chunk.copy()
+            for col in text_columns:
+                chunk[col] = _escape_text(chunk[col].astype("string"))
+
+        fd, path = tempfile.mkstemp(prefix=f"{table_name}_", suffix=".tsv")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                chunk.to_csv(f, sep="\t", header=False, index=False,
+                             na_rep="\\N", float_format="%.17g", lineterminator="\n")
+            result = conn.exec_driver_sql(
+                f"LOAD DATA LOCAL INFILE '{path}' {modifier}INTO TABLE {table_name} "
+                f"CHARACTER SET utf8mb4 "
+                f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({columns})"
+            )
+            warnings = conn.exec_driver_sql("SHOW WARNINGS").fetchall()
+            if ignore:
+                warnings = [w for w in warnings if int(w[1]) != _DUPLICATE_KEY]
+            if warnings or (not ignore and result.rowcount != len(chunk)):
+                details = "; ".join(f"{w[1]} {w[2]}" for w in warnings[:5])
+                raise ValueError(f"{table_name} LOAD DATA 导入 {result.rowcount}/{len(chunk)} 行，警告: {details or '无'}")
+        finally:
+            os.remove(path)
+
+def _write_load_data(engine, df, table_name, chunksize, on_duplicate=None):
+    """
+    LOAD DATA LOCAL INFILE 写入
+
+    "update" 不使用 LOAD DATA 的 REPLACE（先删除冲突行再插入，会把数据中没有的列重置为默认值并触发删除），
+    而是先导入同结构的临时表，再 INSERT ... SELECT ... ON DUPLICATE KEY UPDATE 合并，与多行 INSERT 的结果一致
+    """
+    with _transaction(engine) as conn:
+        if on_duplicate != "update":
+            _load_chunks(conn, df, table_name, chunksize, "IGNORE " if on_duplicate == "ignore" else "")
+            return
+
+        columns = ", ".join(f"`{col}`" for col in df.columns)
+        updates = ", ".join(f"`{col}` = VALUES(`{col}`)" for col in df.columns)
+        staging = f"_stage_{table_name}"
+        # 临时表只对当前连接可见；上次失败留在连接池连接上的临时表先删除
+        conn.exec_driver_sql(f"DROP TEMPORARY TABLE IF EXISTS {staging}")
+        conn.exec_driver_sql(f"CREATE TEMPORARY TABLE {staging} AS SELECT {columns} FROM {table_name} LIMIT 0")
+        _load_chunks(conn, df, staging, chunksize)
+        conn.exec_driver_sql(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {staging} "
+                             f"ON DUPLICATE KEY UPDATE {updates}")
+        conn.exec_driver_sql(f"DROP TEMPORARY TABLE {staging}")
+
+# ============== 函数：多行 INSERT 写入 ==============
+def _write_insert(engine, df, table_name, chunksize, on_duplicate=None):
+    """通过 executemany 写入，pymysql 会将其合并为多行 INSERT 语句"""
+    columns = ", ".join(f"`{col}`" for col in df.columns)
+    placeholders = ", ".join(["%s"] * len(df.columns))
+    ignore = "IGNORE " if on_duplicate == "ignore" else ""
+    sql = f"INSERT {ignore}INTO {table_name} ({columns}) VALUES ({placeholders})"
+    if on_duplicate == "update":
+        updates = ", ".join(f"`{col}` = VALUES(`{col}`)" for col in df.columns)
+        sql += f" ON DUPLICATE KEY UPDATE {updates}"
+
+    values = df.astype(object).where(df.notna(), None)
+    with _transaction(engine) as conn:
+        for start in range(0, len(values), chunksize):
+            rows = list(values.iloc[start:start + chunksize].itertuples(index=False, name=None))
+            conn.exec_driver_sql(sql, rows)
+
+# ============== 函数：其他数据库写入 ==============
+def _write_generic(engine, df, table_name, chunksize, on_duplicate=None):
+    """非 MySQL 数据库（如基准测试使用的 SQLite）的写入方式，SQLite 的冲突处理使用 OR IGNORE / OR REPLACE"""
+    columns = ", ".join(f'"{col}"' for col in df.columns)
+    placeholders = ", ".join(f":p{i}" for i in range(len(df.columns)))
+    verb = "INSERT"
+    if engine.dialect.name == "sqlite" and on_duplicate:
+        verb = {"ignore": "INSERT OR IGNORE", "update": "INSERT OR REPLACE"}[on_duplicate]
+    sql = text(f"{verb} INTO {table_name} ({columns}) VALUES ({placeholders})")
+
+    values = df.astype(object).where(df.notna(), None)
+    with _transaction(engine) as conn:
+        for start in range(0, len(values), chunksize):
+            rows = [{f"p{i}": v for i, v in enumerate(row)}
+                    for row in values.iloc[start:start + chunksize].itertuples(index=False, name=None)]
+            conn.execute(sql, rows)
+
+# ============== 函数：按 DataFrame 结构建表 ==============
+def ensure_table(df, table_name, engine, primary_key=None, dtype=None):
+    """
+    表不存在时按 DataFrame 的列类型创建空表（与 to_sql 自动建表一致）
+
+    Args:
+        primary_key (list): 新建表的主键列，upsert 写入依赖主键判断冲突
+        dtype (dict): 指定列的 SQL 类型，主键中的字符串列需要指定 VARCHAR 长度
+    """
+    if inspect(engine).has_table(table_name):
+        return
+    if engine.dialect.name != "mysql":
+        # 其他数据库不支持 ALTER TABLE ADD PRIMARY KEY，建表时直接带上主键
+        schema = pd.io.sql.get_schema(df.head(0), table_name, keys=primary_key, con=engine, dtype=dtype)
+        with engine.begin() as conn:
+            conn.execute(text(schema))
+        return
+    df.head(0).to_sql(name=table_name, con=engine, if_exists="fail", index=False, dtype=dtype)
+    if primary_key:
+        key_columns = ", ".join(f"`{col}`" for col in primary_key)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table_name} ADD PRIMARY KEY ({key_columns})"))
+
+# ============== 函数：检查主键 ==============
+def require_primary_key(engine, table_name):
+    """
+    "ignore" / "update" 依赖主键判断冲突，没有主键的表会静默追加重复行，因此直接报错
+
+    旧表（如 to_sql 创建的 stock_price）通过 migrate.py --steps primary_key 添加主键
+    """
+    key = (str(engine.engine.url), table_name)
+    if key in _keyed_tables:
+        return
+    if not inspect(engine).get_pk_constraint(table_name).get("constrained_columns"):
+        raise ValueError(f"{table_name} 没有主键，不能按主键跳过或覆盖写入，"
+                         f"请先运行 python migrate.py --tables {table_name} --steps primary_key")
+    _keyed_tables.add(key)
+
+# ============== 函数：批量写入 ==============
+def write_frame(df, table_name, engine, method=None, chunksize=None, on_duplicate=None):
+    """
+    批量写入 DataFrame 到已存在的 MySQL 表
+
+    Args:
+        df (DataFrame): 待写入数据，列名需与表字段一致
+        table_name (str): 目标表名
+        engine: SQLAlchemy engine，LOAD DATA 需要连接参数 local_infile=True；非 MySQL 时使用通用 INSERT。
+            也可以传入 Connection，此时在调用方的事务中写入，由调用方提交
+        method (str): "load_data" 或 "insert"，默认使用 WRITE_METHOD
+        chunksize (int): 每块行数
+        on_duplicate (str): 主键冲突处理，None / "ignore" / "update"，
+            None 时主键冲突抛出异常（LOAD DATA 的冲突和类型转换警告同样视为错误，整批回滚），
+            使用 "ignore" 或 "update" 时重试和重复运行不会因重复主键失败；目标表没有主键时抛出 ValueError
+
+    Returns:
+        int: 写入行数
+    """
+    if df is None or df.empty:
+        return 0
+
+    if on_duplicate not in ON_DUPLICATE_MODES:
+        raise ValueError(f"on_duplicate 只能是 {ON_DUPLICATE_MODES} 之一: {on_duplicate}")
+    if on_duplicate is not None:
+        require_primary_key(engine, table_name)
+
+    method = method or WRITE_METHOD
+    started = time.perf_counter()
+    method = _write(engine, df, table_name, method, chunksize, on_duplicate)
+    metrics.observe("db_write_seconds", time.perf_counter() - started, table=table_name, method=method)
+    metrics.inc("db_write_rows_total", len(df), table=table_name)
+    metrics.inc("db_write_bytes_total", int(df.memory_usage(index=False).sum()), table=table_name)
+    return len(df)
+
+def _write(engine, df, table_name, method, chunksize, on_duplicate):
+    """按数据库类型和写入方式写入，返回实际使用的写入方式"""
+    global _load_data_disabled
+    df = _prepare_frame(df)
+
+    if engine.dialect.name != "mysql":
+        _write_generic(engine, df, table_name, chunksize or INSERT_CHUNKSIZE, on_duplicate)
+        return "generic"
+
+    if method == "load_data" and not _load_data_disabled:
+        try:
+            _write_load_data(engine, df, table_name, chunksize or LOAD_CHUNKSIZE, on_duplicate)
+            return "load_data"
+        except Exception as e:
+            if not any(code in str(e) for code in _LOCAL_INFILE_ERRORS):
+                raise
+            # 服务端或驱动未开启 local_infile，本进程后续写入都使用 INSERT
+            _load_data_disabled = True
+            logging.getLogger(__name__).warning(f"⚠️ LOAD DATA LOCAL INFILE 不可用，回退到多行 INSERT: {e}")
+
+    _write_insert(engine, df, table_name, chunksize or INSERT_CHUNKSIZE, on_duplicate)
+    return "insert"
@@ -0,0 +1,179 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import logging
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import inspect, text
+
+# 入库进度日志（SQLite 文件）：记录每个 (任务, 日期, 批次) 的提交情况，中断后按日志从第一个未提交的批次继续
+JOURNAL_PATH = os.environ.get("INGEST_JOURNAL", "ingest_journal.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    job TEXT NOT NULL,
+    date TEXT NOT NULL,
+    batch TEXT NOT NULL,
+    stocks TEXT,
+    factors TEXT,
+    rows INTEGER,
+    committed_at TEXT,
+    PRIMARY KEY (job, date, batch)
+);
+CREATE TABLE IF NOT EXISTS days (
+    job TEXT NOT NULL,
+    date TEXT NOT NULL,
+    rows INTEGER,
+    committed_at TEXT,
+    PRIMARY KEY (job, date)
+);
+"""
+
+def batch_key(stocks, factors=None):
+    """由批次的股票和因子得到批次编号，批次划分不变时重复运行得到相同的编号"""
+    content = json.dumps([sorted(stocks), sorted(factors or [])])
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+def journal_job(db, table_name):
+    """
+    进度日志中的任务名：数据库连接串（不含密码）+ 表名
+
+    切换数据库后同名的表不会沿用原数据库的进度
+    """
+    return f"{db.engine.url.render_as_string(hide_password=True)}#{table_name}"
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+# ============== 进度日志 ==============
+class Journal:
+    """
+    批次粒度的入库进度日志
+
+    批次写入数据库后记入 batches 表（连同股票和因子列表）；一个交易日的全部批次完成后
+    记入 days 表，并删除该日的批次记录。重新运行时 days 中的交易日直接跳过，
+    未完成交易日中已提交的批次用于恢复覆盖索引，不需要扫描数据表。
+
+    日期按调用方给出的字符串保存，同一任务需使用同一种日期格式。任务名由 journal_job 生成，包含数据库和表名。
+    多个进程（各因子类型的单独脚本）可以共用同一个日志文件。
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 多线程共用一个连接（由锁保护），WAL 模式下多个进程可以同时读写
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    # ---------- 提交 ----------
+    def commit_batch(self, job, dates, stocks, factors=None, rows=0):
+        """批次已写入数据库：dates 为批次覆盖的交易日（多日窗口为多个）"""
+        key = batch_key(stocks, factors)
+        stocks_json = json.dumps(list(stocks))
+        factors_json = json.dumps(list(factors)) if factors is not None else None
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO batches (job, date, batch, stocks, factors, rows, committed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(job, date, key, stocks_json, factors_json, int(rows), _now()) for date in dates]
+            )
+            self._conn.commit()
+
+    def commit_days(self, job, dates):
+        """交易日已全部完成：记入 days 表，合并并删除该日的批次记录"""
+        dates = list(dates)
+        if not dates:
+            return
+        with self._lock:
+            for date in dates:
+                rows = self._conn.execute("SELECT COALESCE(SUM(rows), 0) FROM batches WHERE job = ? AND date = ?",
+                                          (job, date)).fetchone()[0]
+                self._conn.execute("INSERT OR REPLACE INTO days (job, date, rows, committed_at) VALUES (?, ?, ?, ?)",
+                                   (job, date, rows, _now()))
+                self._conn.execute("DELETE FROM batches WHERE job = ? AND date = ?", (job, date))
+            self._conn.commit()
+
+    def discard_dates(self, job, dates):
+        """删除指定日期的进度记录"""
+        with self._lock:
+            for table in ("batches", "days"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE job = ? AND date = ?",
+                                       [(job, date) for date in dates])
+            self._conn.commit()
+
+    def discard(self, job, start_date, end_date):
+        """数据被清除后（重新入库）删除 [start_date, end_date] 的进度记录"""
+        with self._lock:
+            for table in ("batches", "days"):
+                self._conn.execute(f"DELETE FROM {table} WHERE job = ? AND date BETWEEN ? AND ?",
+                                   (job, start_date, end_date))
+            self._conn.commit()
+
+    # ---------- 查询 ----------
+    def done_dates(self, job, start_date, end_date):
+        """[start_date, end_date] 内已全部完成的交易日"""
+        with self._lock:
+            rows = self._conn.execute("SELECT date FROM days WHERE job = ? AND date BETWEEN ? AND ?",
+                                      (job, start_date, end_date)).fetchall()
+        return {date for date, in rows}
+
+    def committed_batches(self, job, start_date, end_date):
+        """
+        [start_date, end_date] 内未完成交易日中已提交的批次
+
+        Returns:
+            list: [(日期, 股票列表, 因子列表或 None)]
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, stocks, factors FROM batches WHERE job = ? AND date BETWEEN ? AND ? ORDER BY date",
+                (job, start_date, end_date)
+            ).fetchall()
+        return [(date, json.loads(stocks), json.loads(factors) if factors else None)
+                for date, stocks, factors in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# ============== 函数：核对数据表 ==============
+def verify_dates(db, table_name, job, dates):
+    """
+    核对进度日志中的日期在数据表中仍有数据，返回仍有数据的日期集合
+
+    表被删除重建或数据被其他方式清除后，日志中已没有数据的日期从日志删除，重新入库
+    """
+    dates = set(dates)
+    if not dates:
+        return dates
+    stored = set()
+    if inspect(db.engine).has_table(table_name):
+        sql = text(f"SELECT DISTINCT date FROM {table_name} WHERE date BETWEEN :start AND :end")
+        with db.engine.connect() as conn:
+            rows = conn.execute(sql, {"start": min(dates), "end": max(dates)}).fetchall()
+        stored = {pd.Timestamp(str(date)) for date, in rows}
+    lost = {date for date in dates if pd.Timestamp(date) not in stored}
+    if lost:
+        logging.getLogger(__name__).warning(
+            f"⚠️ {table_name} 中已没有进度日志记录的 {len(lost)} 个交易日的数据，从日志删除后重新入库")
+        get_journal().discard_dates(job, lost)
+    return dates - lost
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+def get_journal(path=None):
+    """返回进程内共享的进度日志"""
+    path = path or JOURNAL_PATH
+    with _journals_lock:
+        if path not in _journals:
+            _journals[path] = Journal(path)
+        return _journals[path]
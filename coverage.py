@@ -0,0 +1,199 @@
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from factor_schema import INSTRUMENT_TABLE, FACTOR_DICT_TABLE
+from database import read_sql_chunks
+
+# 宽表按行写入，整行视为一个覆盖单元
+WIDE_FACTOR = "*"
+
+def _day(value):
+    """日期统一为 'YYYY-MM-DD' 字符串"""
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+def _bits_from_ids(ids):
+    """股票编号数组 -> 位图（Python int，第 i 位表示编号 i）"""
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+        return 0
+    flags = np.zeros(int(ids.max()) + 1, dtype=bool)
+    flags[ids] = True
+    return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+def _flags_from_bits(bits, size):
+    """位图 -> 长度为 size 的 bool 数组"""
+    raw = bits.to_bytes((size + 7) // 8, "little") if bits else bytes((size + 7) // 8)
+    return np.unpackbits(np.frombuffer(raw, dtype=np.uint8), bitorder="little")[:size].astype(bool)
+
+# ============== 覆盖位图索引 ==============
+class CoverageIndex:
+    """
+    (date, order_book_id, factor_name) 粒度的数据覆盖索引
+
+    每个 (日期, 因子) 对应一个股票位图，股票代码映射为连续编号。按日期范围一次扫描数据表建立，
+    每次写入后同步更新，用于找出部分缺失的交易日并只请求缺失的股票和因子。
+    """
+
+    def __init__(self, db, table_name, layout="long"):
+        self.db = db
+        self.table_name = table_name
+        self.layout = layout
+        self._lock = threading.Lock()
+        self._stock_ids = {}        # order_book_id -> 编号
+        self._stocks = []           # 编号 -> order_book_id
+        self._bits = {}             # 日期 -> {因子名: 股票位图}
+        self._loaded = set()        # 已从数据表加载的日期
+
+    def _ids(self, order_book_ids):
+        """股票代码转编号，新代码分配新编号（调用方持有锁）"""
+        ids = []
+        for code in order_book_ids:
+            sid = self._stock_ids.get(code)
+            if sid is None:
+                sid = len(self._stocks)
+                self._stock_ids[code] = sid
+                self._stocks.append(code)
+            ids.append(sid)
+        return np.asarray(ids, dtype=np.int64)
+
+    # ---------- 建立索引 ----------
+    def load(self, start_date, end_date, chunksize=1000000):
+        """一次扫描数据表中 [start_date, end_date] 的已有数据"""
+        if self.layout == "wide":
+            sql = (f"SELECT date, order_book_id FROM {self.table_name} "
+                   f"WHERE date BETWEEN '{start_date}' AND '{end_date}'")
+        elif self.layout == "encoded":
+            # 编码表通过维表还原股票代码和因子名
+            sql = (f"SELECT t.date, f.factor_name, i.order_book_id FROM {self.table_name} t "
+                   f"JOIN {INSTRUMENT_TABLE} i ON i.instrument_id = t.instrument_id "
+                   f"JOIN {FACTOR_DICT_TABLE} f ON f.factor_id = t.factor_id "
+                   f"WHERE t.date BETWEEN '{start_date}' AND '{end_date}'")
+        else:
+            sql = (f"SELECT date, factor_name, order_book_id FROM {self.table_name} "
+                   f"WHERE date BETWEEN '{start_date}' AND '{end_date}'")
+
+        dates = pd.date_range(start_date, end_date).strftime("%Y-%m-%d")
+        rows = 0
+        try:
+            # 服务器端游标逐块读取，客户端不缓存整个结果集
+            for chunk in read_sql_chunks(sql, self.db.engine, chunksize=chunksize):
+                if self.layout == "wide":
+                    chunk["factor_name"] = WIDE_FACTOR
+                self._add_frame(chunk)
+                rows += len(chunk)
+        except Exception as e:
+            logging.warning(f"建立 {self.table_name} 覆盖索引时出错: {e}")
+            return
+        with self._lock:
+            self._loaded.update(dates)
+        logging.info(f"🧭 {self.table_name} 覆盖索引已建立: {start_date} 到 {end_date}，扫描 {rows} 行")
+
+    def _ensure_loaded(self, date):
+        if date not in self._loaded:
+            self.load(date, date)
+
+    # ---------- 更新 ----------
+    def _add_frame(self, df):
+        if df.empty:
+            return
+        with self._lock:
+            df = df.assign(_day=pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d"),
+                           _sid=self._ids(df["order_book_id"].tolist()))
+            for (day, factor), group in df.groupby(["_day", "factor_name"], sort=False, observed=True):
+                day_bits = self._bits.setdefault(day, {})
+                day_bits[factor] = day_bits.get(factor, 0) | _bits_from_ids(group["_sid"].to_numpy())
+
+    def add_frame(self, df):
+        """写入成功后更新索引：长表需要 date, order_book_id, factor_name 列，宽表需要 date, order_book_id 列"""
+        if self.layout == "wide":
+            df = df[["date", "order_book_id"]].assign(factor_name=WIDE_FACTOR)
+        self._add_frame(df)
+
+    def add_cells(self, date, order_book_ids, factor_names=None):
+        """记录 date 上 股票 × 因子 已覆盖（由进度日志恢复，不读取数据表）"""
+        date = _day(date)
+        factors = [WIDE_FACTOR] if self.layout == "wide" or not factor_names else list(factor_names)
+        with self._lock:
+            bits = _bits_from_ids(self._ids(order_book_ids))
+            day_bits = self._bits.setdefault(date, {})
+            for factor in factors:
+                day_bits[factor] = day_bits.get(factor, 0) | bits
+
+    def mark_loaded(self, dates):
+        """已由其他来源（进度日志）确定覆盖情况的日期，查询时不再扫描数据表"""
+        with self._lock:
+            self._loaded.update(_day(date) for date in dates)
+
+    def discard(self, start_date, end_date):
+        """数据被删除后（如重新入库前清空分区）移除 [start_date, end_date] 的覆盖记录"""
+        days = set(pd.date_range(start_date, end_date).strftime("%Y-%m-%d"))
+        with self._lock:
+            for day in days:
+                self._bits.pop(day, None)
+            self._loaded.update(days)
+
+    # ---------- 查询 ----------
+    def _covered(self, date, factor, size):
+        bits = self._bits.get(date, {}).get(factor, 0)
+        return _flags_from_bits(bits, size)
+
+    def missing_groups(self, date, order_book_ids, factor_names):
+        """
+        找出指定日期缺失的单元，按缺失的因子组合分组
+
+        Returns:
+            list: [(缺失因子列表, 股票列表)]，已全部覆盖时为空列表
+        """
+        date = _day(date)
+        self._ensure_loaded(date)
+        factors = [WIDE_FACTOR] if self.layout == "wide" else list(factor_names)
+
+        with self._lock:
+            sids = self._ids(order_book_ids)
+            size = len(self._stocks)
+            # 矩阵：因子 × 股票，True 表示缺失
+            missing = np.array([~self._covered(date, factor, size)[sids] for factor in factors])
+
+        if not missing.any():
+            return []
+
+        stocks = list(order_book_ids)
+        groups = {}
+        for col in np.flatnonzero(missing.any(axis=0)):
+            key = tuple(np.flatnonzero(missing[:, col]))
+            groups.setdefault(key, []).append(stocks[col])
+
+        if self.layout == "wide":
+            return [(list(factor_names), codes) for codes in groups.values()]
+        return [([factors[i] for i in key], codes) for key, codes in groups.items()]
+
+    def filter_missing(self, df):
+        """只保留尚未覆盖的行，避免重复写入已有的单元"""
+        if df.empty:
+            return df
+        days = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d").to_numpy()
+        if self.layout == "wide":
+            factors = np.full(len(df), WIDE_FACTOR, dtype=object)
+        else:
+            factors = df["factor_name"].to_numpy()
+
+        with self._lock:
+            sids = self._ids(df["order_book_id"].tolist())
+            size = len(self._stocks)
+            keep = np.ones(len(df), dtype=bool)
+            for (day, factor), positions in pd.Series(np.arange(len(df))).groupby([days, factors]):
+                rows = positions.to_numpy()
+                keep[rows] = ~self._covered(day, factor, size)[sids[rows]]
+        return df[keep]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_coverage_index(db, table_name, layout="long"):
+    """返回进程内共享的数据表覆盖索引（按数据库、表名和表结构区分）"""
+    with _indexes_lock:
+        key = (str(db.engine.url), table_name, layout)
+        if key not in _indexes:
+            _indexes[key] = CoverageIndex(db, table_name, layout)
+        return _indexes[key]
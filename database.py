@@ -0,0 +1,117 @@
+import os
+import atexit
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+# ============== 数据库配置 ==============
+# 各入库脚本共用的 MySQL 连接参数，可以通过环境变量覆盖
+DB_HOST = os.environ.get("INGEST_DB_HOST", "")
+DB_PORT = int(os.environ.get("INGEST_DB_PORT", 3306))
+DB_USERNAME = os.environ.get("INGEST_DB_USERNAME", "")
+DB_PASSWORD = os.environ.get("INGEST_DB_PASSWORD", "")
+DB_SCHEMA = os.environ.get("INGEST_DB_SCHEMA", "")
+
+# 连接池：常驻连接数、高峰时额外允许的连接数、取连接的等待上限（秒）
+POOL_SIZE = 10
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 60
+# 连接使用超过该时间（秒）后重建，需小于服务端 wait_timeout，避免取到已被服务端关闭的连接
+POOL_RECYCLE = 1800
+
+# 服务器端游标每次取回的行数
+STREAM_FETCH_SIZE = 100000
+
+def database_url(schema=None):
+    """MySQL 连接串，schema 为 None 时使用 DB_SCHEMA"""
+    schema = DB_SCHEMA if schema is None else schema
+    return f"mysql+pymysql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{schema}?charset=utf8mb4"
+
+# ============== 共享连接池 ==============
+_engines = {}
+_engines_lock = threading.Lock()
+_exit_hook = False
+
+def get_engine(url=None):
+    """
+    返回进程内共享的 SQLAlchemy engine，同一连接串只创建一次，各线程从同一个连接池取连接
+
+    MySQL 连接在取出时先 ping（pool_pre_ping），服务端已断开的连接（MySQL server has gone away）
+    会被丢弃并重新建立，定期回收长时间使用的连接；允许 LOAD DATA LOCAL INFILE 批量导入
+    """
+    global _exit_hook
+    url = url or database_url()
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            if make_url(url).get_backend_name() == "mysql":
+                engine = create_engine(
+                    url,
+                    pool_size=POOL_SIZE,
+                    max_overflow=MAX_OVERFLOW,
+                    pool_timeout=POOL_TIMEOUT,
+                    pool_recycle=POOL_RECYCLE,
+                    pool_pre_ping=True,
+                    connect_args={"local_infile": True}
+                )
+            else:
+                engine = create_engine(url, pool_pre_ping=True)
+            _engines[url] = engine
+            if not _exit_hook:
+                # 创建第一个连接池时注册，进程退出时关闭所有连接
+                atexit.register(dispose_engines)
+                _exit_hook = True
+        return engine
+
+def dispose_engines():
+    """关闭所有连接池中的空闲连接，进程退出时自动调用"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+
+# ============== 流式读取 ==============
+@contextmanager
+def streaming(engine, fetch_size=STREAM_FETCH_SIZE):
+    """
+    服务器端游标的连接：结果逐批从服务端取回，不在客户端缓存整个结果集
+
+    用法：
+        with streaming(db.engine) as conn:
+            result = conn.execute(sql, params)
+    """
+    with engine.connect() as conn:
+        yield conn.execution_options(stream_results=True, max_row_buffer=fetch_size)
+
+def stream_rows(engine, sql, params=None, fetch_size=STREAM_FETCH_SIZE):
+    """使用服务器端游标逐批取回结果，每次生成最多 fetch_size 行"""
+    with streaming(engine, fetch_size) as conn:
+        result = conn.execute(sql, params or {})
+        while True:
+            rows = result.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield rows
+
+def read_sql_chunks(sql, engine, params=None, chunksize=STREAM_FETCH_SIZE):
+    """pd.read_sql 的流式版本：按 chunksize 行逐块生成 DataFrame"""
+    with streaming(engine, chunksize) as conn:
+        yield from pd.read_sql(sql, con=conn, params=params, chunksize=chunksize)
+
+# ============== 数据库连接 ==============
+class DataBase_Position:
+    """
+    数据库连接：engine 为进程内共享的连接池，多个实例、多个线程共用同一组连接
+
+    Args:
+        schema (str): 数据库名，默认为 DB_SCHEMA
+        url (str): 完整的连接串（如基准测试使用的 SQLite），指定后忽略 schema
+    """
+
+    def __init__(self, schema=None, url=None):
+        self.engine = get_engine(url or database_url(schema))
+
+    def close(self):
+        """释放连接池中的空闲连接（之后仍可继续使用，会重新建立连接）"""
+        self.engine.dispose()
@@ -0,0 +1,948 @@
+import numpy as np
+import pandas as pd
+import rqdatac
+from sqlalchemy import text, inspect
+from datetime import datetime, timedelta
+import threading
+import time
+import logging
+import argparse
+from scheduler import WindowSizer, run_batches, run_trading_days
+from pipeline import Pipeline, Stage
+from batch_sizer import get_batch_sizer
+import rq_api
+import metrics
+from rq_api import QuotaExceeded
+from factor_schema import create_wide_factor_table, sync_wide_columns, to_wide_frame, to_long_frame, WIDE_KEY_COLUMNS
+from factor_schema import create_encoded_factor_table, encode_factor_frame
+from factor_schema import ensure_partitions, setup_new_table, truncate_date_range
+from bulk_writer import write_frame, require_primary_key
+from trading_calendar import get_calendar
+from universe import get_universe
+from coverage import get_coverage_index
+from checkpoint import get_journal, journal_job, verify_dates
+from database import DataBase_Position
+
+# ============== 因子任务配置 ==============
+# 每个因子类型对应一张目标表，run_factor_jobs 一次处理列表中的全部任务
+FACTOR_JOBS = [
+    {"factor_type": "moving_average_indicator", "table_name": "factor_MAI", "logger_file": "MAI.log"},
+    {"factor_type": "alpha101", "table_name": "factor4_alpha101", "logger_file": "alpha101_fetch.log"},
+    {"factor_type": "energy_indicator", "table_name": "factor_energy", "logger_file": "energy.log"},
+    {"factor_type": "eod_indicator", "table_name": "factor_fin_eod", "logger_file": "fin_eod.log"},
+    {"factor_type": "obos_indicator", "table_name": "factor_obos", "logger_file": "obos.log"},
+]
+
+# 流水线模式：获取、转换、写入三个阶段之间的队列长度和各阶段线程数（获取线程数由 batch_workers 指定）
+PIPELINE_QUEUE_SIZE = 8
+TRANSFORM_WORKERS = 1
+WRITE_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+# ============== 配置日志 ==============
+def setup_logging(logger_file="factor_engine.log"):
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(logger_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    return logger
+
+# ============== 函数：获取日期列表 ==============
+def get_date_range(start_date, end_date):
+    """从本地交易日历缓存获取真实的交易日列表，缓存未覆盖的区间才请求rqdatac"""
+    try:
+        trade_dt_list = get_calendar().range(start_date, end_date)
+
+        # 将date对象转换为字符串格式 'YYYY-MM-DD'
+        date_list = [dt.strftime('%Y-%m-%d') for dt in trade_dt_list]
+
+        return date_list
+
+    except Exception as e:
+        logging.error(f"获取交易日列表失败: {e}")
+        # 如果rqdatac获取失败，回退到原来的方法
+        logging.warning("回退到手动计算交易日")
+        return get_date_range_fallback(start_date, end_date)
+
+def get_date_range_fallback(start_date, end_date):
+    """回退方案：手动生成日期范围列表，跳过周末"""
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+
+    date_list = []
+    current = start
+    while current <= end:
+        # 跳过周末（周六=5，周日=6）
+        if current.weekday() < 5:
+            date_list.append(current.strftime('%Y-%m-%d'))
+        current += timedelta(days=1)
+
+    return date_list
+
+# ============== 函数：数据清洗 ==============
+def clean_factor_data(df_long, logger, batch_info=""):
+    """清洗因子数据：inf 替换为 NaN（写入后为 NULL），factor_value 保持 float64"""
+    if df_long.empty:
+        return df_long
+
+    # 统计原始数据中的特殊值
+    values = df_long['factor_value'].to_numpy(dtype=np.float64)
+    finite = np.isfinite(values)
+    nan_count = int(np.isnan(values).sum())
+    inf_count = len(values) - int(finite.sum()) - nan_count
+
+    if inf_count > 0 or nan_count > 0:
+        logger.info(f"🔧 {batch_info} 数据清洗: inf值={inf_count}, nan值={nan_count}")
+
+    # 将inf值替换为NaN（MySQL中存储为NULL）
+    if inf_count > 0:
+        df_long['factor_value'] = np.where(finite, values, np.nan)
+
+    # 确保关键字段不为空（没有空值时不复制）
+    key_na = df_long[['order_book_id', 'date', 'factor_name']].isna().any(axis=1).to_numpy()
+    if not key_na.any():
+        return df_long
+    df_cleaned = df_long[~key_na]
+
+    # 记录清洗后的数据量
+    logger.info(f"🧹 {batch_info} 清洗后数据量: {len(df_cleaned)}/{len(df_long)}")
+    return df_cleaned
+
+# ============== 因子入库任务 ==============
+class BatchFailed(Exception):
+    """批次重试后仍获取或写入失败，该批次不记入进度日志，所在交易日计为失败"""
+
+class FactorJob:
+    """一个因子类型的入库任务：因子类型、目标表和写入方式"""
+
+    def __init__(self, factor_type, table_name, logger_file=None, table_layout="long",
+                 on_duplicate="update", max_window_cells=2000000, value_dtype="float64", partition="month"):
+        """
+        Args:
+            factor_type (str): rqdatac.get_all_factor_names 的因子类型
+            table_name (str): 目标表名
+            logger_file (str): 单独运行该任务时的日志文件
+            table_layout (str): "long" 长表 (order_book_id, date, factor_name, factor_value)，
+                "wide" 宽表，每个 (order_book_id, date) 一行、每个因子一列，写入 {table_name}_wide，
+                "encoded" 编码长表 (instrument_id, date, factor_id, factor_value)，写入 {table_name}_enc，
+                股票代码和因子名保存在共用的维表中
+            on_duplicate (str): 主键冲突处理，None 直接插入，"ignore" 跳过，"update" 覆盖，
+                使用 "ignore"/"update" 时批次重试和重复运行不会因重复主键失败
+            max_window_cells (int): 多日窗口模式下单次响应的单元格上限，超过后自动缩小窗口
+            value_dtype (str): 编码表的因子值类型，"float32" 时以 4 字节 FLOAT 存储
+            partition (str): 目标表按日期 RANGE 分区的粒度，"month"/"year"，None 不分区（仅 MySQL）
+        """
+        self.factor_type = factor_type
+        self.table_name = table_name
+        self.logger_file = logger_file or f"{table_name}.log"
+        self.table_layout = table_layout
+        self.on_duplicate = on_duplicate
+        self.max_window_cells = max_window_cells
+        self.value_dtype = value_dtype
+        self.partition = partition
+        self._factor_list = None
+        self._done_dates = set()    # 进度日志中已完成的交易日
+        self._lock = threading.Lock()
+        # 未指定 batch_size 时，每批股票数量由该控制器根据请求耗时和响应大小自动调整
+        self.batch_sizer = get_batch_sizer(f"get_factor:{factor_type}")
+
+    @property
+    def target_table(self):
+        """当前表结构对应的目标表名"""
+        if self.table_layout == "wide":
+            return f"{self.table_name}_wide"
+        if self.table_layout == "encoded":
+            return f"{self.table_name}_enc"
+        return self.table_name
+
+    @property
+    def primary_key(self):
+        """目标表的主键列"""
+        if self.table_layout == "wide":
+            return list(WIDE_KEY_COLUMNS)
+        if self.table_layout == "encoded":
+            return ["instrument_id", "date", "factor_id"]
+        return ["order_book_id", "date", "factor_name"]
+
+    @property
+    def indexes(self):
+        """目标表的二级索引 [(索引名, 列)]，用于按日期（和因子）查询"""
+        if self.table_layout == "wide":
+            return [("idx_date", ["date"])]
+        if self.table_layout == "encoded":
+            return [("idx_date_factor", ["date", "factor_id"])]
+        return [("idx_date_factor", ["date", "factor_name"])]
+
+    # ---------- 表与索引 ----------
+    def create_table(self, db):
+        """创建目标表（如果不存在）"""
+        if self.table_layout == "wide":
+            create_wide_factor_table(db, self.target_table)
+            return
+        if self.table_layout == "encoded":
+            create_encoded_factor_table(db, self.target_table, self.value_dtype)
+            return
+        create_sql = f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            order_book_id VARCHAR(20),
+            date DATE,
+            factor_name VARCHAR(50),
+            factor_value DOUBLE,
+            update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (order_book_id, date, factor_name)
+        );
+        """
+        with db.engine.connect() as conn:
+            conn.execute(text(create_sql))
+            conn.commit()
+
+    def prepare_table(self, db, start_date, end_date):
+        """
+        创建目标表并补齐覆盖 [start_date, end_date] 的分区
+
+        新建的表直接分区并建立二级索引；已有的表只从 p_future 拆分新分区，
+        未分区的旧表需通过 migrate.py 分区和建索引
+        """
+        created = not inspect(db.engine).has_table(self.target_table)
+        self.create_table(db)
+        if created:
+            setup_new_table(db, self.target_table, self.partition, indexes=self.indexes,
+                            start_date=start_date, end_date=end_date)
+        ensure_partitions(db, self.target_table, start_date, end_date, self.partition)
+        # 没有主键的表在请求接口之前直接失败（见 require_primary_key）
+        if self.on_duplicate is not None:
+            require_primary_key(db.engine, self.target_table)
+
+    def truncate(self, db, start_date, end_date):
+        """清除 [start_date, end_date] 的已有数据（整分区直接 TRUNCATE），用于重新入库"""
+        truncate_date_range(db, self.target_table, start_date, end_date)
+        self.get_coverage(db).discard(start_date, end_date)
+        get_journal().discard(self.journal_job(db), start_date, end_date)
+        self._done_dates = {d for d in self._done_dates if not start_date <= d <= end_date}
+
+    def get_existing_dates(self, db, start_date, end_date):
+        """获取数据库中已存在的日期"""
+        try:
+            existing_dates = pd.read_sql(
+                f"SELECT DISTINCT date FROM {self.target_table} WHERE date BETWEEN '{start_date}' AND '{end_date}'",
+                con=db.engine
+            )['date'].tolist()
+            return [str(date) for date in existing_dates]
+        except Exception as e:
+            logging.warning(f"获取已存在日期时出错: {e}")
+            return []
+
+    def get_coverage(self, db):
+        """目标表的 (date, order_book_id, factor_name) 覆盖索引"""
+        return get_coverage_index(db, self.target_table, self.table_layout)
+
+    # ---------- 进度日志 ----------
+    def journal_job(self, db):
+        """进度日志中的任务名（数据库 + 目标表）"""
+        return journal_job(db, self.target_table)
+
+    def resume(self, db, trading_dates):
+        """
+        按进度日志恢复这些交易日的覆盖索引
+
+        日志中已完成的交易日（核对数据表中仍有数据）直接跳过；未完成交易日中已提交的批次写入覆盖索引，
+        之后只请求第一个未提交的批次及其后的数据。日志从未记录过的交易日（首次运行、
+        由旧版本写入的数据，或上次响应不完整未能提交的日期）仍扫描数据表，连续的日期一次扫描。
+        """
+        if not trading_dates:
+            return
+        journal = get_journal()
+        coverage = self.get_coverage(db)
+        job = self.journal_job(db)
+        start_date, end_date = trading_dates[0], trading_dates[-1]
+        done = journal.done_dates(job, start_date, end_date)
+        batches = journal.committed_batches(job, start_date, end_date)
+        kept = verify_dates(db, self.target_table, job, done | {date for date, _, _ in batches})
+        done &= kept
+        batches = [batch for batch in batches if batch[0] in kept]
+        self._done_dates |= done
+
+        batch_dates = {date for date, _, _ in batches}
+        for date, stocks, factors in batches:
+            coverage.add_cells(date, stocks, factors)
+        coverage.mark_loaded(batch_dates)
+
+        # 日志没有记录的交易日按连续区间扫描数据表
+        runs, run = [], []
+        for date in trading_dates:
+            if date in done or date in batch_dates:
+                if run:
+                    runs.append(run)
+                    run = []
+            else:
+                run.append(date)
+        if run:
+            runs.append(run)
+        for run in runs:
+            coverage.load(run[0], run[-1])
+        if done or batches:
+            logger.info(f"⏩ {self.table_name} 按进度日志恢复：{len(done)} 个交易日已完成，"
+                        f"{len(batches)} 个批次已提交")
+
+    def is_done(self, date):
+        """该交易日在进度日志中已完成"""
+        return date in self._done_dates
+
+    def commit_dates(self, db, dates):
+        """
+        数据已完整的交易日记入进度日志
+
+        按覆盖索引确认股票池 × 全部因子都已写入或确认为空（见 BatchSpec.commit）；
+        有批次没有返回数据的日期不提交，下次运行仍会补齐
+        """
+        factor_list = self.get_factor_list()
+        coverage = self.get_coverage(db)
+        complete = [d for d in dates if d not in self._done_dates
+                    and not coverage.missing_groups(d, get_universe().active(d), factor_list)]
+        get_journal().commit_days(self.journal_job(db), complete)
+        self._done_dates.update(complete)
+
+    def get_factor_list(self):
+        """获取该因子类型的全部因子名，进程内只请求一次"""
+        with self._lock:
+            if self._factor_list is None:
+                self._factor_list = rq_api.get_all_factor_names(type=self.factor_type, job=self.table_name)
+            return self._factor_list
+
+    # ---------- 批次：获取 ----------
+    def fetch_batch(self, window_dates, stock_batch, factor_list, batch_info, max_retries=3, sizer=None):
+        """
+        请求一个股票批次在若干交易日内的因子数据
+
+        Args:
+            window_dates (list): 待获取的交易日（'YYYY-MM-DD'），一次请求覆盖首尾之间的所有日期
+            batch_info (str): 批次描述，用于日志
+            sizer (WindowSizer): 多日窗口模式下根据响应大小调整后续窗口
+
+        Returns:
+            list: [(日期列表, DataFrame)]，多日窗口失败拆分重试时包含多个元素
+        """
+        window_label = window_dates[0] if len(window_dates) == 1 else f"{window_dates[0]}~{window_dates[-1]}"
+        retry_count = 0
+
+        while retry_count < max_retries:
+            try:
+                # 所有进程共享 rq_api 的令牌桶，用量计入该任务的配额统计
+                df = rq_api.get_factor(order_book_ids=stock_batch,
+                                     factor=factor_list,
+                                     start_date=window_dates[0],
+                                     end_date=window_dates[-1],
+                                     expect_df=True,
+                                     job=self.table_name)
+                # 批次大小按接口本身的耗时调整，不含令牌桶的等待；本地缓存命中时为 None
+                elapsed = rq_api.last_elapsed()
+
+                if df is None or df.empty:
+                    logger.warning(f"⚠️ {window_label} {batch_info} 返回空数据")
+                    return []
+                # 批次大小按单日请求调整，多日窗口的响应大小由 WindowSizer 控制
+                if len(window_dates) == 1 and elapsed is not None:
+                    self.batch_sizer.observe(len(stock_batch), elapsed, df.size)
+                if sizer is not None:
+                    sizer.observe(df.size)
+                return [(window_dates, df)]
+
+            except QuotaExceeded:
+                raise
+            except Exception as e:
+                retry_count += 1
+                metrics.inc("retries_total", job=self.table_name, operation="fetch")
+
+                # 多日窗口失败（超时、响应过大等）时缩小窗口，拆成两半重新请求
+                if len(window_dates) > 1:
+                    if sizer is not None:
+                        sizer.shrink()
+                    mid = len(window_dates) // 2
+                    logger.warning(f"⚠️ {window_label} {batch_info} 窗口请求失败，拆分为两个窗口重试，错误: {e}")
+                    return (self.fetch_batch(window_dates[:mid], stock_batch, factor_list, batch_info, max_retries, sizer)
+                            + self.fetch_batch(window_dates[mid:], stock_batch, factor_list, batch_info, max_retries, sizer))
+
+                self.batch_sizer.failure(e)
+                # 批次已大于缩小后的批次大小时，按新的大小拆分股票后重新请求
+                if len(stock_batch) > self.batch_sizer.size:
+                    logger.warning(f"⚠️ {window_label} {batch_info} 请求失败，拆分为 {self.batch_sizer.size} 只股票一批重试，错误: {e}")
+                    fetched = []
+                    for part in self.batch_sizer.split(stock_batch):
+                        fetched += self.fetch_batch(window_dates, part, factor_list, batch_info, max_retries, sizer)
+                    return fetched
+                logger.warning(f"⚠️ {window_label} {batch_info} 第 {retry_count} 次重试，错误: {e}")
+                if retry_count >= max_retries:
+                    logger.error(f"❌ {window_label} {batch_info} 重试 {max_retries} 次后失败")
+                    raise BatchFailed(f"{window_label} {batch_info} 获取失败: {e}")
+                time.sleep(2)  # 重试前等待
+
+        return []
+
+    # ---------- 批次：转换 ----------
+    def transform_batch(self, db, fetched, batch_info):
+        """按日期拆分，转换为目标表结构并清洗，过滤已覆盖的单元，返回 [(日志标签, 待写入数据)]"""
+        coverage = self.get_coverage(db)
+        prepared = []
+
+        # 异常时同样记录耗时
+        with metrics.timer("transform_seconds", job=self.table_name):
+            for window_dates, df in fetched:
+                # 按日期拆分后分别写入，跳过窗口外的日期
+                if len(window_dates) == 1:
+                    day_frames = [(window_dates[0], df)]
+                else:
+                    day_frames = [(date.strftime('%Y-%m-%d'), df_day)
+                                  for date, df_day in df.groupby(level='date')]
+
+                for day, df_day in day_frames:
+                    if day not in window_dates:
+                        continue
+                    label = f"{day} {batch_info}"
+
+                    # 宽表：每个 (order_book_id, date) 一行，直接写入
+                    if self.table_layout == "wide":
+                        frame = coverage.filter_missing(to_wide_frame(df_day))
+                    else:
+                        # 转换为长表（order_book_id, date, factor_name, factor_value）
+                        df_long = to_long_frame(df_day)
+                        if df_long.empty:
+                            continue
+                        # 数据清洗：处理无穷大值和缺失值
+                        df_cleaned = clean_factor_data(df_long, logger, label)
+                        # 只写入尚未覆盖的单元（补齐部分缺失的交易日时，请求范围可能包含已有数据）
+                        frame = coverage.filter_missing(df_cleaned)
+
+                    if not frame.empty:
+                        prepared.append((label, frame))
+
+        metrics.inc("transform_rows_total", sum(len(frame) for _, frame in prepared), job=self.table_name)
+        return prepared
+
+    # ---------- 批次：写入 ----------
+    def write_batch(self, db, prepared, max_retries=3):
+        """写入转换后的数据并更新覆盖索引，返回插入行数"""
+        coverage = self.get_coverage(db)
+        kind = "宽表数据" if self.table_layout == "wide" else "数据"
+        total_inserted = 0
+        failed = []
+
+        for label, frame in prepared:
+            retry_count = 0
+            while retry_count < max_retries:
+                try:
+                    # 编码表：股票代码和因子名替换为维表编号后写入，覆盖索引仍按名称记录
+                    out = encode_factor_frame(db, frame, self.value_dtype) if self.table_layout == "encoded" else frame
+                    write_frame(out, self.target_table, db.engine, on_duplicate=self.on_duplicate)
+                    coverage.add_frame(frame)
+                    logger.info(f"✅ {label} 插入 {len(frame)} 行{kind}")
+                    total_inserted += len(frame)
+                    break
+
+                except Exception as e:
+                    retry_count += 1
+                    metrics.inc("retries_total", job=self.table_name, operation="write")
+                    error_msg = str(e)
+                    wait = 2  # 重试前等待
+
+                    # 特殊处理MySQL相关错误
+                    if "inf cannot be used with MySQL" in error_msg:
+                        logger.error(f"❌ {label} 数据包含无穷大值，跳过此批次")
+                        failed.append(label)
+                        break  # 跳过此批次，不重试
+                    elif "MySQL server has gone away" in error_msg or "Lost connection" in error_msg:
+                        # 断开的连接已被连接池丢弃，重试时取到新的连接，无需等待
+                        logger.warning(f"⚠️ {label} MySQL连接断开，使用新连接重试")
+                        wait = 0
+                    else:
+                        logger.warning(f"⚠️ {label} 第 {retry_count} 次重试，错误: {e}")
+
+                    if retry_count >= max_retries:
+                        logger.error(f"❌ {label} 重试 {max_retries} 次后失败")
+                        failed.append(label)
+                        break
+                    time.sleep(wait)
+
+        # 其余日期已写入，但批次不完整，不能记为已提交
+        if failed:
+            raise BatchFailed(f"{len(failed)}/{len(prepared)} 个日期写入失败: {', '.join(failed)}")
+        return total_inserted
+
+    def fetch_batch_factors(self, db, window_dates, stock_batch, factor_list, batch_info, max_retries=3, sizer=None):
+        """顺序执行获取、转换、写入，返回插入行数"""
+        fetched = self.fetch_batch(window_dates, stock_batch, factor_list, batch_info, max_retries, sizer)
+        return self.write_batch(db, self.transform_batch(db, fetched, batch_info), max_retries)
+
+    # ---------- 单日 ----------
+    def day_batches(self, db, target_date, all_stocks, batch_size=None):
+        """
+        按覆盖索引找出该日缺失的 (股票, 因子)，切分为待请求的批次
+
+        batch_size 为 None 时使用自适应批次大小
+
+        Returns:
+            list: BatchSpec 列表，该日数据完整时为空列表
+        """
+        if self.is_done(target_date):
+            logger.info(f"📅 {target_date} {self.table_name} 进度日志中已完成，跳过")
+            return []
+        factor_list = self.get_factor_list()
+        missing_groups = self.get_coverage(db).missing_groups(target_date, all_stocks, factor_list)
+        if not missing_groups:
+            logger.info(f"📅 {target_date} {self.table_name} 数据已存在，跳过")
+            return []
+
+        # 宽表：为新出现的因子自动添加列
+        if self.table_layout == "wide":
+            sync_wide_columns(db, self.target_table, factor_list)
+
+        batch_size = batch_size or self.batch_sizer.size
+        missing_stocks = sum(len(stocks) for _, stocks in missing_groups)
+        if len(missing_groups) == 1 and missing_stocks == len(all_stocks) and len(missing_groups[0][0]) == len(factor_list):
+            logger.info(f"📅 开始获取 {target_date} {self.table_name} 的数据，共 {len(all_stocks)} 只股票")
+        else:
+            logger.info(f"🩹 {target_date} {self.table_name} 数据不完整，补齐 {missing_stocks}/{len(all_stocks)} 只股票的缺失因子")
+
+        batches = [(factors, stocks[i:i+batch_size])
+                   for factors, stocks in missing_groups
+                   for i in range(0, len(stocks), batch_size)]
+        return [BatchSpec(self, [target_date], stock_batch, factors, f"{self.table_name} batch {n}/{len(batches)}")
+                for n, (factors, stock_batch) in enumerate(batches, 1)]
+
+    def fetch_single_day_factors(self, db, target_date, batch_size=None, max_retries=3, batch_workers=1, pipeline=False):
+        """获取单日的因子数据，只请求覆盖索引中缺失的股票和因子，batch_workers>1 时并发获取多个股票批次"""
+        try:
+            all_stocks = get_universe().active(target_date)
+            specs = self.day_batches(db, target_date, all_stocks, batch_size)
+            if not specs:
+                self.commit_dates(db, [target_date])
+                return True
+
+            total_inserted = run_batch_specs(db, specs, batch_workers, max_retries, pipeline)
+            self.commit_dates(db, [target_date])
+
+            logger.info(f"🎉 {target_date} {self.table_name} 数据获取完成，共插入 {total_inserted} 行数据")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ {target_date} {self.table_name} 数据获取失败: {e}")
+            return False
+
+    # ---------- 多日窗口 ----------
+    def fetch_window_factors(self, db, window_dates, batch_size=None, max_retries=3, batch_workers=1, sizer=None,
+                             pipeline=False):
+        """每个股票批次一次请求窗口内的多个交易日，只请求覆盖索引中有缺失的日期和股票，返回是否成功"""
+        window_label = f"{window_dates[0]}~{window_dates[-1]}"
+
+        try:
+            factor_list = self.get_factor_list()
+            coverage = self.get_coverage(db)
+            universe = get_universe().active_range(window_dates)
+
+            # 按日期检查覆盖情况，汇总窗口内有缺失的日期、股票和因子（进度日志中已完成的日期不再检查）
+            pending_dates, missing_stocks, missing_factors = [], set(), set()
+            for date in window_dates:
+                if self.is_done(date):
+                    continue
+                missing_groups = coverage.missing_groups(date, universe[date], factor_list)
+                if missing_groups:
+                    pending_dates.append(date)
+                    for factors, stocks in missing_groups:
+                        missing_factors.update(factors)
+                        missing_stocks.update(stocks)
+            if not pending_dates:
+                self.commit_dates(db, window_dates)
+                logger.info(f"📅 {window_label} {self.table_name} 数据已存在，跳过")
+                return True
+            all_stocks = sorted(missing_stocks)
+            factor_list = [factor for factor in factor_list if factor in missing_factors]
+
+            # 宽表：为新出现的因子自动添加列
+            if self.table_layout == "wide":
+                sync_wide_columns(db, self.target_table, factor_list)
+
+            logger.info(f"📅 开始获取 {window_label} {self.table_name} 的数据，"
+                        f"共 {len(pending_dates)} 个交易日、{len(all_stocks)} 只股票")
+
+            batch_size = batch_size or self.batch_sizer.size
+            batch_total = (len(all_stocks) + batch_size - 1) // batch_size
+            specs = [BatchSpec(self, pending_dates, all_stocks[i:i+batch_size], factor_list,
+                               f"{self.table_name} batch {i//batch_size+1}/{batch_total}", sizer)
+                     for i in range(0, len(all_stocks), batch_size)]
+
+            total_inserted = run_batch_specs(db, specs, batch_workers, max_retries, pipeline)
+            self.commit_dates(db, window_dates)
+
+            logger.info(f"🎉 {window_label} {self.table_name} 数据获取完成，共插入 {total_inserted} 行数据")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ {window_label} {self.table_name} 数据获取失败: {e}")
+            return False
+
+    def fetch_factor_windows(self, db, trading_dates, window_size, batch_size=None, batch_workers=1, pipeline=False):
+        """按窗口顺序处理交易日，窗口大小随响应大小自动调整，返回 (成功天数, 失败日期列表)"""
+        sizer = WindowSizer(window_size, self.max_window_cells)
+        total = len(trading_dates)
+        success_count = 0
+        failed_dates = []
+
+        pos = 0
+        while pos < total:
+            window = trading_dates[pos:pos + sizer.size]
+            ok = self.fetch_window_factors(db, window, batch_size, batch_workers=batch_workers, sizer=sizer,
+                                           pipeline=pipeline)
+            for date in window:
+                pos += 1
+                if ok:
+                    success_count += 1
+                else:
+                    failed_dates.append(date)
+                logger.info(f"📈 进度: {pos}/{total} - 完成日期: {date}")
+
+        return success_count, failed_dates
+
+    # ---------- 日期轮询 ----------
+    def fetch_and_insert_factors(self, db, start_date, end_date, batch_size=None, workers=1, batch_workers=1, window_size=1,
+                                 pipeline=False, reingest=False):
+        """
+        单个因子类型的数据获取，支持日期轮询
+
+        Args:
+            workers (int): 同时处理的交易日数量，1 为逐日顺序处理
+            batch_workers (int): 每个交易日内同时获取的股票批次数量
+            batch_size (int): 每批股票数量，None 时根据请求耗时和响应大小自动调整，并在多次运行之间保留
+            window_size (int): 每次 get_factor 请求包含的交易日数量，大于 1 时启用多日窗口模式
+            pipeline (bool): 获取、转换、写入分阶段并行，下一批次的请求与上一批次的写入重叠进行，
+                逐日模式下所有交易日共用一条流水线（此时 workers 不生效）
+            reingest (bool): 先清除日期范围内的已有数据再重新入库
+        """
+        logger.info(f"🚀 开始获取因子数据 {self.table_name}，时间范围: {start_date} 到 {end_date}")
+
+        self.prepare_table(db, start_date, end_date)
+        if reingest:
+            self.truncate(db, start_date, end_date)
+
+        # 获取所有交易日
+        trading_dates = get_date_range(start_date, end_date)
+        logger.info(f"📊 共需处理 {len(trading_dates)} 个交易日")
+
+        # 按进度日志跳过已完成的交易日并恢复已提交的批次，日志未覆盖的日期一次扫描建立覆盖索引
+        self.resume(db, trading_dates)
+
+        if window_size > 1:
+            success_count, failed_dates = self.fetch_factor_windows(
+                db, trading_dates, window_size, batch_size, batch_workers=batch_workers, pipeline=pipeline
+            )
+        elif pipeline:
+            success_count, failed_dates = run_days_pipeline(db, [self], trading_dates, batch_size, batch_workers)
+        else:
+            success_count, failed_dates = run_trading_days(
+                trading_dates,
+                lambda date: self.fetch_single_day_factors(db, date, batch_size, batch_workers=batch_workers),
+                workers=workers,
+                logger=logger
+            )
+
+        # 输出最终统计
+        logger.info(f"🏁 数据获取完成！成功: {success_count}/{len(trading_dates)} 天")
+        if failed_dates:
+            logger.warning(f"⚠️ 失败的日期: {failed_dates}")
+
+        return success_count, failed_dates
+
+    def retry_failed_dates(self, db, failed_dates, batch_size=None):
+        """重新获取失败的日期数据"""
+        if not failed_dates:
+            return
+
+        logger.info(f"🔄 开始重新获取失败的日期: {failed_dates}")
+
+        for date in failed_dates:
+            logger.info(f"🔄 重新获取 {date}")
+            if self.fetch_single_day_factors(db, date, batch_size):
+                logger.info(f"✅ {date} 重新获取成功")
+            else:
+                logger.error(f"❌ {date} 重新获取仍然失败")
+
+# ============== 批次与流水线 ==============
+class BatchSpec:
+    """一个待请求的批次：所属任务、交易日、股票和因子"""
+
+    def __init__(self, job, window_dates, stock_batch, factor_list, batch_info, sizer=None):
+        self.job = job
+        self.window_dates = window_dates
+        self.stock_batch = stock_batch
+        self.factor_list = factor_list
+        self.batch_info = batch_info
+        self.sizer = sizer
+        self.answered = set()       # 接口返回了数据的交易日
+
+    @property
+    def date(self):
+        """批次所属的交易日（多日窗口为窗口的第一天）"""
+        return self.window_dates[0]
+
+    def fetch(self, max_retries=3):
+        fetched = self.job.fetch_batch(self.window_dates, self.stock_batch, self.factor_list,
+                                       self.batch_info, max_retries, self.sizer)
+        for window_dates, df in fetched:
+            if len(window_dates) == 1:
+                self.answered.add(window_dates[0])
+            else:
+                self.answered.update(pd.DatetimeIndex(df.index.get_level_values("date")).strftime("%Y-%m-%d"))
+        return fetched
+
+    def commit(self, db, rows):
+        """
+        批次获取和写入都已成功，记入进度日志
+
+        接口返回了数据的交易日记入日志，其中没有返回数据的股票（停牌、新上市等）视为确认为空，
+        同时记入覆盖索引，不再重复请求；整日没有返回数据的交易日（数据尚未发布）不记录，下次运行重新请求
+        """
+        dates = [d for d in self.window_dates if d in self.answered]
+        if len(dates) < len(self.window_dates):
+            logger.warning(f"⚠️ {self.date} {self.batch_info} {len(self.window_dates) - len(dates)} "
+                           f"个交易日没有返回数据，这些日期不记入进度日志")
+        coverage = self.job.get_coverage(db)
+        for date in dates:
+            coverage.add_cells(date, self.stock_batch, self.factor_list)
+        if dates:
+            get_journal().commit_batch(self.job.journal_job(db), dates, self.stock_batch, self.factor_list, rows)
+
+    def run(self, db, max_retries=3):
+        """顺序执行获取、转换、写入，返回插入行数"""
+        fetched = self.fetch(max_retries)
+        rows = self.job.write_batch(db, self.job.transform_batch(db, fetched, self.batch_info), max_retries)
+        self.commit(db, rows)
+        return rows
+
+def build_batch_pipeline(db, fetch_workers=1, max_retries=3, on_done=None, name="factor_pipeline"):
+    """
+    创建 获取 → 转换 → 写入 三阶段流水线，输入为 BatchSpec，输出为 (BatchSpec, 插入行数)
+
+    Args:
+        on_done (callable): on_done(spec, rows, ok)，批次写入完成或在任一阶段失败时调用
+    """
+    def guard(func):
+        def wrapper(item):
+            spec = item[0] if isinstance(item, tuple) else item
+            try:
+                return func(item)
+            except Exception as e:
+                logger.error(f"❌ {spec.date} {spec.batch_info} 处理失败: {e}")
+                if on_done is not None:
+                    on_done(spec, 0, False)
+                return None
+        return wrapper
+
+    def fetch(spec):
+        return spec, spec.fetch(max_retries)
+
+    def transform(item):
+        spec, fetched = item
+        return spec, spec.job.transform_batch(db, fetched, spec.batch_info)
+
+    def write(item):
+        spec, prepared = item
+        rows = spec.job.write_batch(db, prepared, max_retries)
+        spec.commit(db, rows)
+        if on_done is not None:
+            on_done(spec, rows, True)
+        return spec, rows
+
+    stages = [
+        Stage("fetch", guard(fetch), workers=fetch_workers,
+              count=lambda out: sum(len(df) for _, df in out[1])),
+        Stage("transform", guard(transform), workers=TRANSFORM_WORKERS,
+              count=lambda out: sum(len(frame) for _, frame in out[1])),
+        Stage("write", guard(write), workers=WRITE_WORKERS, count=lambda out: out[1]),
+    ]
+    return Pipeline(stages, queue_size=PIPELINE_QUEUE_SIZE, name=name)
+
+def run_batch_specs(db, specs, batch_workers=1, max_retries=3, pipeline=False):
+    """执行一组批次，返回插入行数；pipeline=True 时获取、转换、写入分阶段并行。有批次失败时抛出 BatchFailed"""
+    if pipeline:
+        failed = []
+
+        def on_done(spec, rows, ok):
+            if not ok:
+                failed.append(spec)
+
+        results = build_batch_pipeline(db, batch_workers, max_retries, on_done).run(specs)
+        if failed:
+            raise BatchFailed(f"{len(failed)}/{len(specs)} 个批次处理失败")
+        return sum(rows for _, rows in results)
+    tasks = [lambda spec=spec: spec.run(db, max_retries) for spec in specs]
+    return sum(run_batches(tasks, batch_workers))
+
+def run_days_pipeline(db, jobs, trading_dates, batch_size=None, fetch_workers=1, max_retries=3):
+    """
+    所有交易日共用一条流水线：按日期顺序逐日生成批次，前一日的写入与后一日的请求重叠进行
+
+    Returns:
+        tuple: (成功天数, 失败日期列表)
+    """
+    total = len(trading_dates)
+    lock = threading.Lock()
+    pending = {}        # 日期 -> 尚未完成的批次数
+    inserted = {}       # 日期 -> 插入行数
+    failed = set()
+    finished = []
+
+    def finish(date):
+        # 调用方持有锁
+        finished.append(date)
+        if date in failed:
+            logger.error(f"❌ {date} 部分批次处理失败")
+        else:
+            for job in jobs:
+                job.commit_dates(db, [date])
+            logger.info(f"🎉 {date} 数据获取完成，共插入 {inserted.get(date, 0)} 行数据")
+        logger.info(f"📈 进度: {len(finished)}/{total} - 完成日期: {date}")
+
+    def on_done(spec, rows, ok):
+        with lock:
+            inserted[spec.date] = inserted.get(spec.date, 0) + rows
+            if not ok:
+                failed.add(spec.date)
+            pending[spec.date] -= 1
+            if pending[spec.date] == 0:
+                finish(spec.date)
+
+    def generate():
+        for date in trading_dates:
+            try:
+                all_stocks = get_universe().active(date)
+                specs = []
+                for job in jobs:
+                    specs.extend(job.day_batches(db, date, all_stocks, batch_size))
+            except Exception as e:
+                logger.error(f"❌ {date} 数据获取失败: {e}")
+                with lock:
+                    failed.add(date)
+                    finish(date)
+                continue
+
+            with lock:
+                pending[date] = len(specs)
+                if not specs:
+                    finish(date)
+            yield from specs
+
+    build_batch_pipeline(db, fetch_workers, max_retries, on_done).run(generate())
+
+    failed_dates = sorted(failed)
+    return total - len(failed_dates), failed_dates
+
+def build_jobs(configs=None, **options):
+    """根据配置列表创建任务（None 为全部任务），options 为所有任务共用的 FactorJob 参数"""
+    return [FactorJob(**config, **options) for config in (FACTOR_JOBS if configs is None else configs)]
+
+# ============== 函数：单日处理所有因子类型 ==============
+def fetch_day_all_factors(db, jobs, target_date, batch_size=None, max_retries=3, batch_workers=1, pipeline=False):
+    """同一交易日的股票池只计算一次，所有因子类型的缺失批次放入同一个线程池并发获取"""
+    try:
+        all_stocks = get_universe().active(target_date)
+        specs = []
+        for job in jobs:
+            specs.extend(job.day_batches(db, target_date, all_stocks, batch_size))
+        if not specs:
+            for job in jobs:
+                job.commit_dates(db, [target_date])
+            return True
+
+        logger.info(f"📅 {target_date} 共 {len(specs)} 个批次待获取，{len(all_stocks)} 只股票")
+        total_inserted = run_batch_specs(db, specs, batch_workers, max_retries, pipeline)
+        for job in jobs:
+            job.commit_dates(db, [target_date])
+
+        logger.info(f"🎉 {target_date} 所有因子类型获取完成，共插入 {total_inserted} 行数据")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ {target_date} 数据获取失败: {e}")
+        return False
+
+# ============== 函数：统一入库引擎 ==============
+def run_factor_jobs(db, jobs, start_date, end_date, batch_size=None, workers=1, batch_workers=4, pipeline=False,
+                    reingest=False):
+    """
+    一次运行多个因子类型：交易日历、股票池只计算一次，各因子类型的批次并发获取并写入各自的表
+
+    Args:
+        jobs (list): FactorJob 列表
+        batch_size (int): 每批股票数量，None 时各因子类型分别自适应调整
+        workers (int): 同时处理的交易日数量
+        batch_workers (int): 每个交易日内同时获取的批次数量（跨因子类型共享）
+        pipeline (bool): 所有交易日、所有因子类型共用一条获取→转换→写入流水线（此时 workers 不生效）
+        reingest (bool): 先清除各表日期范围内的已有数据再重新入库
+
+    Returns:
+        tuple: (成功天数, 失败日期列表)
+    """
+    logger.info(f"🚀 开始获取 {len(jobs)} 个因子类型，时间范围: {start_date} 到 {end_date}")
+
+    trading_dates = get_date_range(start_date, end_date)
+    logger.info(f"📊 共需处理 {len(trading_dates)} 个交易日")
+
+    for job in jobs:
+        job.prepare_table(db, start_date, end_date)
+        if reingest:
+            job.truncate(db, start_date, end_date)
+        job.resume(db, trading_dates)
+
+    if pipeline:
+        success_count, failed_dates = run_days_pipeline(db, jobs, trading_dates, batch_size, batch_workers)
+    else:
+        success_count, failed_dates = run_trading_days(
+            trading_dates,
+            lambda date: fetch_day_all_factors(db, jobs, date, batch_size, batch_workers=batch_workers),
+            workers=workers,
+            logger=logger
+        )
+
+    logger.info(f"🏁 数据获取完成！成功: {success_count}/{len(trading_dates)} 天")
+    if failed_dates:
+        logger.warning(f"⚠️ 失败的日期: {failed_dates}")
+    rq_api.log_usage(logger)
+
+    return success_count, failed_dates
+
+# ============== 主程序 ==============
+if __name__ == "__main__":
+    today = datetime.today().strftime("%Y-%m-%d")
+    parser = argparse.ArgumentParser(description='因子数据统一入库程序，一次运行所有因子类型')
+    parser.add_argument('--start-date', type=str, default=today, help='开始日期 (YYYY-MM-DD)，默认为今天')
+    parser.add_argument('--end-date', type=str, default=today, help='结束日期 (YYYY-MM-DD)，默认为今天')
+    parser.add_argument('--jobs', type=str, nargs='*',
+                        help='只运行指定的表，例如: --jobs factor_MAI factor_obos，默认运行全部')
+    parser.add_argument('--batch-size', type=int, default=None, help='每批股票数量，默认自适应调整')
+    parser.add_argument('--workers', type=int, default=1, help='同时处理的交易日数量，默认 1')
+    parser.add_argument('--batch-workers', type=int, default=4, help='每个交易日同时获取的批次数量')
+    parser.add_argument('--pipeline', action='store_true', help='获取、转换、写入分阶段并行执行')
+    parser.add_argument('--reingest', action='store_true', help='先清空日期范围内的已有数据（按分区）再重新入库')
+    args = parser.parse_args()
+
+    known = [c["table_name"] for c in FACTOR_JOBS]
+    unknown = [name for name in args.jobs or [] if name not in known]
+    if unknown:
+        parser.error(f"未知的表: {', '.join(unknown)}，可选: {', '.join(known)}")
+    configs = [c for c in FACTOR_JOBS if not args.jobs or c["table_name"] in args.jobs]
+
+    setup_logging()
+    rqdatac.init()
+    db = DataBase_Position()
+
+    try:
+        with metrics.run_metrics("factor_engine"):
+            run_factor_jobs(db, build_jobs(configs), args.start_date, args.end_date, batch_size=args.batch_size,
+                            workers=args.workers, batch_workers=args.batch_workers, pipeline=args.pipeline,
+                            reingest=args.reingest)
+    finally:
+        db.close()
+        print("📝 数据库连接已关闭")
@@ -0,0 +1,224 @@
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text, bindparam
+from factor_engine import FACTOR_JOBS
+from factor_schema import WIDE_KEY_COLUMNS, get_dictionary
+from database import DataBase_Position, stream_rows
+
+# 默认每次查询的自然日数量和每次从游标取回的行数
+CHUNK_DAYS = 30
+FETCH_SIZE = 100000
+
+# (连接串, 表名列表) -> {因子名: (表名, 表结构)} 的缓存
+_factor_tables = {}
+_factor_tables_lock = threading.Lock()
+
+# ============== 因子面板 ==============
+class FactorPanel:
+    """稠密的因子面板：values[交易日, 股票, 因子]，没有数据的单元为 NaN"""
+
+    def __init__(self, dates, stocks, factors, values):
+        self.dates = dates          # datetime64[D] 数组
+        self.stocks = stocks        # order_book_id 列表
+        self.factors = factors      # 因子名列表
+        self.values = values
+
+    def __len__(self):
+        return len(self.dates)
+
+    def to_frame(self, dropna=True):
+        """转换为宽表 DataFrame：index 为 (date, order_book_id)，每个因子一列"""
+        index = pd.MultiIndex.from_product([pd.DatetimeIndex(self.dates), self.stocks],
+                                           names=["date", "order_book_id"])
+        df = pd.DataFrame(self.values.reshape(-1, len(self.factors)), index=index, columns=self.factors)
+        return df.dropna(how="all") if dropna else df
+
+# ============== 函数：定位因子所在的表 ==============
+def _table_factors(db, table_name):
+    """返回 (表结构, 该表包含的因子名集合)，表不存在时返回 None"""
+    inspector = inspect(db.engine)
+    wide_table = f"{table_name}_wide"
+    if inspector.has_table(wide_table):
+        columns = {col["name"] for col in inspector.get_columns(wide_table)}
+        return wide_table, "wide", columns - set(WIDE_KEY_COLUMNS) - {"update_time"}
+    encoded_table = f"{table_name}_enc"
+    if inspector.has_table(encoded_table):
+        ids = pd.read_sql(
+            f"SELECT DISTINCT factor_id FROM {encoded_table} "
+            f"WHERE date = (SELECT MAX(date) FROM {encoded_table})",
+            con=db.engine
+        )["factor_id"]
+        return encoded_table, "encoded", set(get_dictionary(db, "factor").decode(ids))
+    if inspector.has_table(table_name):
+        # 取最近一个交易日的因子名，(date, factor_name) 索引下只需扫描一天
+        names = pd.read_sql(
+            f"SELECT DISTINCT factor_name FROM {table_name} "
+            f"WHERE date = (SELECT MAX(date) FROM {table_name})",
+            con=db.engine
+        )["factor_name"]
+        return table_name, "long", set(names)
+    return None
+
+def resolve_factor_tables(db, factor_names, table_names=None):
+    """
+    找出每个因子所在的表
+
+    Returns:
+        dict: {(表名, 表结构): [因子名]}
+    """
+    table_names = table_names or [job["table_name"] for job in FACTOR_JOBS]
+    with _factor_tables_lock:
+        # 不同数据库、不同的表范围分别缓存
+        tables = _factor_tables.setdefault((str(db.engine.url), tuple(table_names)), {})
+        missing = [name for name in factor_names if name not in tables]
+        if missing:
+            for table_name in table_names:
+                found = _table_factors(db, table_name)
+                if found is None:
+                    continue
+                target, layout, names = found
+                for name in names:
+                    tables.setdefault(name, (target, layout))
+
+        groups = {}
+        for name in factor_names:
+            if name not in tables:
+                raise KeyError(f"在 {table_names} 中找不到因子 {name}")
+            groups.setdefault(tables[name], []).append(name)
+        return groups
+
+# ============== 函数：按日期分块读取 ==============
+def _date_chunks(start_date, end_date, chunk_days):
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    while start <= end:
+        chunk_end = min(end, start + pd.Timedelta(days=chunk_days - 1))
+        yield start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")
+        start = chunk_end + pd.Timedelta(days=1)
+
+def _query(table_name, layout, factors, stocks):
+    """生成带过滤条件的 SQL，日期、因子、股票条件都在数据库端执行"""
+    conditions = ["date BETWEEN :start AND :end"]
+    params = [bindparam("start"), bindparam("end")]
+    stock_column = "order_book_id"
+    if layout == "wide":
+        columns = ", ".join(["date", "order_book_id"] + [f"`{name}`" for name in factors])
+    else:
+        if layout == "encoded":
+            # 编码表按编号过滤，结果在客户端解码，不需要与维表 JOIN
+            columns = "date, instrument_id, factor_id, factor_value"
+            conditions.append("factor_id IN :factors")
+            stock_column = "instrument_id"
+        else:
+            columns = "date, order_book_id, factor_name, factor_value"
+            conditions.append("factor_name IN :factors")
+        params.append(bindparam("factors", expanding=True))
+    if stocks is not None:
+        conditions.append(f"{stock_column} IN :stocks")
+        params.append(bindparam("stocks", expanding=True))
+    sql = text(f"SELECT {columns} FROM {table_name} WHERE {' AND '.join(conditions)}")
+    return sql.bindparams(*params)
+
+def iter_factor_panel(factor_names, start_date, end_date, stocks=None, db=None, table_names=None,
+                      chunk_days=CHUNK_DAYS, fetch_size=FETCH_SIZE):
+    """
+    按日期分块生成 FactorPanel，适合内存放不下整个区间时逐块处理
+
+    每块只包含该日期范围内有数据的交易日；stocks 为 None 时股票轴为该块出现过的股票
+    """
+    db = db or DataBase_Position()
+    factor_names = list(factor_names)
+    factor_pos = {name: i for i, name in enumerate(factor_names)}
+    groups = resolve_factor_tables(db, factor_names, table_names)
+
+    # 编码表的查询参数：因子名、股票代码换成维表编号
+    if any(layout == "encoded" for _, layout in groups):
+        factor_ids = get_dictionary(db, "factor").lookup(factor_names)
+        id_pos = {factor_ids[name]: factor_pos[name] for name in factor_names if name in factor_ids}
+        if stocks is not None:
+            stock_ids = list(get_dictionary(db, "instrument").lookup(list(stocks)).values())
+
+    for chunk_start, chunk_end in _date_chunks(start_date, end_date, chunk_days):
+        # 收集各表的 (日期, 股票, 因子位置, 值)
+        parts = []
+        for (table_name, layout), factors in groups.items():
+            params = {"start": chunk_start, "end": chunk_end}
+            if layout == "long":
+                params["factors"] = factors
+            elif layout == "encoded":
+                params["factors"] = [factor_ids[name] for name in factors if name in factor_ids]
+            if stocks is not None:
+                params["stocks"] = stock_ids if layout == "encoded" else list(stocks)
+                if not params["stocks"]:
+                    continue
+            sql = _query(table_name, layout, factors, stocks)
+            for rows in stream_rows(db.engine, sql, params, fetch_size):
+                block = np.array(rows, dtype=object)
+                if layout == "wide":
+                    n = len(factors)
+                    values = block[:, 2:].astype(np.float64)
+                    parts.append((np.repeat(block[:, 0], n), np.repeat(block[:, 1], n),
+                                  np.tile([factor_pos[f] for f in factors], len(block)), values.ravel()))
+                elif layout == "encoded":
+                    codes = get_dictionary(db, "instrument").decode(block[:, 1].astype(np.int64))
+                    fpos = np.array([id_pos[int(f)] for f in block[:, 2]], dtype=np.int64)
+                    parts.append((block[:, 0], codes, fpos, block[:, 3].astype(np.float64)))
+                else:
+                    fpos = np.array([factor_pos[f] for f in block[:, 2]], dtype=np.int64)
+                    parts.append((block[:, 0], block[:, 1], fpos, block[:, 3].astype(np.float64)))
+        if not parts:
+            continue
+
+        dates = pd.to_datetime(np.concatenate([p[0] for p in parts])).to_numpy().astype("datetime64[D]")
+        codes = np.concatenate([p[1] for p in parts])
+        fpos = np.concatenate([p[2] for p in parts]).astype(np.int64)
+        values = np.concatenate([p[3] for p in parts])
+
+        # 直接写入稠密数组，不经过 pandas pivot
+        date_axis, date_idx = np.unique(dates, return_inverse=True)
+        if stocks is not None:
+            stock_axis = list(stocks)
+            stock_idx = pd.Index(stock_axis).get_indexer(codes)
+        else:
+            stock_idx, uniques = pd.factorize(codes, sort=True)
+            stock_axis = list(uniques)
+        panel = np.full((len(date_axis), len(stock_axis), len(factor_names)), np.nan)
+        panel[date_idx, stock_idx, fpos] = values
+        yield FactorPanel(date_axis, stock_axis, factor_names, panel)
+
+def load_factor_panel(factor_names, start_date, end_date, stocks=None, db=None, table_names=None,
+                      as_array=False, chunk_days=CHUNK_DAYS):
+    """
+    读取多个因子在 [start_date, end_date] 内的数据
+
+    Args:
+        factor_names (list): 因子名，可以来自不同的因子表
+        stocks (list): 只读取这些股票，None 为全部
+        as_array (bool): True 返回 FactorPanel（values[交易日, 股票, 因子]），False 返回宽表 DataFrame
+
+    Returns:
+        FactorPanel 或 DataFrame（index 为 (date, order_book_id)，每个因子一列）
+    """
+    chunks = list(iter_factor_panel(factor_names, start_date, end_date, stocks, db, table_names, chunk_days))
+    factor_names = list(factor_names)
+    if not as_array:
+        if not chunks:
+            return pd.DataFrame(columns=factor_names,
+                                index=pd.MultiIndex.from_arrays([[], []], names=["date", "order_book_id"]))
+        return pd.concat([chunk.to_frame() for chunk in chunks])
+
+    stock_axis = list(stocks) if stocks is not None else sorted({s for chunk in chunks for s in chunk.stocks})
+    if not chunks:
+        return FactorPanel(np.array([], dtype="datetime64[D]"), stock_axis, factor_names,
+                           np.empty((0, len(stock_axis), len(factor_names))))
+    # 各块的股票轴不同，按统一的股票轴拼接
+    position = pd.Index(stock_axis)
+    date_axis = np.concatenate([chunk.dates for chunk in chunks])
+    values = np.full((len(date_axis), len(stock_axis), len(factor_names)), np.nan)
+    row = 0
+    for chunk in chunks:
+        values[row:row + len(chunk), position.get_indexer(chunk.stocks)] = chunk.values
+        row += len(chunk)
+    logging.getLogger(__name__).info(f"📥 读取因子面板 {values.shape}（交易日 × 股票 × 因子）")
+    return FactorPanel(date_axis, stock_axis, factor_names, values)
@@ -0,0 +1,522 @@
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text, bindparam
+
+# 已知的宽表因子列缓存 {(连接串, 表名): set(列名)}，避免每个批次都查询表结构
+_wide_columns = {}
+_wide_lock = threading.Lock()
+
+WIDE_KEY_COLUMNS = ["order_book_id", "date"]
+
+# ============== 函数：创建宽表（如果不存在） ==============
+def create_wide_factor_table(db, table_name):
+    """创建宽表：每个 (order_book_id, date) 一行，因子列由 sync_wide_columns 按需添加"""
+    create_sql = f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        order_book_id VARCHAR(20),
+        date DATE,
+        update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (order_book_id, date)
+    );
+    """
+    with db.engine.connect() as conn:
+        conn.execute(text(create_sql))
+        conn.commit()
+
+# ============== 函数：同步宽表因子列 ==============
+def sync_wide_columns(db, table_name, factor_names):
+    """为新出现的因子添加 DOUBLE 列，返回新增的列名列表"""
+    key = (str(db.engine.url), table_name)
+    with _wide_lock:
+        if key not in _wide_columns:
+            columns = inspect(db.engine).get_columns(table_name)
+            _wide_columns[key] = {col["name"] for col in columns}
+
+        known = _wide_columns[key]
+        new_columns = [name for name in factor_names if name not in known]
+        if not new_columns:
+            return []
+
+        # 一条 ALTER 语句添加所有新列，减少表重建次数
+        add_sql = ", ".join(f"ADD COLUMN `{name}` DOUBLE NULL" for name in new_columns)
+        with db.engine.connect() as conn:
+            conn.execute(text(f"ALTER TABLE {table_name} {add_sql}"))
+            conn.commit()
+        known.update(new_columns)
+
+    logging.getLogger(__name__).info(f"🧩 {table_name} 新增因子列 {len(new_columns)} 个: {new_columns}")
+    return new_columns
+
+# ============== 函数：转换为宽表数据 ==============
+def to_wide_frame(df):
+    """将 rqdatac.get_factor 返回的数据整理为宽表格式，inf 替换为 NaN（写入后为 NULL）"""
+    df_wide = df.reset_index()
+    factor_columns = [col for col in df_wide.columns if col not in WIDE_KEY_COLUMNS]
+    values = df_wide[factor_columns].astype("float64")
+    df_wide[factor_columns] = values.where(np.isfinite(values))
+    return df_wide.dropna(subset=WIDE_KEY_COLUMNS)
+
+def to_long_frame(df):
+    """
+    将 rqdatac.get_factor 返回的数据整理为长表 (order_book_id, date, factor_name, factor_value)
+
+    直接展开值矩阵（与 melt 相同的因子优先顺序），factor_value 为 float64，
+    order_book_id 和 factor_name 为 category，不产生 object 列
+    """
+    if not isinstance(df.index, pd.MultiIndex):
+        df = df.set_index(WIDE_KEY_COLUMNS)
+    stock_level = df.index.names.index("order_book_id")
+    date_level = df.index.names.index("date")
+    stock_codes = df.index.codes[stock_level]
+    dates = df.index.levels[date_level].to_numpy().take(df.index.codes[date_level])
+    values = df.to_numpy(dtype=np.float64)
+
+    # 索引中缺失的股票或日期（编码为 -1）不写入
+    valid = (stock_codes >= 0) & (df.index.codes[date_level] >= 0)
+    if not valid.all():
+        stock_codes, dates, values = stock_codes[valid], dates[valid], values[valid]
+
+    n_rows, n_factors = values.shape
+    return pd.DataFrame({
+        "order_book_id": pd.Categorical.from_codes(np.tile(stock_codes, n_factors),
+                                                   categories=df.index.levels[stock_level]),
+        "date": np.tile(dates, n_factors),
+        "factor_name": pd.Categorical.from_codes(np.repeat(np.arange(n_factors), n_rows),
+                                                 categories=pd.Index(df.columns.astype(str))),
+        "factor_value": values.ravel(order="F"),
+    })
+
+# ============== 字典编码 ==============
+# 所有编码因子表共用的维表：股票代码和因子名映射为整数编号
+INSTRUMENT_TABLE = "factor_instrument"
+FACTOR_DICT_TABLE = "factor_dict"
+
+class Dictionary:
+    """字符串与整数编号的双向映射，对应一张 (编号, 名称) 维表，新名称写入时自动分配编号"""
+
+    def __init__(self, db, table_name, id_column, name_column, name_type="VARCHAR(50)", id_type="INT UNSIGNED"):
+        self.db = db
+        self.table_name = table_name
+        self.id_column = id_column
+        self.name_column = name_column
+        self.name_type = name_type
+        self.id_type = id_type
+        self._lock = threading.Lock()
+        self._ids = None        # 名称 -> 编号
+        self._names = {}        # 编号 -> 名称
+
+    def create(self):
+        create_sql = f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            {self.id_column} {self.id_type} NOT NULL AUTO_INCREMENT,
+            {self.name_column} {self.name_type} NOT NULL,
+            PRIMARY KEY ({self.id_column}),
+            UNIQUE KEY uk_{self.name_column} ({self.name_column})
+        );
+        """
+        with self.db.engine.connect() as conn:
+            conn.execute(text(create_sql))
+            conn.commit()
+
+    def _fetch(self, names=None):
+        # 调用方持有锁
+        sql = f"SELECT {self.id_column}, {self.name_column} FROM {self.table_name}"
+        if names is None:
+            df = pd.read_sql(sql, con=self.db.engine)
+        else:
+            sql = text(f"{sql} WHERE {self.name_column} IN :names").bindparams(bindparam("names", expanding=True))
+            with self.db.engine.connect() as conn:
+                df = pd.DataFrame(conn.execute(sql, {"names": list(names)}).fetchall(),
+                                  columns=[self.id_column, self.name_column])
+        for sid, name in zip(df[self.id_column], df[self.name_column]):
+            self._ids[name] = int(sid)
+            self._names[int(sid)] = name
+
+    def _ensure_loaded(self):
+        if self._ids is None:
+            self._ids = {}
+            self._fetch()
+
+    def encode(self, names):
+        """名称数组 -> 编号数组，未登记的名称先写入维表（INSERT IGNORE，多进程并发写入也只分配一个编号）"""
+        names = np.asarray(names, dtype=object)
+        uniques, inverse = np.unique(names, return_inverse=True)
+        with self._lock:
+            self._ensure_loaded()
+            new_names = [name for name in uniques if name not in self._ids]
+            if new_names:
+                insert_sql = text(f"INSERT IGNORE INTO {self.table_name} ({self.name_column}) VALUES (:name)")
+                with self.db.engine.begin() as conn:
+                    conn.execute(insert_sql, [{"name": name} for name in new_names])
+                self._fetch(new_names)
+            codes = np.array([self._ids[name] for name in uniques], dtype=np.int64)
+        return codes[inverse]
+
+    def lookup(self, names):
+        """只查询已登记的名称，返回 {名称: 编号}，不写入维表"""
+        with self._lock:
+            self._ensure_loaded()
+            missing = [name for name in names if name not in self._ids]
+            if missing:
+                self._fetch(missing)
+            return {name: self._ids[name] for name in names if name in self._ids}
+
+    def decode(self, ids):
+        """编号数组 -> 名称数组"""
+        ids = np.asarray(ids, dtype=np.int64)
+        uniques, inverse = np.unique(ids, return_inverse=True)
+        with self._lock:
+            self._ensure_loaded()
+            unknown = [int(i) for i in uniques if int(i) not in self._names]
+            if unknown:
+                # 其他进程新登记的编号
+                self._fetch_ids(unknown)
+            names = np.array([self._names.get(int(i)) for i in uniques], dtype=object)
+        return names[inverse]
+
+    def _fetch_ids(self, ids):
+        sql = text(f"SELECT {self.id_column}, {self.name_column} FROM {self.table_name} "
+                   f"WHERE {self.id_column} IN :ids").bindparams(bindparam("ids", expanding=True))
+        with self.db.engine.connect() as conn:
+            for sid, name in conn.execute(sql, {"ids": ids}).fetchall():
+                self._ids[name] = int(sid)
+                self._names[int(sid)] = name
+
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+def get_dictionary(db, kind):
+    """返回进程内共享的维表映射（每个数据库一份），kind 为 "instrument" 或 "factor"""
+    key = (str(db.engine.url), kind)
+    with _dictionaries_lock:
+        if key not in _dictionaries:
+            if kind == "instrument":
+                _dictionaries[key] = Dictionary(db, INSTRUMENT_TABLE, "instrument_id", "order_book_id",
+                                                 "VARCHAR(20)", "MEDIUMINT UNSIGNED")
+            elif kind == "factor":
+                _dictionaries[key] = Dictionary(db, FACTOR_DICT_TABLE, "factor_id", "factor_name",
+                                                 "VARCHAR(50)", "SMALLINT UNSIGNED")
+            else:
+                raise ValueError(f"未知的维表类型: {kind}")
+        return _dictionaries[key]
+
+# ============== 函数：创建编码表（如果不存在） ==============
+def create_encoded_factor_table(db, table_name, value_dtype="float64"):
+    """
+    创建编码长表：(instrument_id, date, factor_id, factor_value)
+
+    主键为 3 + 3 + 2 字节的整数，远小于 VARCHAR 主键；value_dtype="float32" 时因子值为 4 字节 FLOAT
+    """
+    for kind in ("instrument", "factor"):
+        get_dictionary(db, kind).create()
+    value_type = "FLOAT" if value_dtype == "float32" else "DOUBLE"
+    create_sql = f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        instrument_id MEDIUMINT UNSIGNED NOT NULL,
+        date DATE NOT NULL,
+        factor_id SMALLINT UNSIGNED NOT NULL,
+        factor_value {value_type},
+        PRIMARY KEY (instrument_id, date, factor_id)
+    );
+    """
+    with db.engine.connect() as conn:
+        conn.execute(text(create_sql))
+        conn.commit()
+
+# ============== 函数：编码 / 解码长表数据 ==============
+def encode_factor_frame(db, df_long, value_dtype="float64"):
+    """长表 (order_book_id, date, factor_name, factor_value) -> 编码表的列"""
+    return pd.DataFrame({
+        "instrument_id": get_dictionary(db, "instrument").encode(df_long["order_book_id"].to_numpy()),
+        "date": df_long["date"].to_numpy(),
+        "factor_id": get_dictionary(db, "factor").encode(df_long["factor_name"].to_numpy()),
+        "factor_value": df_long["factor_value"].to_numpy(dtype=value_dtype, na_value=np.nan),
+    })
+
+def decode_factor_frame(db, df_encoded):
+    """编码表的行 -> 长表 (order_book_id, date, factor_name, factor_value)"""
+    return pd.DataFrame({
+        "order_book_id": get_dictionary(db, "instrument").decode(df_encoded["instrument_id"].to_numpy()),
+        "date": df_encoded["date"].to_numpy(),
+        "factor_name": get_dictionary(db, "factor").decode(df_encoded["factor_id"].to_numpy()),
+        "factor_value": df_encoded["factor_value"].to_numpy(),
+    })
+
+# ============== 分区与索引管理 ==============
+# 按日期 RANGE COLUMNS 分区（仅 MySQL），最后一个分区 p_future 接收尚未建分区的日期，新日期到来时从中拆出。
+# 新建的表建表后直接分区；已有的未分区表通过 migrate.py 分区
+FUTURE_PARTITION = "p_future"
+
+# 已知的各表分区覆盖范围 {(连接串, 表名): (第一个周期的起始日期, 上界)}，避免每次写入都查询 information_schema
+_partition_range = {}
+_partition_lock = threading.Lock()
+
+def _is_mysql(db):
+    return db.engine.dialect.name == "mysql"
+
+def _period_starts(start, end, granularity):
+    """覆盖 [start, end] 的每个分区周期的第一天，granularity 为 "month" 或 "year" """
+    freq = "M" if granularity == "month" else "Y"
+    first = pd.Timestamp(start).to_period(freq).start_time
+    return list(pd.date_range(first, pd.Timestamp(end), freq="MS" if granularity == "month" else "YS"))
+
+def _next_period(ts, granularity):
+    return ts + (pd.DateOffset(months=1) if granularity == "month" else pd.DateOffset(years=1))
+
+def _prev_period(ts, granularity):
+    return ts - (pd.DateOffset(months=1) if granularity == "month" else pd.DateOffset(years=1))
+
+def _partition_clauses(starts, granularity, date_format):
+    clauses = []
+    for ts in starts:
+        name = f"p{ts:%Y%m}" if granularity == "month" else f"p{ts:%Y}"
+        bound = _next_period(ts, granularity).strftime(date_format)
+        clauses.append(f"PARTITION {name} VALUES LESS THAN ('{bound}')")
+    return clauses
+
+def get_partitions(db, table_name):
+    """返回 [(分区名, 上界)]，上界为 Timestamp，MAXVALUE 为 None；未分区时返回空列表"""
+    sql = text("""
+    SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+    ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    with db.engine.connect() as conn:
+        rows = conn.execute(sql, {"table": table_name}).fetchall()
+    partitions = []
+    for name, description in rows:
+        bound = None if description == "MAXVALUE" else pd.Timestamp(description.strip("'"))
+        partitions.append((name, bound))
+    return partitions
+
+def ensure_partitions(db, table_name, start_date, end_date, granularity="month", date_format="%Y-%m-%d"):
+    """
+    保证已分区的表按周期覆盖 [start_date, end_date]：较新的日期从 p_future 拆出新的周期，
+    早于第一个周期的日期从第一个分区拆出更早的周期（历史回补），分区上界覆盖到 end_date 所在周期的下一个周期
+
+    只做 REORGANIZE PARTITION（只重写 p_future 或第一个分区中的数据）；未分区的表不会自动分区
+    （ALTER TABLE ... PARTITION BY 会重建整张表），只提示一次，需要时通过 migrate.py 显式执行。
+    非 MySQL 数据库直接返回。
+    """
+    if not _is_mysql(db) or granularity is None:
+        return
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    key = (str(db.engine.url), table_name)
+    logger = logging.getLogger(__name__)
+    with _partition_lock:
+        lower, upper = _partition_range.get(key, (None, None))
+        if upper is not None and lower <= start and end < upper:
+            return
+        try:
+            partitions = get_partitions(db, table_name)
+            if not partitions:
+                logger.warning(f"⚠️ {table_name} 未分区，不做分区维护；需要分区时运行 "
+                               f"python migrate.py --tables {table_name} --steps partition")
+                _partition_range[key] = (pd.Timestamp.min, pd.Timestamp.max)
+                return
+            lower = _prepend_partitions(db, table_name, partitions, start, granularity, date_format)
+            upper = _extend_partitions(db, table_name, partitions, end, granularity, date_format)
+            _partition_range[key] = (lower, upper)
+        except Exception as e:
+            # 日期仍会写入第一个分区或 p_future，本进程内不再重试
+            logger.error(f"❌ {table_name} 拆分分区失败，超出已有周期的数据将留在第一个分区或 {FUTURE_PARTITION} 中: {e}")
+            _partition_range[key] = (pd.Timestamp.min, pd.Timestamp.max)
+
+def _prepend_partitions(db, table_name, partitions, start, granularity, date_format):
+    """从第一个分区拆出覆盖到 start 的更早周期，返回第一个周期的起始日期（调用方持有 _partition_lock）"""
+    first_name, first_bound = partitions[0]
+    if first_bound is None:
+        raise ValueError(f"第一个分区 {first_name} 为 MAXVALUE，无法按周期拆分")
+    lower = _prev_period(first_bound, granularity)
+    if start >= lower:
+        return lower
+
+    # 新的最后一个周期即原第一个分区的周期，沿用原分区名
+    starts = _period_starts(start, lower, granularity)
+    clauses = _partition_clauses(starts, granularity, date_format)
+    with db.engine.connect() as conn:
+        conn.execute(text(f"ALTER TABLE {table_name} REORGANIZE PARTITION {first_name} "
+                          f"INTO ({', '.join(clauses)})"))
+        conn.commit()
+    logging.getLogger(__name__).info(f"🧱 {table_name} 新增 {len(clauses) - 1} 个早期分区")
+    return starts[0]
+
+def _extend_partitions(db, table_name, partitions, end, granularity, date_format):
+    """从 p_future 拆出覆盖到 end 的分区，返回分区覆盖的上界（调用方持有 _partition_lock）"""
+    if partitions[-1][0] != FUTURE_PARTITION or partitions[-1][1] is not None:
+        raise ValueError(f"最后一个分区不是 {FUTURE_PARTITION} (MAXVALUE)，无法自动拆分")
+    bounds = [bound for _, bound in partitions if bound is not None]
+    upper = max(bounds) if bounds else None
+    if upper is not None and end < upper:
+        return upper
+
+    starts = _period_starts(upper if upper is not None else end, _next_period(end, granularity), granularity)
+    starts = [ts for ts in starts if upper is None or ts >= upper]
+    clauses = _partition_clauses(starts, granularity, date_format)
+    clauses.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    with db.engine.connect() as conn:
+        conn.execute(text(f"ALTER TABLE {table_name} REORGANIZE PARTITION {FUTURE_PARTITION} "
+                          f"INTO ({', '.join(clauses)})"))
+        conn.commit()
+    logging.getLogger(__name__).info(f"🧱 {table_name} 新增 {len(clauses) - 1} 个分区")
+    return _next_period(starts[-1], granularity)
+
+# ============== 迁移：分区与索引（会重建整张表，由 migrate.py 显式执行） ==============
+def _column_type(db, table_name, column):
+    sql = text("""
+    SELECT DATA_TYPE FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """)
+    with db.engine.connect() as conn:
+        row = conn.execute(sql, {"table": table_name, "column": column}).fetchone()
+    return row[0].lower() if row else None
+
+def check_partitionable(db, table_name):
+    """
+    检查表能否按 date 做 RANGE COLUMNS 分区，不能时抛出 ValueError
+
+    MySQL 要求主键和所有唯一索引都包含分区列，且分区列不能是 TEXT / BLOB
+    """
+    inspector = inspect(db.engine)
+    primary_key = inspector.get_pk_constraint(table_name).get("constrained_columns") or []
+    if not primary_key:
+        raise ValueError(f"{table_name} 没有主键，请先运行 python migrate.py --tables {table_name} --steps primary_key")
+    if "date" not in primary_key:
+        raise ValueError(f"{table_name} 的主键 ({', '.join(primary_key)}) 不包含 date，不能按日期分区")
+    for index in inspector.get_indexes(table_name):
+        if index.get("unique") and "date" not in index["column_names"]:
+            raise ValueError(f"{table_name} 的唯一索引 {index['name']} 不包含 date，不能按日期分区")
+    column_type = _column_type(db, table_name, "date")
+    if column_type is None:
+        raise ValueError(f"{table_name} 没有 date 列")
+    if "text" in column_type or "blob" in column_type:
+        raise ValueError(f"{table_name}.date 为 {column_type.upper()}，不能作为分区列，需先改为 DATE 或 VARCHAR")
+
+def partition_table(db, table_name, granularity="month", date_format="%Y-%m-%d", start_date=None, end_date=None):
+    """
+    将未分区的表按日期 RANGE COLUMNS 分区，另加 p_future
+
+    分区从表中最早的日期和 start_date 中较早者（都没有时为当前日期）开始，
+    到表中最晚的日期、end_date 和当前日期中最晚者的下一个周期
+
+    ALTER 会重建整张表；已分区时直接返回 False。
+
+    Raises:
+        ValueError: 非 MySQL，或表结构不能分区（见 check_partitionable）
+    """
+    if not _is_mysql(db):
+        raise ValueError(f"{table_name}: 只支持为 MySQL 表分区")
+    logger = logging.getLogger(__name__)
+    if get_partitions(db, table_name):
+        logger.info(f"{table_name} 已分区")
+        return False
+    check_partitionable(db, table_name)
+
+    bounds = pd.read_sql(f"SELECT MIN(date) AS first_date, MAX(date) AS last_date FROM {table_name}", con=db.engine)
+    today = pd.Timestamp.today().normalize()
+    first, last = bounds["first_date"][0], bounds["last_date"][0]
+    candidates = [pd.Timestamp(str(first))] if first is not None and not pd.isna(first) else []
+    if start_date is not None:
+        candidates.append(pd.Timestamp(start_date))
+    start = min(candidates) if candidates else today
+    end = max([today, pd.Timestamp(end_date) if end_date is not None else today]
+              + ([pd.Timestamp(str(last))] if last is not None and not pd.isna(last) else []))
+    starts = _period_starts(start, _next_period(end, granularity), granularity)
+    clauses = _partition_clauses(starts, granularity, date_format)
+    clauses.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    logger.info(f"🧱 {table_name} 按{'月' if granularity == 'month' else '年'}分区，共 {len(clauses)} 个分区（重建表）")
+    with db.engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table_name} PARTITION BY RANGE COLUMNS(date) ({', '.join(clauses)})"))
+    with _partition_lock:
+        _partition_range[(str(db.engine.url), table_name)] = (starts[0], _next_period(starts[-1], granularity))
+    return True
+
+def add_index(db, table_name, index_name, columns):
+    """
+    添加二级索引（仅 MySQL，会重建整张表），已存在时返回 False，失败时抛出异常
+    """
+    if not _is_mysql(db):
+        raise ValueError(f"{table_name}: 只支持为 MySQL 表添加索引")
+    logger = logging.getLogger(__name__)
+    if any(index["name"] == index_name for index in inspect(db.engine).get_indexes(table_name)):
+        logger.info(f"{table_name} 已有索引 {index_name}")
+        return False
+    with db.engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table_name} ADD INDEX {index_name} ({', '.join(columns)})"))
+    logger.info(f"🗂️ {table_name} 新增索引 {index_name} ({', '.join(columns)})")
+    return True
+
+def setup_new_table(db, table_name, granularity=None, date_format="%Y-%m-%d", indexes=(), start_date=None, end_date=None):
+    """
+    刚创建的空表直接分区并建立二级索引（空表不涉及数据重建），非 MySQL 数据库直接返回
+
+    分区从本次入库的 start_date 开始，历史回补的数据落在各自的周期分区中
+    """
+    if not _is_mysql(db):
+        return
+    if granularity is not None:
+        partition_table(db, table_name, granularity, date_format, start_date, end_date)
+    for index_name, columns in indexes:
+        add_index(db, table_name, index_name, columns)
+
+def add_primary_key(db, table_name, columns, column_types=None):
+    """
+    为没有主键的旧表添加主键（仅 MySQL，会重建整张表，由 migrate.py 显式执行）
+
+    Args:
+        columns (list): 主键列
+        column_types (dict): 需要改为定长类型的列，例如 TEXT 列不能作为主键，需改为 VARCHAR
+
+    Raises:
+        ValueError: 已有不同的主键，或表中存在重复的主键值
+    """
+    logger = logging.getLogger(__name__)
+    existing = inspect(db.engine).get_pk_constraint(table_name).get("constrained_columns") or []
+    if existing:
+        if list(existing) != list(columns):
+            raise ValueError(f"{table_name} 已有主键 ({', '.join(existing)})，与期望的 ({', '.join(columns)}) 不同")
+        logger.info(f"{table_name} 已有主键 ({', '.join(columns)})")
+        return False
+    if not _is_mysql(db):
+        raise ValueError(f"{table_name} 没有主键，只支持为 MySQL 表添加主键")
+
+    key_list = ", ".join(columns)
+    duplicates = pd.read_sql(f"SELECT COUNT(*) AS n FROM (SELECT 1 FROM {table_name} GROUP BY {key_list} "
+                             f"HAVING COUNT(*) > 1) d", con=db.engine)["n"][0]
+    if duplicates:
+        raise ValueError(f"{table_name} 有 {duplicates} 组重复的 ({key_list})，去重后才能添加主键")
+
+    modify = [f"MODIFY {col} {column_types[col]} NOT NULL" for col in columns if col in (column_types or {})]
+    with db.engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table_name} {', '.join(modify + [f'ADD PRIMARY KEY ({key_list})'])}"))
+    logger.info(f"🔑 {table_name} 已添加主键 ({key_list})")
+    return True
+
+def truncate_date_range(db, table_name, start_date, end_date, date_format="%Y-%m-%d"):
+    """
+    删除 [start_date, end_date] 的数据，用于重新入库
+
+    完全落在区间内的分区用 TRUNCATE PARTITION 直接清空，区间两端不完整的分区再用 DELETE 删除。
+
+    Returns:
+        list: 被清空的分区名
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    truncated = []
+    if _is_mysql(db):
+        lower = None
+        for name, bound in get_partitions(db, table_name):
+            # 分区范围为 [lower, bound)
+            if lower is not None and bound is not None and lower >= start and bound <= end + pd.Timedelta(days=1):
+                truncated.append(name)
+            lower = bound
+    with db.engine.begin() as conn:
+        if truncated:
+            conn.execute(text(f"ALTER TABLE {table_name} TRUNCATE PARTITION {', '.join(truncated)}"))
+        conn.execute(text(f"DELETE FROM {table_name} WHERE date BETWEEN :start AND :end"),
+                     {"start": start.strftime(date_format), "end": end.strftime(date_format)})
+    logging.getLogger(__name__).info(
+        f"🧹 {table_name} 已清除 {start_date} 到 {end_date} 的数据，清空分区 {len(truncated)} 个")
+    return truncated
@@ -0,0 +1,118 @@
+import sys
+import time
+import zlib
+import threading
+from collections import Counter
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+# ============== 配置 ==============
+# 模拟的 rqdatac，供 benchmark.py 使用：返回确定性的数据，并按配置模拟网络延迟
+CONFIG = {
+    "n_stocks": 1000,           # 全市场股票数量
+    "n_factors": 20,            # 每个因子类型的因子数量
+    "latency": 0.05,            # 每次请求的固定延迟（秒）
+    "seconds_per_mcell": 0.5,   # 每百万个单元格（行数 × 列数）额外的传输时间（秒）
+    "nan_ratio": 0.02,          # 因子值中 NaN 的比例
+    "instrument_version": 0,    # 增大后部分股票的 status 发生变化，用于测试 stock_info 增量同步
+}
+
+PRICE_FIELDS = ["open", "high", "low", "close", "volume", "total_turnover",
+                "prev_close", "limit_up", "limit_down", "num_trades"]
+
+# 各接口的调用次数、返回的单元格数和模拟耗时
+calls = Counter()
+cells = Counter()
+seconds = Counter()
+_lock = threading.Lock()
+
+def configure(**options):
+    unknown = set(options) - set(CONFIG)
+    if unknown:
+        raise KeyError(f"未知的配置项: {sorted(unknown)}")
+    CONFIG.update(options)
+
+def reset():
+    with _lock:
+        calls.clear()
+        cells.clear()
+        seconds.clear()
+
+def install():
+    """替换 sys.modules 中的 rqdatac，之后 import rqdatac 得到本模块"""
+    sys.modules["rqdatac"] = sys.modules[__name__]
+
+def _record(endpoint, n_cells):
+    delay = CONFIG["latency"] + n_cells / 1e6 * CONFIG["seconds_per_mcell"]
+    time.sleep(delay)
+    with _lock:
+        calls[endpoint] += 1
+        cells[endpoint] += n_cells
+        seconds[endpoint] += delay
+
+def _rng(*key):
+    """由请求参数得到确定的随机数种子，相同的请求返回相同的数据"""
+    return np.random.default_rng(zlib.crc32(repr(key).encode()))
+
+def _stocks():
+    return [f"{i:06d}.{'XSHG' if i % 2 else 'XSHE'}" for i in range(CONFIG["n_stocks"])]
+
+def _weekdays(start_date, end_date):
+    return pd.bdate_range(pd.Timestamp(start_date), pd.Timestamp(end_date))
+
+# ============== rqdatac 接口 ==============
+def init(*args, **kwargs):
+    pass
+
+def get_trading_dates(start_date, end_date, market="cn"):
+    _record("get_trading_dates", 0)
+    return [d.date() for d in _weekdays(start_date, end_date)]
+
+def all_instruments(type="CS", market="cn", date=None):
+    """每 10 只股票中有 1 只 2024 年上市，每 50 只中有 1 只 2024 年退市"""
+    stocks = _stocks()
+    index = np.arange(len(stocks))
+    version = CONFIG["instrument_version"]
+    df = pd.DataFrame({
+        "order_book_id": stocks,
+        "symbol": [f"股票{i}" for i in index],
+        "type": type,
+        "listed_date": np.where(index % 10 == 0, "2024-03-01", "2000-01-04"),
+        "de_listed_date": np.where(index % 50 == 7, "2024-06-03", "0000-00-00"),
+        "status": np.where((index + version) % 97 == 0, "Suspended", "Active"),
+        "exchange": np.where(index % 2, "XSHG", "XSHE"),
+    })
+    _record("all_instruments", df.size)
+    return df
+
+def get_all_factor_names(type=None, market="cn"):
+    _record("get_all_factor_names", 0)
+    return [f"{type or 'factor'}_{i}" for i in range(CONFIG["n_factors"])]
+
+def get_factor(order_book_ids, factor, start_date=None, end_date=None, expect_df=True, **kwargs):
+    order_book_ids = [order_book_ids] if isinstance(order_book_ids, str) else list(order_book_ids)
+    factor = [factor] if isinstance(factor, str) else list(factor)
+    dates = _weekdays(start_date, end_date)
+    index = pd.MultiIndex.from_product([order_book_ids, dates], names=["order_book_id", "date"])
+    rng = _rng("get_factor", order_book_ids[:1], len(order_book_ids), factor[:1], len(factor), str(dates[:1]))
+    values = rng.standard_normal((len(index), len(factor)))
+    values[rng.random(values.shape) < CONFIG["nan_ratio"]] = np.nan
+    _record("get_factor", values.size)
+    return pd.DataFrame(values, index=index, columns=factor)
+
+def get_price(order_book_ids, start_date=None, end_date=None, frequency="1d", fields=None, adjust_type="pre",
+              skip_suspended=False, market="cn", expect_df=True, **kwargs):
+    order_book_ids = [order_book_ids] if isinstance(order_book_ids, str) else list(order_book_ids)
+    fields = PRICE_FIELDS if fields is None else ([fields] if isinstance(fields, str) else list(fields))
+    dates = _weekdays(start_date, end_date)
+    index = pd.MultiIndex.from_product([order_book_ids, dates], names=["order_book_id", "date"])
+    rng = _rng("get_price", order_book_ids[:1], len(order_book_ids), str(dates[:1]), len(dates))
+    values = np.abs(rng.standard_normal((len(index), len(fields)))) * 10 + 1
+    _record("get_price", values.size)
+    return pd.DataFrame(values, index=index, columns=fields)
+
+def _get_quota():
+    return {"bytes_limit": 0, "bytes_used": int(sum(cells.values()) * 8), "remaining_days": 365}
+
+user = SimpleNamespace(get_quota=_get_quota)
@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import bisect
+import resource
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+# 指标输出目录：每个入口脚本写一个 Prometheus 文本文件（node exporter textfile collector）和一个 JSON 运行摘要
+METRICS_DIR = os.environ.get("INGEST_METRICS_DIR", "metrics")
+
+# 指标名前缀
+PREFIX = "rq_ingest"
+
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# 指标说明，同时决定 Prometheus 输出的类型
+METRICS = {
+    "api_request_seconds": ("histogram", "rqdatac 请求耗时（不含本地缓存命中）"),
+    "api_requests_total": ("counter", "rqdatac 请求次数，cached 为 1 表示由本地缓存返回"),
+    "api_rows_total": ("counter", "rqdatac 返回的行数"),
+    "api_bytes_total": ("counter", "rqdatac 返回数据的内存大小（字节）"),
+    "api_errors_total": ("counter", "rqdatac 请求失败次数"),
+    "stage_seconds": ("histogram", "流水线阶段处理单个元素的耗时"),
+    "stage_rows_total": ("counter", "流水线阶段输出的行数"),
+    "stage_errors_total": ("counter", "流水线阶段处理失败次数"),
+    "transform_seconds": ("histogram", "宽表转长表、清洗、过滤已覆盖单元的耗时"),
+    "transform_rows_total": ("counter", "转换后待写入的行数"),
+    "db_write_seconds": ("histogram", "数据库批量写入耗时"),
+    "db_write_rows_total": ("counter", "写入数据库的行数"),
+    "db_write_bytes_total": ("counter", "写入数据库的数据内存大小（字节）"),
+    "retries_total": ("counter", "重试次数"),
+    "run_seconds": ("gauge", "本次运行的总耗时"),
+    "run_success": ("gauge", "本次运行是否成功结束（1/0）"),
+    "run_timestamp_seconds": ("gauge", "本次运行结束的时间戳"),
+    "peak_rss_bytes": ("gauge", "进程峰值常驻内存"),
+}
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+# ============== 直方图 ==============
+class Histogram:
+    """固定桶的累计直方图，同时记录最小值和最大值，用于 JSON 摘要"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """按桶线性插值估计分位数"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = self.min
+        for upper, n in zip(self.buckets + (self.max,), self.counts):
+            if seen + n >= rank and n:
+                upper = min(upper, self.max)
+                return round(lower + (upper - lower) * (rank - seen) / n, 6)
+            seen += n
+            lower = max(upper, self.min)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "min": self.min,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+# ============== 指标注册表 ==============
+class Registry:
+    """进程内的计数器、仪表和直方图，按 (指标名, 标签) 区分"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}       # (name, labels) -> float
+        self._histograms = {}   # (name, labels) -> Histogram
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """记录代码块耗时到直方图，异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+    # ---------- 输出 ----------
+    def to_prometheus(self, extra_labels=None):
+        """Prometheus 文本格式"""
+        extra = _label_key(extra_labels or {})
+
+        def fmt(name, labels, suffix="", **more):
+            items = list(extra) + list(labels) + [(k, str(v)) for k, v in more.items()]
+            label_text = ",".join(f'{k}="{v}"' for k, v in items)
+            return f"{PREFIX}_{name}{suffix}" + (f"{{{label_text}}}" if label_text else "")
+
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: (list(h.counts), h.count, h.sum, h.buckets) for key, h in self._histograms.items()}
+
+        lines = []
+        for name in sorted({n for n, _ in values} | {n for n, _ in histograms}):
+            kind, help_text = METRICS.get(name, ("gauge", name))
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for (n, labels), value in sorted(values.items()):
+                if n == name:
+                    lines.append(f"{fmt(name, labels)} {value}")
+            for (n, labels), (counts, count, total, buckets) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for upper, c in zip(buckets, counts):
+                    cumulative += c
+                    lines.append(f"{fmt(name, labels, '_bucket', le=upper)} {cumulative}")
+                lines.append(f"{fmt(name, labels, '_bucket', le='+Inf')} {count}")
+                lines.append(f"{fmt(name, labels, '_sum')} {round(total, 6)}")
+                lines.append(f"{fmt(name, labels, '_count')} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """JSON 运行摘要：计数器/仪表为数值，直方图为 count/sum/分位数"""
+        summary = {}
+        with self._lock:
+            for (name, labels), value in sorted(self._values.items()):
+                summary.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                summary.setdefault(name, []).append({"labels": dict(labels), **histogram.summary()})
+        return summary
+
+_registry = Registry()
+
+def get_registry():
+    """返回进程内共享的指标注册表"""
+    return _registry
+
+# 模块级快捷函数
+def inc(name, value=1, **labels):
+    _registry.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    _registry.observe(name, value, **labels)
+
+def timer(name, **labels):
+    return _registry.timer(name, **labels)
+
+def peak_rss_bytes():
+    # Linux 上 ru_maxrss 的单位为 KB，macOS 为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# ============== 输出文件 ==============
+def _atomic_write(path, content):
+    """先写临时文件再改名，node exporter 不会读到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def write_metrics(entry, directory=METRICS_DIR):
+    """
+    写出 {entry}.prom（Prometheus 文本格式）和 {entry}.json（运行摘要）
+
+    Returns:
+        tuple: (prom 文件路径, json 文件路径)
+    """
+    _registry.set("peak_rss_bytes", peak_rss_bytes())
+    os.makedirs(directory, exist_ok=True)
+    prom_path = os.path.join(directory, f"{entry}.prom")
+    json_path = os.path.join(directory, f"{entry}.json")
+    _atomic_write(prom_path, _registry.to_prometheus({"entry": entry}))
+    _atomic_write(json_path, json.dumps({"entry": entry, "written": datetime.now().isoformat(timespec="seconds"),
+                                         "metrics": _registry.to_dict()}, ensure_ascii=False, indent=2))
+    return prom_path, json_path
+
+@contextmanager
+def run_metrics(entry, directory=METRICS_DIR):
+    """
+    包裹一次入库运行：结束时（包括异常退出）记录总耗时、是否成功和峰值内存，并写出指标文件
+
+    用法：
+        with run_metrics("stock_price"):
+            daily_polling_main(...)
+    """
+    started = time.perf_counter()
+    success = 0
+    try:
+        yield _registry
+        success = 1
+    finally:
+        _registry.set("run_seconds", round(time.perf_counter() - started, 3))
+        _registry.set("run_success", success)
+        _registry.set("run_timestamp_seconds", int(time.time()))
+        try:
+            prom_path, _ = write_metrics(entry, directory)
+            logging.getLogger(__name__).info(f"📈 运行指标已写入 {prom_path}")
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"写入运行指标失败: {e}")
@@ -0,0 +1,83 @@
+import logging
+import argparse
+from database import DataBase_Position
+from factor_engine import build_jobs
+from factor_schema import add_primary_key, partition_table, add_index
+import stock_price
+
+# ============== 迁移配置 ==============
+# 迁移步骤：都会重建整张表，只通过本脚本显式执行，日常入库不会自动执行
+# primary_key 添加主键，partition 按日期分区（需要主键包含 date），index 添加二级索引
+STEPS = ["primary_key", "partition", "index"]
+
+def table_specs():
+    """
+    各表的迁移配置 {表名: {"primary_key": 主键列, "column_types": 主键列需改成的类型,
+    "partition": 分区粒度, "date_format": 分区边界的日期格式, "indexes": [(索引名, 列)]}}
+    """
+    specs = {}
+    for job in build_jobs():
+        specs[job.target_table] = {"primary_key": job.primary_key, "column_types": {},
+                                   "partition": job.partition, "date_format": "%Y-%m-%d", "indexes": job.indexes}
+    # to_sql 创建的旧 stock_price 表 order_book_id、date 为 TEXT，不能直接作为主键和分区列
+    specs["stock_price"] = {
+        "primary_key": stock_price.PRIMARY_KEY,
+        "column_types": {col: str(sql_type) for col, sql_type in stock_price.KEY_TYPES.items()},
+        "partition": stock_price.PARTITION_GRANULARITY,
+        "date_format": stock_price.DATE_FORMAT,
+        "indexes": stock_price.INDEXES,
+    }
+    return specs
+
+# ============== 函数：执行迁移 ==============
+def migrate_table(db, table_name, spec, steps=STEPS):
+    """按顺序执行一张表的迁移步骤，任何一步失败都抛出异常"""
+    if "primary_key" in steps:
+        add_primary_key(db, table_name, spec["primary_key"], spec["column_types"])
+    if "partition" in steps and spec["partition"] is not None:
+        partition_table(db, table_name, spec["partition"], spec["date_format"])
+    if "index" in steps:
+        for index_name, columns in spec["indexes"]:
+            add_index(db, table_name, index_name, columns)
+
+def migrate(db, tables=None, steps=STEPS):
+    """
+    迁移指定的表（默认全部），返回失败的表名列表
+
+    表不存在时跳过；一张表失败不影响其他表
+    """
+    from sqlalchemy import inspect
+    specs = table_specs()
+    failed = []
+    for table_name in tables or list(specs):
+        if table_name not in specs:
+            logging.error(f"❌ 未知的表: {table_name}，可选: {', '.join(specs)}")
+            failed.append(table_name)
+            continue
+        if not inspect(db.engine).has_table(table_name):
+            logging.info(f"{table_name} 不存在，跳过")
+            continue
+        try:
+            migrate_table(db, table_name, specs[table_name], steps)
+        except Exception as e:
+            logging.error(f"❌ {table_name} 迁移失败: {e}")
+            failed.append(table_name)
+    return failed
+
+# ============== 主程序 ==============
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='表结构迁移：为旧表添加主键、按日期分区、添加二级索引（会重建整张表，请在入库任务停止时执行）')
+    parser.add_argument('--tables', type=str, nargs='*', help='只迁移指定的表，默认全部')
+    parser.add_argument('--steps', type=str, nargs='*', choices=STEPS, default=STEPS, help='执行的迁移步骤，默认全部')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = DataBase_Position()
+    try:
+        failed = migrate(db, args.tables, args.steps)
+    finally:
+        db.close()
+    if failed:
+        print(f"❌ 迁移失败的表: {failed}")
+        exit(1)
+    print("🎉 迁移完成")
@@ -0,0 +1,265 @@
+import os
+import json
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from trading_calendar import get_calendar, to_date, CALENDAR_START
+
+# 行情面板目录：每个字段一个 (交易日 × 股票) 的 float64 内存映射文件，另有 meta.json 保存日期和股票索引
+PANEL_DIR = "stock_price_panel"
+
+# 保存的字段（get_price 默认返回的日线字段）
+PANEL_FIELDS = ["open", "high", "low", "close", "volume", "total_turnover",
+                "prev_close", "limit_up", "limit_down", "num_trades"]
+
+# 预分配的行数（交易日）和股票列数，用完后按块扩展
+ROW_CHUNK = 256
+STOCK_CHUNK = 512
+STOCK_CAPACITY = 6144
+
+_META = "meta.json"
+
+def _day(value):
+    """日期统一为 'YYYYMMDD' 字符串"""
+    return to_date(value).strftime("%Y%m%d")
+
+def _days(values):
+    """'YYYYMMDD'/'YYYY-MM-DD' 字符串序列转为 datetime64[D] 数组"""
+    text = pd.Series(values, dtype=str).str.replace("-", "", regex=False).str[:8]
+    return pd.to_datetime(text, format="%Y%m%d").to_numpy().astype("datetime64[D]")
+
+# ============== 行情面板 ==============
+class PanelStore:
+    """
+    stock_price 的内存映射面板：field -> ndarray[交易日, 股票]
+
+    行为连续的交易日（从 CALENDAR_START 之后的第一个交易日起），列为股票，按首次出现的顺序编号、
+    只追加不重排。没有数据的单元为 NaN。读取返回 np.memmap 的切片，不复制数据。
+    单写多读：写入方先写数据文件，最后原子替换 meta.json，读取方只会看到已完整写入的行。
+    """
+
+    def __init__(self, root=PANEL_DIR, mode="r"):
+        """
+        Args:
+            mode (str): "r" 只读，"r+" 读写（不存在时创建）
+        """
+        self.root = root
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._arrays = {}
+        self.dates = []             # 行 -> 'YYYYMMDD'
+        self.stocks = []            # 列 -> order_book_id
+        self.fields = []
+        self.row_capacity = 0
+        self.stock_capacity = STOCK_CAPACITY
+        self._date_index = _days([])
+        self._stock_ids = {}
+        self._load_meta()
+
+    # ---------- 元数据 ----------
+    def _load_meta(self):
+        path = os.path.join(self.root, _META)
+        if not os.path.exists(path):
+            if self.mode == "r":
+                raise FileNotFoundError(f"行情面板 {self.root} 不存在，请先运行 stock_price.py")
+            os.makedirs(self.root, exist_ok=True)
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dates = meta["dates"]
+        self.stocks = meta["stocks"]
+        self.fields = meta["fields"]
+        self.row_capacity = meta["row_capacity"]
+        self.stock_capacity = meta["stock_capacity"]
+        self._date_index = _days(self.dates)
+        self._stock_ids = {code: i for i, code in enumerate(self.stocks)}
+        self._arrays = {}
+
+    def _save_meta(self):
+        meta = {
+            "dates": self.dates,
+            "stocks": self.stocks,
+            "fields": self.fields,
+            "row_capacity": self.row_capacity,
+            "stock_capacity": self.stock_capacity,
+        }
+        path = os.path.join(self.root, _META)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def refresh(self):
+        """重新读取 meta.json，看到写入方新增的交易日和股票"""
+        self._load_meta()
+
+    # ---------- 文件 ----------
+    def _path(self, field):
+        return os.path.join(self.root, f"{field}.f8")
+
+    def _array(self, field):
+        arr = self._arrays.get(field)
+        if arr is None:
+            arr = np.memmap(self._path(field), dtype=np.float64, mode=self.mode,
+                            shape=(self.row_capacity, self.stock_capacity))
+            self._arrays[field] = arr
+        return arr
+
+    def _resize(self, field, rows, stocks):
+        """把字段文件从当前容量扩展到 rows × stocks，新单元填 NaN；文件不存在时新建"""
+        path = self._path(field)
+        self._arrays.pop(field, None)
+        exists = os.path.exists(path)
+        if exists and stocks == self.stock_capacity:
+            # 行优先存储，增加行只需在文件末尾追加
+            with open(path, "r+b") as f:
+                f.truncate(rows * stocks * 8)
+            arr = np.memmap(path, dtype=np.float64, mode="r+", shape=(rows, stocks))
+            arr[self.row_capacity:] = np.nan
+            arr.flush()
+            return
+
+        # 新字段或股票列数变化时重写整个文件
+        tmp_path = f"{path}.tmp"
+        arr = np.memmap(tmp_path, dtype=np.float64, mode="w+", shape=(rows, stocks))
+        arr[:] = np.nan
+        if exists and self.row_capacity:
+            old = np.memmap(path, dtype=np.float64, mode="r", shape=(self.row_capacity, self.stock_capacity))
+            arr[:self.row_capacity, :self.stock_capacity] = old
+            del old
+        arr.flush()
+        del arr
+        os.replace(tmp_path, path)
+
+    # ---------- 写入 ----------
+    def _extend_dates(self, last_day):
+        """行索引扩展到 last_day（含）为止的所有交易日"""
+        calendar = get_calendar()
+        if self.dates:
+            start = calendar.next(self.dates[-1])
+        else:
+            start = calendar.offset(CALENDAR_START, 0)
+        new_dates = [d.strftime("%Y%m%d") for d in calendar.range(start, last_day)]
+        if not new_dates:
+            return
+        self.dates = self.dates + new_dates
+        self._date_index = _days(self.dates)
+
+    def _grow(self, fields):
+        """按当前日期和股票数量扩展所有字段文件，并创建新字段的文件"""
+        rows = self.row_capacity
+        while rows < len(self.dates):
+            rows += ROW_CHUNK
+        stocks = self.stock_capacity
+        while stocks < len(self.stocks):
+            stocks += STOCK_CHUNK
+        new_fields = [f for f in fields if f not in self.fields]
+        if rows == self.row_capacity and stocks == self.stock_capacity and not new_fields:
+            return
+        for field in self.fields + new_fields:
+            self._resize(field, rows, stocks)
+        self.fields += new_fields
+        self.row_capacity, self.stock_capacity = rows, stocks
+
+    def write_frame(self, df):
+        """
+        写入 get_price 格式的数据（order_book_id, date 以及各字段列），已有单元被覆盖
+
+        Returns:
+            int: 写入的行数
+        """
+        if self.mode == "r":
+            raise ValueError("只读模式的行情面板不能写入")
+        fields = [f for f in PANEL_FIELDS if f in df.columns]
+        if df.empty or not fields:
+            return 0
+
+        with self._lock:
+            days = pd.Series(_days(df["date"])).dt.strftime("%Y%m%d")
+            first = days.min()
+            if self.dates and first < self.dates[0]:
+                raise ValueError(f"{first} 早于行情面板的起始日期 {self.dates[0]}")
+            if not self.dates or days.max() > self.dates[-1]:
+                self._extend_dates(days.max())
+
+            for code in df["order_book_id"].unique():
+                if code not in self._stock_ids:
+                    self._stock_ids[code] = len(self.stocks)
+                    self.stocks.append(code)
+            self._grow(fields)
+
+            rows = np.searchsorted(self._date_index, _days(days))
+            cols = df["order_book_id"].map(self._stock_ids).to_numpy()
+            for field in fields:
+                arr = self._array(field)
+                arr[rows, cols] = pd.to_numeric(df[field], errors="coerce").to_numpy(dtype=np.float64)
+                arr.flush()
+            self._save_meta()
+        return len(df)
+
+    # ---------- 读取 ----------
+    def _rows(self, start_date=None, end_date=None):
+        r0 = 0 if start_date is None else int(np.searchsorted(self._date_index, np.datetime64(to_date(start_date), "D")))
+        r1 = len(self.dates) if end_date is None else int(
+            np.searchsorted(self._date_index, np.datetime64(to_date(end_date), "D"), side="right"))
+        return r0, r1
+
+    def field(self, name, start_date=None, end_date=None):
+        """
+        单个字段在 [start_date, end_date] 内的 (交易日 × 股票) 数组，为内存映射的视图，不复制数据
+
+        行对应 self.dates 的切片，列对应 self.stocks
+        """
+        r0, r1 = self._rows(start_date, end_date)
+        return self._array(name)[r0:r1, :len(self.stocks)]
+
+    def window(self, start_date=None, end_date=None, fields=None):
+        """
+        多个字段的窗口
+
+        Returns:
+            tuple: (交易日列表, 股票列表, {字段: 数组视图})
+        """
+        r0, r1 = self._rows(start_date, end_date)
+        fields = fields or self.fields
+        return (self.dates[r0:r1], list(self.stocks),
+                {f: self._array(f)[r0:r1, :len(self.stocks)] for f in fields})
+
+    def columns(self, order_book_ids):
+        """股票代码对应的列号，不存在的股票为 -1"""
+        return np.array([self._stock_ids.get(code, -1) for code in order_book_ids], dtype=np.int64)
+
+    def get(self, name, start_date=None, end_date=None, order_book_ids=None):
+        """按日期和股票取子集，返回 DataFrame（index 为日期，columns 为股票），会复制数据"""
+        r0, r1 = self._rows(start_date, end_date)
+        arr = self._array(name)[r0:r1, :len(self.stocks)]
+        codes = list(self.stocks)
+        if order_book_ids is not None:
+            cols = self.columns(order_book_ids)
+            codes = [code for code, c in zip(order_book_ids, cols) if c >= 0]
+            arr = arr[:, cols[cols >= 0]]
+        return pd.DataFrame(arr, index=pd.to_datetime(self.dates[r0:r1], format="%Y%m%d"), columns=codes)
+
+# ============== 函数：从数据表补齐面板 ==============
+def backfill_from_db(db, table_name="stock_price", start_date=None, end_date=None, root=PANEL_DIR):
+    """按交易日从 stock_price 表读取数据写入面板，用于首次建立面板"""
+    store = PanelStore(root, mode="r+")
+    where = []
+    if start_date:
+        where.append(f"date >= '{_day(start_date)}'")
+    if end_date:
+        where.append(f"date <= '{_day(end_date)}'")
+    sql = f"SELECT DISTINCT date FROM {table_name}" + (" WHERE " + " AND ".join(where) if where else "")
+    dates = sorted(pd.read_sql(sql, con=db.engine)["date"].astype(str))
+
+    columns = ", ".join(["order_book_id", "date"] + PANEL_FIELDS)
+    total = 0
+    for date_str in dates:
+        try:
+            df = pd.read_sql(f"SELECT {columns} FROM {table_name} WHERE date = '{date_str}'", con=db.engine)
+        except Exception:
+            df = pd.read_sql(f"SELECT * FROM {table_name} WHERE date = '{date_str}'", con=db.engine)
+        total += store.write_frame(df)
+    logging.info(f"🧱 行情面板已从 {table_name} 补齐 {len(dates)} 个交易日，共 {total} 行")
+    return store
@@ -0,0 +1,162 @@
+import queue
+import threading
+import time
+import logging
+import metrics
+
+_STOP = object()
+
+# 流水线结束时的回调 func(name, snapshot)，用于基准测试等收集各阶段统计
+_listeners = []
+
+def add_listener(func):
+    """注册流水线结束时的回调，参数为流水线名称和各阶段的最终统计（见 Pipeline.snapshot）"""
+    _listeners.append(func)
+
+# ============== 流水线阶段 ==============
+class Stage:
+    """流水线中的一个阶段：func 处理上游的每个元素，返回 None 表示丢弃"""
+
+    def __init__(self, name, func, workers=1, count=None):
+        """
+        Args:
+            name (str): 阶段名称，用于日志和统计
+            func (callable): 处理函数，参数为上游元素，返回值传给下游
+            workers (int): 该阶段的线程数
+            count (callable): 从返回值计算行数，用于统计吞吐量
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.count = count
+        # 统计
+        self.processed = 0
+        self.rows = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, rows=0, error=False):
+        with self._lock:
+            self.processed += 1
+            self.rows += rows
+            self.busy_seconds += elapsed
+            if error:
+                self.errors += 1
+
+# ============== 流水线 ==============
+class Pipeline:
+    """
+    多阶段流水线，相邻阶段之间用有界队列连接
+
+    下游处理不过来时上游的 put 会阻塞（背压），因此网络请求和数据库写入可以重叠进行，
+    内存中积压的数据量也有上限。运行期间定期输出各阶段的队列深度和吞吐量。
+    """
+
+    def __init__(self, stages, queue_size=4, report_interval=30, name="pipeline"):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.name = name
+        self.logger = logging.getLogger(__name__)
+        self._queues = []
+        self._started = None
+
+    def _worker(self, index, stage, results):
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                return
+            start = time.perf_counter()
+            try:
+                output = stage.func(item)
+            except Exception as e:
+                stage.record(time.perf_counter() - start, error=True)
+                metrics.inc("stage_errors_total", pipeline=self.name, stage=stage.name)
+                self.logger.error(f"❌ {self.name} 阶段 {stage.name} 处理失败: {e}")
+                continue
+            rows = stage.count(output) if stage.count and output is not None else 0
+            elapsed = time.perf_counter() - start
+            stage.record(elapsed, rows)
+            metrics.observe("stage_seconds", elapsed, pipeline=self.name, stage=stage.name)
+            metrics.inc("stage_rows_total", rows, pipeline=self.name, stage=stage.name)
+            if output is None:
+                continue
+            if outbox is not None:
+                outbox.put(output)
+            else:
+                results.append(output)
+
+    def snapshot(self):
+        """各阶段当前状态：队列深度、已处理数量、行数、累计耗时和吞吐量"""
+        elapsed = max(time.perf_counter() - self._started, 1e-9) if self._started else 1e-9
+        stats = []
+        for index, stage in enumerate(self.stages):
+            stats.append({
+                "stage": stage.name,
+                "queue_depth": self._queues[index].qsize() if self._queues else 0,
+                "processed": stage.processed,
+                "rows": stage.rows,
+                "errors": stage.errors,
+                "busy_seconds": round(stage.busy_seconds, 3),
+                "items_per_second": round(stage.processed / elapsed, 2),
+                "rows_per_second": round(stage.rows / elapsed, 1),
+            })
+        return stats
+
+    def log_snapshot(self, final=False):
+        parts = [f"{s['stage']}[队列 {s['queue_depth']}/{self.queue_size}, 已处理 {s['processed']}, "
+                 f"{s['rows_per_second']} 行/秒, 耗时 {s['busy_seconds']}s]" for s in self.snapshot()]
+        self.logger.info(f"{'🏁' if final else '📊'} {self.name} " + " → ".join(parts))
+
+    def run(self, items):
+        """
+        处理所有元素，返回最后一个阶段的输出列表
+
+        输入队列同样有界，调用线程在投递元素时也会受到背压。
+        """
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        self._started = time.perf_counter()
+        results = []
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            stage_threads = [threading.Thread(target=self._worker, args=(index, stage, results),
+                                              name=f"{self.name}-{stage.name}-{n}", daemon=True)
+                             for n in range(stage.workers)]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        done = threading.Event()
+
+        def report():
+            while not done.wait(self.report_interval):
+                self.log_snapshot()
+
+        reporter = threading.Thread(target=report, daemon=True)
+        reporter.start()
+
+        try:
+            for item in items:
+                self._queues[0].put(item)
+        finally:
+            # 逐级关闭：上一阶段全部线程退出后，再通知下一阶段
+            for index, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    self._queues[index].put(_STOP)
+                for thread in threads[index]:
+                    thread.join()
+            done.set()
+
+        self.log_snapshot(final=True)
+        if _listeners:
+            snapshot = self.snapshot()
+            for listener in list(_listeners):
+                try:
+                    listener(self.name, snapshot)
+                except Exception as e:
+                    self.logger.warning(f"流水线回调失败: {e}")
+        return results
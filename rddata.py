@@ -1,31 +1,16 @@
 import pandas as pd
-import pymysql
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect, text, bindparam
+from sqlalchemy.types import VARCHAR, CHAR
 import rqdatac
 from datetime import datetime
+from bulk_writer import ensure_table, write_frame
+import rq_api
+import metrics
+from database import DataBase_Position
 
 # ================== 配置区 ==================
-class DataBase_Position:
-    """从Mysql数据库获取数据"""
-    __HOST = ""
-    __PORT = 3306
-    __USERNAME = ""
-    __PASSWORD = ""
-    __SCHEMA_OTC = "StockSignal"
-
-    def __init__(self):
-        self.conn = pymysql.connect(
-            host=DataBase_Position.__HOST,
-            port=DataBase_Position.__PORT,
-            user=DataBase_Position.__USERNAME,
-            password=DataBase_Position.__PASSWORD,
-            charset="utf8",
-            database=DataBase_Position.__SCHEMA_OTC
-        )
-        self.engine = create_engine(
-            f"mysql+pymysql://{DataBase_Position.__USERNAME}:{DataBase_Position.__PASSWORD}@"
-            f"{DataBase_Position.__HOST}:{DataBase_Position.__PORT}/{DataBase_Position.__SCHEMA_OTC}?charset=utf8mb4"
-        )
+# stock_info 所在的数据库，连接参数在 database.py 中统一配置
+SCHEMA = "StockSignal"
 
 # ================== 核心逻辑 ==================
 
@@ -35,42 +20,96 @@ def get_all_instruments():
     rqdatac.init()
 
     # 示例：获取全市场股票信息
-    df = rqdatac.all_instruments(type='CS', market='cn', date=None)
+    df = rq_api.all_instruments(type='CS', market='cn', date=None, job="stock_info")
     # 这里你可以替换成具体的因子暴露接口，比如 rqdatac.get_factor_exposure(...)
     return df
 
+# 行内容哈希列：与接口返回的数据比较，只写入新增和变化的行
+KEY_COLUMNS = ["order_book_id"]
+HASH_COLUMN = "row_hash"
+
+def row_hashes(df, columns):
+    """按列内容计算每行的哈希（16 位十六进制字符串），缺失值与空字符串视为相同"""
+    values = df[columns].astype("string").fillna("")
+    hashes = pd.util.hash_pandas_object(values, index=False, categorize=False)
+    return hashes.map("{:016x}".format).to_numpy()
+
+def _add_hash_column(table_name, db: DataBase_Position):
+    """旧表没有哈希列时补上，已有行的哈希为 NULL，下次同步时全部视为变化并更新一次"""
+    columns = {col["name"] for col in inspect(db.engine).get_columns(table_name)}
+    if HASH_COLUMN not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {HASH_COLUMN} CHAR(16)"))
+        columns.add(HASH_COLUMN)
+    return columns
+
 def load_data_to_mysql(df, table_name, db: DataBase_Position):
-    """加载数据到 MySQL，如果表不存在则创建表，存在则增量插入"""
+    """
+    同步数据到 MySQL：表不存在则建表全量插入，存在则按行哈希只写入新增和变化的行
+
+    只从数据库读取 (order_book_id, row_hash) 两列，与接口数据的哈希比较，
+    网络传输和内存占用只与股票数和变化行数有关，不再读取整张表
+    """
     inspector = inspect(db.engine)
-    tables = inspector.get_table_names()
 
-    if table_name not in tables:
+    if not inspector.has_table(table_name):
         print(f"[INFO] 表 {table_name} 不存在，执行全量插入...")
-        df.to_sql(name=table_name, con=db.engine, if_exists='replace', index=False)
+        df = df.assign(**{HASH_COLUMN: row_hashes(df, list(df.columns))})
+        ensure_table(df, table_name, db.engine, primary_key=KEY_COLUMNS,
+                     dtype={"order_book_id": VARCHAR(32), HASH_COLUMN: CHAR(16)})
+        write_frame(df, table_name, db.engine)
         print(f"[INFO] 表 {table_name} 创建完成，插入 {len(df)} 行")
-    else:
-        print(f"[INFO] 表 {table_name} 已存在，执行增量插入...")
-        existing_df = pd.read_sql(f"SELECT * FROM {table_name}", con=db.engine)
-
-        # 假设有唯一键 "order_book_id" 判断是否重复
-        key_cols = ["order_book_id"]
-        merged_df = pd.merge(df, existing_df[key_cols], on=key_cols, how="left", indicator=True)
-        new_df = merged_df[merged_df["_merge"] == "left_only"].drop(columns=["_merge"])
-
-        if len(new_df) > 0:
-            new_df.to_sql(name=table_name, con=db.engine, if_exists='append', index=False)
-            print(f"[INFO] 增量插入 {len(new_df)} 行")
+        return
+
+    print(f"[INFO] 表 {table_name} 已存在，执行增量同步...")
+    table_columns = _add_hash_column(table_name, db)
+
+    # 只比较表中已有的列，接口新增的字段不写入
+    columns = [col for col in df.columns if col in table_columns and col != HASH_COLUMN]
+    dropped = [col for col in df.columns if col not in table_columns]
+    if dropped:
+        print(f"[WARN] 表 {table_name} 中没有以下字段，不写入: {dropped}")
+    df = df[columns].drop_duplicates(subset=KEY_COLUMNS, keep="last")
+    df = df.assign(**{HASH_COLUMN: row_hashes(df, columns)})
+
+    existing = pd.read_sql(f"SELECT {', '.join(KEY_COLUMNS)}, {HASH_COLUMN} FROM {table_name}", con=db.engine)
+    # 没有主键的旧表可能已有重复行，合并前去重，避免一行新数据对应多行
+    existing = existing.drop_duplicates(subset=KEY_COLUMNS, keep="last")
+    merged = df[KEY_COLUMNS + [HASH_COLUMN]].merge(existing, on=KEY_COLUMNS, how="left",
+                                                    suffixes=("", "_old"), indicator=True)
+    is_new = (merged["_merge"] == "left_only").to_numpy()
+    is_changed = (~is_new) & (merged[HASH_COLUMN] != merged[f"{HASH_COLUMN}_old"]).to_numpy()
+    new_df, changed_df = df[is_new], df[is_changed]
+
+    if len(new_df) > 0:
+        write_frame(new_df, table_name, db.engine)
+        print(f"[INFO] 新增 {len(new_df)} 行")
+
+    if len(changed_df) > 0:
+        if inspector.get_pk_constraint(table_name).get("constrained_columns"):
+            write_frame(changed_df, table_name, db.engine, on_duplicate="update")
         else:
-            print("[INFO] 没有新的数据需要插入")
+            # 旧表没有主键，在同一个事务中先删除变化的行再插入，插入失败时删除一并回滚
+            keys = bindparam("keys", expanding=True)
+            with db.engine.begin() as conn:
+                conn.execute(text(f"DELETE FROM {table_name} WHERE order_book_id IN :keys").bindparams(keys),
+                             {"keys": changed_df["order_book_id"].tolist()})
+                write_frame(changed_df, table_name, conn)
+        print(f"[INFO] 更新 {len(changed_df)} 行")
+
+    if len(new_df) == 0 and len(changed_df) == 0:
+        print("[INFO] 没有新增或变化的数据")
 
 # ================== 主程序 ==================
 if __name__ == "__main__":
-    db = DataBase_Position()
+    db = DataBase_Position(SCHEMA)
     table_name = "stock_info"
-    df = get_all_instruments()
 
-    # 确保日期列是 datetime 格式，便于比较
-   # if "listed_date" in df.columns:
-   #     df["listed_date"] = pd.to_datetime(df["listed_date"])
+    with metrics.run_metrics("stock_info"):
+        df = get_all_instruments()
+
+        # 确保日期列是 datetime 格式，便于比较
+       # if "listed_date" in df.columns:
+       #     df["listed_date"] = pd.to_datetime(df["listed_date"])
 
-    load_data_to_mysql(df, table_name, db)
+        load_data_to_mysql(df, table_name, db)
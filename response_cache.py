@@ -0,0 +1,234 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from datetime import date
+import pandas as pd
+
+# rqdatac 原始响应的本地缓存目录和容量上限（字节），超过上限时删除最久未使用的文件
+CACHE_DIR = os.environ.get("RQ_CACHE_DIR", "rqdatac_cache")
+MAX_CACHE_BYTES = 20 * 1024 ** 3
+
+# 可缓存的接口：ids 为股票列表参数，columns 为可按列取子集的参数（如因子列表）
+ENDPOINTS = {
+    "get_factor": {"ids": "order_book_ids", "columns": "factor"},
+    "get_price": {"ids": "order_book_ids", "columns": None},
+    "all_instruments": {"ids": None, "columns": None},
+}
+
+_MANIFEST = "_index.json"
+
+def _day(value):
+    """日期参数统一为 YYYYMMDD 字符串"""
+    return pd.Timestamp(value).strftime("%Y%m%d")
+
+def _as_list(value):
+    return [value] if isinstance(value, str) else list(value)
+
+# ============== rqdatac 响应缓存 ==============
+class ResponseCache:
+    """
+    按内容寻址的 rqdatac 原始响应缓存，Parquet 文件按 接口/日期 分区
+
+    {CACHE_DIR}/{接口}/{日期区间}/{参数哈希}-{股票与列哈希}.parquet
+
+    每个分区的 _index.json 记录各文件请求时的股票和列，因此批次大小变化后，
+    多个已缓存批次只要合起来覆盖本次请求的股票和因子，也能直接从磁盘返回。
+    截止日期不早于今天的请求（当日数据可能更新）不缓存。
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    # ---------- 键 ----------
+    def _partition(self, endpoint, kwargs):
+        """日期分区；不可缓存时返回 None"""
+        today = date.today().strftime("%Y%m%d")
+        if "start_date" in kwargs or "end_date" in kwargs:
+            start = _day(kwargs.get("start_date") or kwargs.get("end_date"))
+            end = _day(kwargs.get("end_date") or kwargs.get("start_date"))
+            if end >= today:
+                return None
+            return start if start == end else f"{start}_{end}"
+        if kwargs.get("date") is not None:
+            return _day(kwargs["date"])
+        # 不带日期的请求（如 all_instruments(date=None)）结果随时间变化，按请求当天分区
+        return f"asof_{today}"
+
+    def _split(self, endpoint, kwargs):
+        """拆分为 (其余参数的哈希, 股票列表, 列列表)"""
+        spec = ENDPOINTS[endpoint]
+        ids = sorted(_as_list(kwargs[spec["ids"]])) if spec["ids"] else None
+        columns = sorted(_as_list(kwargs[spec["columns"]])) if spec["columns"] else None
+        rest = {k: v for k, v in kwargs.items() if k not in (spec["ids"], spec["columns"])}
+        param_key = hashlib.sha1(json.dumps(rest, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return param_key, ids, columns
+
+    def _paths(self, endpoint, kwargs):
+        partition = self._partition(endpoint, kwargs)
+        if partition is None:
+            return None
+        param_key, ids, columns = self._split(endpoint, kwargs)
+        content_key = hashlib.sha1(json.dumps([ids, columns]).encode()).hexdigest()[:16]
+        directory = os.path.join(self.root, endpoint, partition)
+        return directory, f"{param_key}-{content_key}.parquet", param_key, ids, columns
+
+    # ---------- 索引文件 ----------
+    def _read_manifest(self, directory):
+        try:
+            with open(os.path.join(directory, _MANIFEST), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, directory, name, ids, columns):
+        # 调用方持有锁
+        manifest = self._read_manifest(directory)
+        manifest[name] = {"ids": ids, "columns": columns}
+        tmp_path = os.path.join(directory, f"{_MANIFEST}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(directory, _MANIFEST))
+
+    # ---------- 读取 ----------
+    def _read(self, path):
+        df = pd.read_parquet(path)
+        os.utime(path)  # 更新修改时间，淘汰时按最久未使用排序
+        return df
+
+    def _select(self, df, endpoint, ids, columns):
+        spec = ENDPOINTS[endpoint]
+        if ids is not None and spec["ids"]:
+            df = df[df.index.get_level_values("order_book_id").isin(ids)]
+        if columns is not None:
+            df = df[[c for c in columns if c in df.columns]]
+        return df
+
+    def get(self, endpoint, kwargs):
+        """返回缓存的响应，未命中时返回 None"""
+        if not self.enabled:
+            return None
+        paths = self._paths(endpoint, kwargs)
+        if paths is None:
+            return None
+        directory, name, param_key, ids, columns = paths
+
+        try:
+            # 完全相同的请求
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                self.hits += 1
+                return self._read(path)
+
+            # 由多个已缓存的批次拼出：每个文件包含全部所需的列，股票合起来覆盖本次请求
+            if ids is not None and os.path.isdir(directory):
+                wanted = set(ids)
+                files = []
+                for cached_name, entry in self._read_manifest(directory).items():
+                    if not cached_name.startswith(param_key + "-"):
+                        continue
+                    if columns is not None and not set(columns) <= set(entry["columns"] or []):
+                        continue
+                    overlap = wanted.intersection(entry["ids"] or [])
+                    if overlap and os.path.exists(os.path.join(directory, cached_name)):
+                        files.append(cached_name)
+                        wanted -= overlap
+                    if not wanted:
+                        break
+                if not wanted:
+                    frames = [self._select(self._read(os.path.join(directory, f)), endpoint, ids, columns)
+                              for f in files]
+                    self.hits += 1
+                    return pd.concat(frames).sort_index()
+        except Exception as e:
+            logging.warning(f"读取 rqdatac 缓存失败，改为请求接口: {e}")
+
+        self.misses += 1
+        return None
+
+    # ---------- 写入与淘汰 ----------
+    def put(self, endpoint, kwargs, df):
+        """保存响应，空结果不缓存"""
+        if not self.enabled or df is None or len(df) == 0:
+            return
+        paths = self._paths(endpoint, kwargs)
+        if paths is None:
+            return
+        directory, name, _, ids, columns = paths
+        path = os.path.join(directory, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            df.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+        except ImportError as e:
+            # 未安装 pyarrow/fastparquet 时关闭缓存
+            logging.warning(f"无法写入 Parquet，关闭 rqdatac 缓存: {e}")
+            self.enabled = False
+            return
+        except Exception as e:
+            logging.warning(f"写入 rqdatac 缓存 {path} 失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._write_manifest(directory, name, ids, columns)
+            if self._total_bytes is None:
+                self._total_bytes = self.size()
+            else:
+                self._total_bytes += os.path.getsize(path)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def size(self):
+        """缓存目录中 Parquet 文件的总大小（字节）"""
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            total += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames if f.endswith(".parquet"))
+        return total
+
+    def _evict(self):
+        """删除最久未使用的文件，直到总大小降到上限的 90%（调用方持有锁）"""
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for f in filenames:
+                if f.endswith(".parquet"):
+                    path = os.path.join(dirpath, f)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._total_bytes = total
+        logging.info(f"🧹 rqdatac 缓存淘汰 {removed} 个文件，当前 {total / 1024 ** 3:.2f} GB")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """返回进程内共享的响应缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,251 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+import logging
+import argparse
+from datetime import date
+import rqdatac
+from response_cache import get_cache
+import metrics
+
+# 跨进程共享的限速与配额状态（SQLite 文件，所有入库脚本使用同一个文件）
+QUOTA_DB = os.environ.get("RQ_QUOTA_DB", "rqdatac_quota.db")
+
+# 所有进程合计的请求速率（次/秒）和突发上限
+RATE = 10
+BURST = None
+
+# 每日调用次数上限，None 表示不限制（许可证按流量计费时以 license_quota() 为准）
+DAILY_QUOTA = None
+
+class QuotaExceeded(RuntimeError):
+    """当日调用次数已达到 DAILY_QUOTA"""
+
+# ============== 跨进程令牌桶 ==============
+class SharedRateLimiter:
+    """
+    基于 SQLite 的跨进程令牌桶
+
+    令牌数和上次补充时间保存在数据库中，每次取令牌在 BEGIN IMMEDIATE 事务内完成，
+    同一台机器上的所有进程、所有线程共享同一个速率上限。同时按 (日期, 任务) 记录调用次数、
+    返回行数和数据量，用于配额统计。
+    """
+
+    def __init__(self, path=QUOTA_DB, rate=RATE, burst=BURST, daily_quota=DAILY_QUOTA):
+        self.path = path
+        self.rate = rate
+        self.burst = burst or rate
+        self.daily_quota = daily_quota
+        self._local = threading.local()
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS bucket (id INTEGER PRIMARY KEY, tokens REAL, updated REAL)")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS usage (
+            day TEXT,
+            job TEXT,
+            calls INTEGER DEFAULT 0,
+            rows INTEGER DEFAULT 0,
+            bytes INTEGER DEFAULT 0,
+            PRIMARY KEY (day, job)
+        )
+        """)
+        conn.execute("INSERT OR IGNORE INTO bucket (id, tokens, updated) VALUES (0, ?, ?)",
+                     (self.burst, time.time()))
+
+    # ---------- 限速 ----------
+    def acquire(self, tokens=1, job="default"):
+        """阻塞直到取得 tokens 个令牌，并计入 job 当日的调用次数"""
+        conn = self._conn()
+        today = date.today().isoformat()
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.daily_quota is not None:
+                    used = conn.execute("SELECT COALESCE(SUM(calls), 0) FROM usage WHERE day = ?",
+                                        (today,)).fetchone()[0]
+                    if used + tokens > self.daily_quota:
+                        raise QuotaExceeded(f"rqdatac 当日调用次数已达上限 {self.daily_quota}")
+
+                available, updated = conn.execute("SELECT tokens, updated FROM bucket WHERE id = 0").fetchone()
+                now = time.time()
+                available = min(self.burst, available + max(0.0, now - updated) * self.rate)
+                if available >= tokens:
+                    conn.execute("UPDATE bucket SET tokens = ?, updated = ? WHERE id = 0",
+                                 (available - tokens, now))
+                    conn.execute("""
+                    INSERT INTO usage (day, job, calls) VALUES (?, ?, ?)
+                    ON CONFLICT (day, job) DO UPDATE SET calls = calls + excluded.calls
+                    """, (today, job, tokens))
+                    conn.execute("COMMIT")
+                    return
+                conn.execute("UPDATE bucket SET tokens = ?, updated = ? WHERE id = 0", (available, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            time.sleep((tokens - available) / self.rate)
+
+    def record(self, job, rows=0, nbytes=0):
+        """记录一次调用返回的行数和数据量"""
+        self._conn().execute("""
+        INSERT INTO usage (day, job, rows, bytes) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, job) DO UPDATE SET rows = rows + excluded.rows, bytes = bytes + excluded.bytes
+        """, (date.today().isoformat(), job, int(rows), int(nbytes)))
+
+    # ---------- 配额查询 ----------
+    def usage(self, day=None):
+        """指定日期（默认今天）各任务的用量：{job: {"calls", "rows", "bytes"}}"""
+        day = day or date.today().isoformat()
+        rows = self._conn().execute("SELECT job, calls, rows, bytes FROM usage WHERE day = ? ORDER BY job",
+                                    (day,)).fetchall()
+        return {job: {"calls": calls, "rows": n, "bytes": nbytes} for job, calls, n, nbytes in rows}
+
+    def remaining(self, day=None):
+        """当日剩余调用次数，未设置 DAILY_QUOTA 时返回 None"""
+        if self.daily_quota is None:
+            return None
+        used = sum(u["calls"] for u in self.usage(day).values())
+        return max(0, self.daily_quota - used)
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter():
+    """返回进程内共享的跨进程限速器"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = SharedRateLimiter()
+        return _limiter
+
+# 未指定 job 时计入的任务名，默认为入口脚本名
+_default_job = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+
+def set_job(name):
+    """设置本进程调用默认计入的任务名"""
+    global _default_job
+    _default_job = name
+
+def _size(result):
+    """返回结果的行数和内存占用（字节），非 DataFrame/列表时为 0"""
+    try:
+        if hasattr(result, "memory_usage"):
+            usage = result.memory_usage(index=True)
+            return len(result), int(usage.sum() if hasattr(usage, "sum") else usage)
+        return len(result), 0
+    except TypeError:
+        return 0, 0
+
+# ============== rqdatac 接口 ==============
+# 本线程上一次接口调用的耗时
+_last = threading.local()
+
+def last_elapsed():
+    """本线程上一次接口调用的耗时（秒），只计 rqdatac 调用本身，不含限速等待；由本地缓存返回时为 None"""
+    return getattr(_last, "elapsed", None)
+
+def call(func, *args, job=None, **kwargs):
+    """先从共享令牌桶取令牌，再调用 rqdatac 接口，并记录返回的数据量"""
+    job = job or _default_job
+    endpoint = getattr(func, "__name__", str(func))
+    limiter = get_limiter()
+    limiter.acquire(job=job)
+    started = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    except Exception:
+        metrics.inc("api_errors_total", endpoint=endpoint, job=job)
+        raise
+    finally:
+        _last.elapsed = time.perf_counter() - started
+        metrics.observe("api_request_seconds", _last.elapsed, endpoint=endpoint, job=job)
+    metrics.inc("api_requests_total", endpoint=endpoint, job=job, cached=0)
+    if result is not None:
+        rows, nbytes = _size(result)
+        limiter.record(job, rows, nbytes)
+        metrics.inc("api_rows_total", rows, endpoint=endpoint, job=job)
+        metrics.inc("api_bytes_total", nbytes, endpoint=endpoint, job=job)
+    return result
+
+def cached_call(endpoint, func, *args, job=None, cache=True, **kwargs):
+    """可缓存的接口：先查本地响应缓存，命中时不请求接口、不消耗配额"""
+    cache = cache and not args
+    if cache:
+        df = get_cache().get(endpoint, kwargs)
+        if df is not None:
+            _last.elapsed = None
+            metrics.inc("api_requests_total", endpoint=endpoint, job=job or _default_job, cached=1)
+            return df
+    result = call(func, *args, job=job, **kwargs)
+    if cache:
+        get_cache().put(endpoint, kwargs, result)
+    return result
+
+def get_factor(*args, job=None, cache=True, **kwargs):
+    return cached_call("get_factor", rqdatac.get_factor, *args, job=job, cache=cache, **kwargs)
+
+def get_price(*args, job=None, cache=True, **kwargs):
+    return cached_call("get_price", rqdatac.get_price, *args, job=job, cache=cache, **kwargs)
+
+def get_all_factor_names(*args, job=None, **kwargs):
+    return call(rqdatac.get_all_factor_names, *args, job=job, **kwargs)
+
+def all_instruments(*args, job=None, cache=True, **kwargs):
+    return cached_call("all_instruments", rqdatac.all_instruments, *args, job=job, cache=cache, **kwargs)
+
+def get_trading_dates(*args, job=None, **kwargs):
+    return call(rqdatac.get_trading_dates, *args, job=job, **kwargs)
+
+def license_quota():
+    """rqdatac 许可证的流量配额（rqdatac.user.get_quota），获取失败时返回 None"""
+    try:
+        return rqdatac.user.get_quota()
+    except Exception as e:
+        logging.warning(f"获取 rqdatac 许可证配额失败: {e}")
+        return None
+
+def log_usage(logger=None):
+    """输出今日各任务的调用次数、行数和剩余配额"""
+    logger = logger or logging.getLogger(__name__)
+    limiter = get_limiter()
+    for job, u in limiter.usage().items():
+        logger.info(f"📊 rqdatac 用量 {job}: 调用 {u['calls']} 次, {u['rows']} 行, {u['bytes'] / 1e6:.1f} MB")
+    remaining = limiter.remaining()
+    if remaining is not None:
+        logger.info(f"📊 rqdatac 今日剩余调用次数: {remaining}/{limiter.daily_quota}")
+    cache = get_cache()
+    if cache.hits or cache.misses:
+        logger.info(f"📊 rqdatac 本地缓存: 命中 {cache.hits} 次, 未命中 {cache.misses} 次")
+
+# ============== 主程序：查看配额 ==============
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='查看 rqdatac 调用用量和剩余配额')
+    parser.add_argument('--day', type=str, default=None, help='日期 (YYYY-MM-DD)，默认为今天')
+    parser.add_argument('--license', action='store_true', help='同时查询许可证流量配额（需要 rqdatac.init）')
+    args = parser.parse_args()
+
+    limiter = get_limiter()
+    usage = limiter.usage(args.day)
+    if not usage:
+        print("没有调用记录")
+    for job, u in usage.items():
+        print(f"{job:<24} 调用 {u['calls']:>8} 次  {u['rows']:>12} 行  {u['bytes'] / 1e6:>10.1f} MB")
+    remaining = limiter.remaining(args.day)
+    if remaining is not None:
+        print(f"剩余调用次数: {remaining}/{limiter.daily_quota}")
+    if args.license:
+        rqdatac.init()
+        print(f"许可证配额: {license_quota()}")
@@ -0,0 +1,88 @@
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ============== 函数：并发执行批次 ==============
+def run_batches(tasks, workers=1):
+    """执行一组无参任务，workers>1 时使用线程池并发执行，按提交顺序返回结果"""
+    if workers <= 1 or len(tasks) <= 1:
+        return [task() for task in tasks]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        return [future.result() for future in futures]
+
+# ============== 函数：并发调度交易日 ==============
+def run_trading_days(trading_dates, day_func, workers=1, logger=None):
+    """
+    按交易日调度 day_func，workers>1 时多个交易日并发处理
+
+    Args:
+        trading_dates (list): 交易日列表
+        day_func (callable): 处理单日的函数，参数为日期，返回是否成功
+        workers (int): 同时处理的交易日数量
+        logger (logging.Logger): 进度日志输出
+
+    Returns:
+        tuple: (成功天数, 失败日期列表)
+    """
+    logger = logger or logging.getLogger(__name__)
+    total = len(trading_dates)
+    success_count = 0
+    failed_dates = []
+
+    if workers <= 1:
+        for i, date in enumerate(trading_dates, 1):
+            logger.info(f"📈 进度: {i}/{total} - 处理日期: {date}")
+            if day_func(date):
+                success_count += 1
+            else:
+                failed_dates.append(date)
+        return success_count, failed_dates
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(day_func, date): date for date in trading_dates}
+        for i, future in enumerate(as_completed(futures), 1):
+            date = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                logger.error(f"❌ {date} 处理异常: {e}")
+                ok = False
+            if ok:
+                success_count += 1
+            else:
+                failed_dates.append(date)
+            logger.info(f"📈 进度: {i}/{total} - 完成日期: {date}")
+
+    # 保持失败日期按时间顺序，便于重试
+    failed_dates.sort()
+    return success_count, failed_dates
+
+# ============== 多日窗口大小控制 ==============
+class WindowSizer:
+    """多日窗口请求的窗口大小控制：响应过大或请求失败时减半，响应较小时逐步恢复到上限"""
+
+    def __init__(self, size, max_cells=2000000):
+        """
+        Args:
+            size (int): 每次请求包含的交易日数量上限
+            max_cells (int): 单次响应允许的最大单元格数（行数 × 列数）
+        """
+        self.max_size = max(1, int(size))
+        self.size = self.max_size
+        self.max_cells = max_cells
+        self._lock = threading.Lock()
+
+    def observe(self, n_cells):
+        """根据一次响应的大小调整窗口"""
+        with self._lock:
+            if n_cells > self.max_cells:
+                self.size = max(1, self.size // 2)
+            elif n_cells * 4 < self.max_cells and self.size < self.max_size:
+                self.size = min(self.max_size, self.size * 2)
+
+    def shrink(self):
+        """请求失败（超时、响应过大）时缩小窗口"""
+        with self._lock:
+            self.size = max(1, self.size // 2)
@@ -1,34 +1,23 @@
+import numpy as np
 import pandas as pd
-import pymysql
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect, text
+from sqlalchemy.types import VARCHAR
 import rqdatac
 from datetime import datetime, timedelta
 import time
 import logging
 import argparse
-
-# ================== 数据库连接类 ==================
-class DataBase_Position:
-    """MySQL 数据库连接"""
-    __HOST = ""
-    __PORT = 3306
-    __USERNAME = ""
-    __PASSWORD = ""
-    __SCHEMA_OTC = ""
-
-    def __init__(self):
-        self.conn = pymysql.connect(
-            host=DataBase_Position.__HOST,
-            port=DataBase_Position.__PORT,
-            user=DataBase_Position.__USERNAME,
-            password=DataBase_Position.__PASSWORD,
-            charset="utf8",
-            database=DataBase_Position.__SCHEMA_OTC
-        )
-        self.engine = create_engine(
-            f"mysql+pymysql://{DataBase_Position.__USERNAME}:{DataBase_Position.__PASSWORD}@"
-            f"{DataBase_Position.__HOST}:{DataBase_Position.__PORT}/{DataBase_Position.__SCHEMA_OTC}?charset=utf8mb4"
-        )
+from bulk_writer import ensure_table, write_frame, require_primary_key
+from trading_calendar import get_calendar
+from universe import get_universe
+from pipeline import Pipeline, Stage
+from batch_sizer import get_batch_sizer
+from panel_store import PanelStore
+from factor_schema import ensure_partitions, setup_new_table
+from checkpoint import get_journal, journal_job, verify_dates
+from database import DataBase_Position
+import rq_api
+import metrics
 
 # ================== 获取股票列表 ==================
 def get_stock_list(db: DataBase_Position):
@@ -36,26 +25,20 @@ def get_stock_list(db: DataBase_Position):
     return pd.read_sql("SELECT order_book_id FROM stock_info", con=db.engine)["order_book_id"].tolist()
 
 def get_all_stocks_from_rqdatac(target_date):
-    """从rqdatac获取所有股票列表"""
+    """从股票池索引获取指定日期的所有股票，索引由一次 all_instruments 调用构建"""
     try:
-        all_stocks = rqdatac.all_instruments(type='CS', market='cn', date=target_date)['order_book_id'].tolist()
-        return all_stocks
+        return get_universe().active(target_date)
     except Exception as e:
         logging.error(f"获取股票列表失败: {e}")
         return []
 
 # ============== 函数：获取交易日列表 ==============
 def get_trading_dates(start_date, end_date):
-    """使用rqdatac获取真实的交易日列表"""
+    """从本地交易日历缓存获取真实的交易日列表，缓存未覆盖的区间才请求rqdatac"""
     try:
-        # 将日期格式从 'YYYYMMDD' 转换为 'YYYY-MM-DD'
-        start_date_str = start_date[:4] + '-' + start_date[4:6] + '-' + start_date[6:8]
-        end_date_str = end_date[:4] + '-' + end_date[4:6] + '-' + end_date[6:8]
-        
-        # 使用rqdatac获取交易日列表
-        trade_dt_list = rqdatac.get_trading_dates(start_date=start_date, end_date=end_date)
+        trade_dt_list = get_calendar().range(start_date, end_date)
         
-        # 将datetime对象转换为字符串格式 'YYYYMMDD'
+        # 将date对象转换为字符串格式 'YYYYMMDD'
         date_list = [dt.strftime('%Y%m%d') for dt in trade_dt_list]
         
         return date_list
@@ -86,47 +69,280 @@ def get_trading_dates_fallback(start_date, end_date):
         logging.error(f"回退方法获取交易日失败: {e}")
         return []
 
-# ================== 获取单日行情数据 ==================
+# ================== 获取行情数据 ==================
 def get_daily_price_data_batch(all_stocks, target_date, max_retry=3, retry_wait=3):
     """
     从 rqdatac 批量拉取单日行情数据，支持重试，防止返回 None 导致报错
+
+    股票按自适应批次大小分批请求：请求顺利时批次增大，超时或失败时减半，调整结果在多次运行之间保留
     """
-    for attempt in range(1, max_retry + 1):
-        try:
-            df = rqdatac.get_price(
-                order_book_ids=all_stocks,
-                start_date=target_date,
-                end_date=target_date,
-                frequency="1d",
-                fields=None,
-                adjust_type="none",
-                skip_suspended=False,
-                market="cn",
-                expect_df=True
-            )
-            # 处理返回 None 的情况
-            if df is None or len(df) == 0:
-                logging.warning(f"所有股票 {target_date} 没有数据 (返回 None)")
-                return pd.DataFrame()
-
-            df = df.reset_index().rename(columns={"index": "date"})
-            # 将日期格式转换为YYYYMMDD
-            df["date"] = df["date"].dt.strftime("%Y%m%d")
-            return df
+    sizer = get_batch_sizer("get_price:1d", initial=len(all_stocks) or 100, max_size=10000)
+    return get_price_data_batch(all_stocks, target_date, target_date, sizer, max_retry, retry_wait)
 
-        except Exception as e:
-            logging.error(f"第 {attempt} 次批量获取 {target_date} 数据失败: {e}")
-            if attempt < max_retry:
-                logging.info(f"等待 {retry_wait} 秒后重试...")
-                time.sleep(retry_wait)
-            else:
-                logging.error(f"批量获取 {target_date} 数据失败")
-                return pd.DataFrame()
+def get_window_price_data_batch(all_stocks, start_date, end_date, max_retry=3, retry_wait=3):
+    """拉取 [start_date, end_date] 多个交易日的行情，每只股票批次一次请求整个窗口"""
+    sizer = get_batch_sizer("get_price:1d:window", initial=min(len(all_stocks), 500) or 100, max_size=10000)
+    return get_price_data_batch(all_stocks, start_date, end_date, sizer, max_retry, retry_wait)
+
+def get_price_data_batch(all_stocks, start_date, end_date, sizer, max_retry=3, retry_wait=3):
+    """
+    按 sizer 的批次大小分批请求 get_price，返回 order_book_id, date（YYYYMMDD）及各字段列
+
+    某个批次重试后仍失败时跳过该批次，保留其他批次的数据；调用方按返回的 (股票, 日期) 判断是否完整
+    """
+    label = start_date if start_date == end_date else f"{start_date}~{end_date}"
+    frames = []
+    failed = 0
+    pos = 0
+    while pos < len(all_stocks):
+        stock_batch = all_stocks[pos:pos + sizer.size]
+        df = None
+        for attempt in range(1, max_retry + 1):
+            try:
+                df = rq_api.get_price(
+                    order_book_ids=stock_batch,
+                    start_date=start_date,
+                    end_date=end_date,
+                    frequency="1d",
+                    fields=None,
+                    adjust_type="none",
+                    skip_suspended=False,
+                    market="cn",
+                    expect_df=True,
+                    job="stock_price"
+                )
+                elapsed = rq_api.last_elapsed()
+                if df is not None and len(df) > 0 and elapsed is not None:
+                    # 只按接口本身的耗时调整批次，不含令牌桶的等待；本地缓存命中时不调整
+                    sizer.observe(len(stock_batch), elapsed, df.size)
+                break
+
+            except Exception as e:
+                sizer.failure(e)
+                metrics.inc("retries_total", job="stock_price", operation="fetch")
+                logging.error(f"第 {attempt} 次批量获取 {label} 数据失败: {e}")
+                # 批次缩小后按新的大小重新切分剩余股票
+                if len(stock_batch) > sizer.size:
+                    stock_batch = all_stocks[pos:pos + sizer.size]
+                if attempt < max_retry:
+                    logging.info(f"等待 {retry_wait} 秒后重试...")
+                    time.sleep(retry_wait)
+                else:
+                    logging.error(f"批量获取 {label} 数据失败，跳过 {len(stock_batch)} 只股票")
+                    failed += len(stock_batch)
+
+        pos += len(stock_batch)
+        # 处理返回 None 的情况
+        if df is not None and len(df) > 0:
+            frames.append(df)
+
+    if failed:
+        logging.error(f"{label} 共 {failed}/{len(all_stocks)} 只股票获取失败")
+    if not frames:
+        logging.warning(f"所有股票 {label} 没有数据 (返回 None)")
+        return pd.DataFrame()
+
+    df = pd.concat(frames).reset_index().rename(columns={"index": "date"})
+    # 将日期格式转换为YYYYMMDD
+    df["date"] = df["date"].dt.strftime("%Y%m%d")
+    return df
 
 # ================== 插入数据库 ==================
-def insert_data(df, table_name, db: DataBase_Position, chunksize=2000):
-    """分批写入 MySQL"""
-    df.to_sql(name=table_name, con=db.engine, if_exists="append", index=False, chunksize=chunksize)
+# stock_price 表的主键、分区粒度（"year"/"month"，None 不分区）和二级索引，date 为 'YYYYMMDD' 字符串
+PRIMARY_KEY = ["order_book_id", "date"]
+KEY_TYPES = {"order_book_id": VARCHAR(20), "date": VARCHAR(8)}
+PARTITION_GRANULARITY = "year"
+DATE_FORMAT = "%Y%m%d"
+# “某日全部股票”的查询使用 date 索引
+INDEXES = [("idx_date", ["date"])]
+
+def insert_data(df, table_name, db: DataBase_Position, chunksize=None, method=None, on_duplicate="update"):
+    """
+    分批写入 MySQL，默认 LOAD DATA LOCAL INFILE，method="insert" 时使用多行 INSERT
+
+    新建的表以 (order_book_id, date) 为主键，默认按主键覆盖更新，重复写入同一天的数据是安全的。
+    没有主键的旧表写入时报错，需先运行 python migrate.py --tables stock_price --steps primary_key；
+    新建的表直接按年分区并建立 date 索引，旧表的分区和索引同样通过 migrate.py 添加
+    """
+    if not inspect(db.engine).has_table(table_name):
+        ensure_table(df, table_name, db.engine, primary_key=PRIMARY_KEY, dtype=KEY_TYPES)
+        setup_new_table(db, table_name, PARTITION_GRANULARITY, DATE_FORMAT, INDEXES,
+                        start_date=df["date"].min(), end_date=df["date"].max())
+    ensure_partitions(db, table_name, df["date"].min(), df["date"].max(),
+                      granularity=PARTITION_GRANULARITY, date_format=DATE_FORMAT)
+    write_frame(df, table_name, db.engine, method=method, chunksize=chunksize, on_duplicate=on_duplicate)
+
+# ================== 已入库数据 ==================
+# 每次查询已存在 (股票, 日期) 的交易日数量
+KEY_WINDOW = 20
+
+class StoredKeys:
+    """按交易日窗口批量查询表中已存在的股票，一个窗口只查询一次数据库"""
+
+    def __init__(self, db, table_name, date_list, window=KEY_WINDOW):
+        self.db = db
+        self.table_name = table_name
+        self.date_list = list(date_list)
+        self.window = window
+        self._keys = {}
+        self._exists = inspect(db.engine).has_table(table_name)
+
+    def _load(self, date_str):
+        if date_str in self.date_list:
+            start = self.date_list.index(date_str)
+            dates = self.date_list[start:start + self.window]
+        else:
+            dates = [date_str]
+        for d in dates:
+            self._keys.setdefault(d, set())
+        if not self._exists:
+            return
+        try:
+            sql = text(f"SELECT date, order_book_id FROM {self.table_name} WHERE date BETWEEN :start AND :end")
+            existing = pd.read_sql(sql, con=self.db.engine, params={"start": min(dates), "end": max(dates)})
+        except Exception as e:
+            logging.warning(f"查询 {dates[0]}~{dates[-1]} 已存在数据时出错: {e}，按全部缺失处理")
+            return
+        for d, codes in existing.groupby(existing["date"].astype(str))["order_book_id"]:
+            if d in self._keys:
+                self._keys[d] = set(codes)
+
+    def pop(self, date_str):
+        """返回该交易日已入库的股票集合，并释放其内存"""
+        if date_str not in self._keys:
+            self._load(date_str)
+        return self._keys.pop(date_str, set())
+
+def _panel_has_date(panel, date_str):
+    """行情面板中该交易日是否已有数据"""
+    if "close" not in panel.fields:
+        return False
+    arr = panel.field("close", date_str, date_str)
+    return arr.size > 0 and bool(np.isfinite(arr).any())
+
+def fill_panel_from_db(panel, db, table_name, dates):
+    """面板中缺少的已入库交易日从数据表一次读出补齐，不请求接口"""
+    dates = [d for d in dates if not _panel_has_date(panel, d)]
+    if not dates:
+        return 0
+    sql = text(f"SELECT * FROM {table_name} WHERE date BETWEEN :start AND :end")
+    stored_df = pd.read_sql(sql, con=db.engine, params={"start": min(dates), "end": max(dates)})
+    stored_df = stored_df[stored_df["date"].astype(str).isin(dates)]
+    return panel.write_frame(stored_df)
+
+def skip_done_dates(db, table_name, date_list, panel=None):
+    """
+    去掉进度日志中已完成的交易日，这些日期不再查询已入库数据、不请求接口；
+    日志按数据库和表名区分，并核对数据表中仍有这些日期的数据。行情面板缺少的已完成交易日仍从数据表补齐
+
+    Returns:
+        list: 尚未完成的交易日
+    """
+    job = journal_job(db, table_name)
+    done = verify_dates(db, table_name, job, get_journal().done_dates(job, date_list[0], date_list[-1]))
+    if not done:
+        return date_list
+    logging.info(f"进度日志中 {len(done)} 个交易日已完成，跳过")
+    if panel is not None:
+        done_list = [d for d in date_list if d in done]
+        for i in range(0, len(done_list), KEY_WINDOW):
+            try:
+                fill_panel_from_db(panel, db, table_name, done_list[i:i + KEY_WINDOW])
+            except Exception as e:
+                logging.error(f"{done_list[i]} 起的已完成交易日写入行情面板失败: {e}")
+    return [d for d in date_list if d not in done]
+
+# ================== 多日窗口回补 ==================
+# 回补模式每个窗口包含的交易日数量（约一个月），以及每次写入的行数
+BACKFILL_WINDOW = 20
+BACKFILL_CHUNKSIZE = 500000
+
+def backfill_windows(db, table_name, date_list, window_size=BACKFILL_WINDOW, panel=None, counts=None,
+                     fetch_workers=1, queue_size=2, chunksize=BACKFILL_CHUNKSIZE):
+    """
+    按交易日窗口回补行情：每个窗口一次查询已入库数据，每个股票批次一次 get_price 请求整个窗口，
+    每个窗口一次批量写入。窗口内全部已入库时不请求接口
+
+    Returns:
+        dict: counts（total_inserted / success / fail）
+    """
+    counts = counts if counts is not None else {"total_inserted": 0, "success": 0, "fail": 0}
+    journal, job = get_journal(), journal_job(db, table_name)
+    windows = [date_list[i:i + window_size] for i in range(0, len(date_list), window_size)]
+    stored_keys = StoredKeys(db, table_name, date_list, window=window_size)
+    universe = get_universe()
+    
+    def diff_stage(window):
+        label = f"{window[0]}~{window[-1]}"
+        active = universe.active_range(window)
+        missing, stored_dates = {}, []
+        for date_str in window:
+            stored = stored_keys.pop(date_str)
+            if stored:
+                stored_dates.append(date_str)
+            codes = [code for code in active[date_str] if code not in stored]
+            if codes:
+                missing[date_str] = codes
+        if not missing:
+            logging.info(f"{label} 数据都已存在，跳过接口请求")
+        else:
+            n_missing = sum(len(codes) for codes in missing.values())
+            logging.info(f"{label} 共 {len(missing)} 个交易日缺少数据，缺失 {n_missing} 行")
+        return window, missing, stored_dates
+    
+    def fetch_stage(item):
+        window, missing, stored_dates = item
+        label = f"{window[0]}~{window[-1]}"
+        if not missing:
+            return window, pd.DataFrame(), stored_dates, list(window)
+        
+        # 请求缺失股票在缺失日期区间内的全部数据，再只保留缺失的 (股票, 日期)
+        stocks = sorted({code for codes in missing.values() for code in codes})
+        df = get_window_price_data_batch(stocks, min(missing), max(missing))
+        complete_dates = [d for d in window if d not in missing]
+        if df.empty:
+            logging.info(f"{label} 没有数据")
+            return window, df, stored_dates, complete_dates
+        wanted = pd.MultiIndex.from_tuples([(code, d) for d, codes in missing.items() for code in codes])
+        df = df[pd.MultiIndex.from_arrays([df["order_book_id"], df["date"]]).isin(wanted)]
+        # 返回的 (股票, 日期) 覆盖了全部缺失的交易日才算完成
+        returned = df.groupby("date")["order_book_id"].agg(set).to_dict()
+        complete_dates += [d for d, codes in missing.items() if set(codes) <= returned.get(d, set())]
+        return window, df.reset_index(drop=True), stored_dates, complete_dates
+    
+    def write_stage(item):
+        window, df, stored_dates, complete_dates = item
+        label = f"{window[0]}~{window[-1]}"
+        rows = 0
+        if not df.empty:
+            try:
+                insert_data(df, table_name, db, chunksize=chunksize)
+                counts["total_inserted"] += len(df)
+                counts["success"] += len(df)
+                logging.info(f"{label} 成功插入 {len(df)} 行数据")
+                rows = len(df)
+            except Exception as e:
+                logging.error(f"{label} 插入失败: {e}")
+                counts["fail"] += len(df)
+                written = set(df["date"])
+                complete_dates = [d for d in complete_dates if d not in written]
+        # 接口没有返回全部缺失数据（请求失败、数据缺失）或写入失败的交易日不记为完成，下次运行重新处理
+        journal.commit_days(job, sorted(complete_dates))
+        
+        if panel is not None:
+            try:
+                fill_panel_from_db(panel, db, table_name, stored_dates)
+                panel.write_frame(df)
+            except Exception as e:
+                logging.error(f"{label} 写入行情面板失败: {e}")
+        return rows
+    
+    Pipeline([
+        Stage("diff", diff_stage, count=lambda out: sum(len(codes) for codes in out[1].values())),
+        Stage("fetch", fetch_stage, workers=fetch_workers, count=lambda out: len(out[1])),
+        Stage("write", write_stage, count=lambda rows: rows),
+    ], queue_size=queue_size, name="stock_price_backfill").run(windows)
+    return counts
 
 # ================== 日期验证函数 ==================
 def validate_date(date_str, param_name="日期"):
@@ -151,13 +367,19 @@ def validate_date(date_str, param_name="日期"):
         exit(1)
 
 # ================== 按天轮询主程序 ==================
-def daily_polling_main(start_date=None, end_date=None):
+def daily_polling_main(start_date=None, end_date=None, trading_days=None, fetch_workers=1, queue_size=2,
+                       update_panel=True, window_size=1):
     """
     按天轮询的主程序
     
     Args:
         start_date (str): 开始日期，格式 'YYYYMMDD'，默认为昨天
         end_date (str): 结束日期，格式 'YYYYMMDD'，默认为今天
+        trading_days (int): 指定后忽略 start_date，处理截至 end_date 的最近 N 个交易日
+        fetch_workers (int): 同时拉取的交易日数量，比对和写入始终为单线程
+        queue_size (int): 各阶段之间最多积压的交易日数量，限制内存占用
+        update_panel (bool): 同时更新 panel_store 的内存映射行情面板
+        window_size (int): 大于 1 时为回补模式，每次请求和写入 window_size 个交易日（见 backfill_windows）
     """
     # 配置日志
     logging.basicConfig(
@@ -172,7 +394,11 @@ def daily_polling_main(start_date=None, end_date=None):
     # 设置默认日期
     if end_date is None:
         end_date = datetime.today().strftime("%Y%m%d")
-    if start_date is None:
+    if trading_days is not None:
+        # 由交易日历推算开始日期（缓存未覆盖时会请求rqdatac，因此先初始化）
+        rqdatac.init()
+        start_date = get_calendar().last_n(end_date, trading_days)[0].strftime("%Y%m%d")
+    elif start_date is None:
         start_date = (datetime.today() - timedelta(days=1)).strftime("%Y%m%d")
     
     # 验证日期格式
@@ -189,9 +415,13 @@ def daily_polling_main(start_date=None, end_date=None):
         return
     
     db = DataBase_Position()
-    rqdatac.init()
-
     table_name = "stock_price"
+    # 按主键覆盖写入需要主键：没有主键的旧表在请求接口之前直接失败，避免拉取的数据全部写入失败
+    if inspect(db.engine).has_table(table_name):
+        require_primary_key(db.engine, table_name)
+
+    if trading_days is None:
+        rqdatac.init()
     
     logging.info(f"开始轮询 {start_date} 到 {end_date} 的数据")
     
@@ -203,64 +433,104 @@ def daily_polling_main(start_date=None, end_date=None):
     
     logging.info(f"获取到 {len(date_list)} 个交易日")
     
-    total_inserted = 0
-    success_count = 0
-    fail_count = 0
+    counts = {"total_inserted": 0, "success": 0, "fail": 0}
     
-    # 按交易日循环处理
-    for date_str in date_list:
+    try:
+        panel = PanelStore(mode="r+") if update_panel else None
+    except Exception as e:
+        logging.error(f"打开行情面板失败，本次不更新面板: {e}")
+        panel = None
+    
+    # 进度日志中已完成的交易日直接跳过，中断后重新运行从第一个未完成的交易日继续
+    date_list = skip_done_dates(db, table_name, date_list, panel)
+    if not date_list:
+        logging.info("所有交易日都已完成")
+        return
+    
+    if window_size > 1:
+        backfill_windows(db, table_name, date_list, window_size, panel, counts, fetch_workers, queue_size)
+        logging.info(f"窗口回补完成 - 成功: {counts['success']}, 失败: {counts['fail']}, 共插入: {counts['total_inserted']} 行")
+        rq_api.log_usage()
+        return
+    
+    stored_keys = StoredKeys(db, table_name, date_list)
+    journal, job = get_journal(), journal_job(db, table_name)
+    
+    # 按交易日流水线处理：先比对已入库的股票，只请求缺失的部分；拉取下一个交易日的同时写入上一个交易日
+    def diff_stage(date_str):
         logging.info(f"处理交易日: {date_str}")
         
         # 1. 获取该日期的所有股票列表
         all_stocks = get_all_stocks_from_rqdatac(date_str)
         if not all_stocks:
             logging.warning(f"{date_str} 没有获取到股票列表")
-            continue
+            return None
         
-        logging.info(f"{date_str} 获取到 {len(all_stocks)} 只股票")
+        # 2. 过滤掉已存在的股票（已存在的 (股票, 日期) 按窗口一次查出）
+        stored = stored_keys.pop(date_str)
+        missing = [code for code in all_stocks if code not in stored]
+        if not missing:
+            logging.info(f"{date_str} {len(all_stocks)} 只股票都已存在，跳过接口请求")
+        elif stored:
+            logging.info(f"{date_str} 过滤掉 {len(all_stocks) - len(missing)} 只已存在的股票，剩余 {len(missing)} 只股票")
+        else:
+            logging.info(f"{date_str} 没有已存在的数据，处理所有 {len(missing)} 只股票")
+        return date_str, missing, len(stored)
+    
+    def fetch_stage(item):
+        date_str, missing, n_stored = item
         
-        # 2. 批量拉取该日期的所有股票数据
-        df_all = get_daily_price_data_batch(all_stocks, date_str)
-        if df_all.empty:
+        # 3. 批量拉取缺失股票的数据
+        df_new = get_daily_price_data_batch(missing, date_str) if missing else pd.DataFrame()
+        if missing and df_new.empty:
             logging.info(f"{date_str} 没有数据")
-            continue
-        
-        # 3. 检查哪些股票数据已存在，过滤掉已存在的数据
-        existing_data = set()
-        try:
-            check_sql = f"""
-            SELECT DISTINCT order_book_id 
-            FROM {table_name} 
-            WHERE date='{date_str}'
-            """
-            existing_result = pd.read_sql(check_sql, con=db.engine)
-            existing_data = set(existing_result["order_book_id"].tolist())
-        except Exception as e:
-            logging.warning(f"检查已存在数据时出错: {e}，继续处理所有数据")
-        
-        # 4. 过滤掉已存在的数据
-        if existing_data:
-            df_filtered = df_all[~df_all["order_book_id"].isin(existing_data)]
-            logging.info(f"{date_str} 过滤掉 {len(existing_data)} 只已存在的股票，剩余 {len(df_filtered)} 只股票")
-        else:
-            df_filtered = df_all
-            logging.info(f"{date_str} 没有已存在的数据，处理所有 {len(df_filtered)} 只股票")
+        # 返回的股票覆盖了全部缺失的股票才算完成
+        complete = not missing or (not df_new.empty and set(missing) <= set(df_new["order_book_id"]))
+        if not complete and not df_new.empty:
+            logging.warning(f"{date_str} 有 {len(set(missing) - set(df_new['order_book_id']))} 只股票没有返回数据，"
+                            f"不记入进度日志")
+        return date_str, df_new, n_stored, complete
+    
+    def write_stage(item):
+        date_str, df_new, n_stored, complete = item
         
-        if df_filtered.empty:
-            logging.info(f"{date_str} 所有数据都已存在，跳过")
-            continue
+        # 4. 批量插入新数据（单线程写入，计数无需加锁）
+        rows = 0
+        if not df_new.empty:
+            try:
+                insert_data(df_new, table_name, db)
+                counts["total_inserted"] += len(df_new)
+                counts["success"] += len(df_new)
+                logging.info(f"{date_str} 成功插入 {len(df_new)} 行数据")
+                rows = len(df_new)
+            except Exception as e:
+                logging.error(f"{date_str} 插入失败: {e}")
+                counts["fail"] += len(df_new)
+                complete = False
+        # 该交易日的数据已全部入库，记入进度日志
+        if complete:
+            journal.commit_days(job, [date_str])
         
-        # 5. 批量插入新数据
-        try:
-            insert_data(df_filtered, table_name, db)
-            total_inserted += len(df_filtered)
-            success_count += len(df_filtered)
-            logging.info(f"{date_str} 成功插入 {len(df_filtered)} 行数据")
-        except Exception as e:
-            logging.error(f"{date_str} 插入失败: {e}")
-            fail_count += len(df_filtered)
+        # 5. 同步更新内存映射行情面板；面板缺少的已入库数据从数据表补齐，不请求接口
+        if panel is not None:
+            try:
+                if n_stored:
+                    fill_panel_from_db(panel, db, table_name, [date_str])
+                panel.write_frame(df_new)
+            except Exception as e:
+                logging.error(f"{date_str} 写入行情面板失败: {e}")
+        return rows
+    
+    Pipeline([
+        Stage("diff", diff_stage, count=lambda out: len(out[1])),
+        Stage("fetch", fetch_stage, workers=fetch_workers, count=lambda out: len(out[1])),
+        Stage("write", write_stage, count=lambda rows: rows),
+    ], queue_size=queue_size, name="stock_price").run(date_list)
+    
+    total_inserted, success_count, fail_count = counts["total_inserted"], counts["success"], counts["fail"]
 
     logging.info(f"交易日轮询完成 - 成功: {success_count}, 失败: {fail_count}, 共插入: {total_inserted} 行")
+    rq_api.log_usage()
 
 if __name__ == "__main__":
     # 在脚本内设置开始日期参数
@@ -274,7 +544,8 @@ if __name__ == "__main__":
 使用示例:
   python stock_price.py                                    # 默认：{START_DATE}到今天
   python stock_price.py --end-date 20240105               # 从{START_DATE}到指定日期
-  python stock_price.py --days 7                          # 最近7天
+  python stock_price.py --days 7                          # 最近7个交易日
+  python stock_price.py --backfill --window 20 --workers 2 # 按 20 个交易日的窗口回补全部历史
         """
     )
     
@@ -286,22 +557,42 @@ if __name__ == "__main__":
     parser.add_argument(
         '--days', 
         type=int, 
-        help='从结束日期往前推的天数。例如: --days 7 表示最近7天'
+        help='从结束日期往前推的交易日数。例如: --days 7 表示最近7个交易日'
+    )
+    
+    parser.add_argument(
+        '--backfill',
+        action='store_true',
+        help='回补模式：按多日窗口请求和写入，适合补齐长时间段的历史数据'
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=BACKFILL_WINDOW,
+        help=f'回补模式每个窗口的交易日数，默认 {BACKFILL_WINDOW}'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='同时拉取的交易日（回补模式为窗口）数量，默认 1'
     )
     
     args = parser.parse_args()
+    window_size = args.window if args.backfill else 1
     
-    # 处理参数
+    # 处理参数：--days 按交易日计算，开始日期在主程序中由交易日历推算
     if args.days is not None:
         if args.days <= 0:
             print("错误: --days 必须大于0")
             exit(1)
         end_date = args.end_date or datetime.today().strftime("%Y%m%d")
-        end_dt = validate_date(end_date, "结束日期")
-        start_date = (end_dt - timedelta(days=args.days-1)).strftime("%Y%m%d")
+        validate_date(end_date, "结束日期")
+        with metrics.run_metrics("stock_price"):
+            daily_polling_main(end_date=end_date, trading_days=args.days, fetch_workers=args.workers,
+                               window_size=window_size)
     else:
-        start_date = START_DATE
-        end_date = args.end_date
-    
-    # 运行主程序
-    daily_polling_main(start_date=start_date, end_date=end_date)
+        # 运行主程序
+        with metrics.run_metrics("stock_price"):
+            daily_polling_main(start_date=START_DATE, end_date=args.end_date, fetch_workers=args.workers,
+                               window_size=window_size)
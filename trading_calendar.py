@@ -0,0 +1,190 @@
+import os
+import json
+import threading
+import logging
+from datetime import date, datetime, timedelta
+import rq_api
+
+# 本地交易日历缓存文件
+CALENDAR_FILE = "trading_calendar.json"
+
+# 首次建立缓存时的起始日期
+CALENDAR_START = date(2000, 1, 1)
+
+def to_date(value):
+    """将 'YYYY-MM-DD' / 'YYYYMMDD' 字符串、datetime 或 date 统一转换为 date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    return datetime.strptime(value, "%Y-%m-%d" if "-" in value else "%Y%m%d").date()
+
+# ============== 交易日历 ==============
+class TradingCalendar:
+    """
+    本地持久化的交易日历，按需从 rqdatac 增量补充缺失的区间
+
+    交易日保存在有序列表中，另外为覆盖区间内的每个自然日预先计算
+    “该日及之后第一个交易日”的位置，因此 next/prev/offset/range 查找都是 O(1)。
+    """
+
+    def __init__(self, path=CALENDAR_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        # (覆盖的第一个自然日, 覆盖的最后一个自然日, 交易日列表, 自然日位置索引)
+        # 整体替换，读取方无需加锁
+        self._state = None
+        self._load()
+
+    # ---------- 持久化 ----------
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            days = [to_date(d) for d in data["dates"]]
+            self._state = self._build(to_date(data["start"]), to_date(data["end"]), days)
+        except Exception as e:
+            logging.warning(f"读取交易日历缓存 {self.path} 失败，将重新获取: {e}")
+
+    def _save(self):
+        start, end, days, _ = self._state
+        data = {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "dates": [d.isoformat() for d in days],
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _build(start, end, days):
+        """为覆盖区间内每个自然日计算“该日及之后第一个交易日”在 days 中的位置"""
+        pos = []
+        i = 0
+        for offset in range((end - start).days + 1):
+            current = start + timedelta(days=offset)
+            while i < len(days) and days[i] < current:
+                i += 1
+            pos.append(i)
+        return start, end, days, pos
+
+    # ---------- 增量刷新 ----------
+    def _fetch(self, start, end):
+        trade_dt_list = rq_api.get_trading_dates(start_date=start.strftime("%Y%m%d"),
+                                                 end_date=end.strftime("%Y%m%d"),
+                                                 job="trading_calendar")
+        return [to_date(d) for d in trade_dt_list]
+
+    def ensure(self, start, end):
+        """保证缓存覆盖 [start, end]，只向 rqdatac 请求尚未缓存的部分"""
+        start, end = to_date(start), to_date(end)
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] <= start and end <= state[1]:
+                return
+
+            if state is None:
+                new_start = min(start, CALENDAR_START)
+                new_end = max(end, date.today())
+                days = self._fetch(new_start, new_end)
+            else:
+                old_start, old_end, days, _ = state
+                new_start = min(start, old_start)
+                new_end = max(end, old_end)
+                if new_start < old_start:
+                    days = self._fetch(new_start, old_start - timedelta(days=1)) + days
+                if new_end > old_end:
+                    days = days + self._fetch(old_end + timedelta(days=1), new_end)
+
+            self._state = self._build(new_start, new_end, days)
+            self._save()
+            logging.info(f"📆 交易日历已更新: {new_start} 到 {new_end}，共 {len(days)} 个交易日")
+
+    # ---------- 查询 ----------
+    def _locate(self, d):
+        """返回 (交易日列表, d 及之后第一个交易日的位置)"""
+        self.ensure(d, d)
+        start, _, days, pos = self._state
+        return days, pos[(d - start).days]
+
+    def _extend(self, d, n_days):
+        """向后扩展缓存，扩展后仍没有新的交易日时报错"""
+        before = len(self._state[2])
+        self.ensure(d, self._state[1] + timedelta(days=n_days))
+        if len(self._state[2]) == before:
+            raise ValueError(f"{d} 之后的交易日历尚未公布")
+
+    def is_trading_day(self, d):
+        d = to_date(d)
+        days, i = self._locate(d)
+        return i < len(days) and days[i] == d
+
+    def next(self, d):
+        """d 之后（不含 d）的第一个交易日"""
+        d = to_date(d)
+        days, i = self._locate(d)
+        if i < len(days) and days[i] == d:
+            i += 1
+        if i >= len(days):
+            self._extend(d, 30)
+            return self.next(d)
+        return days[i]
+
+    def prev(self, d):
+        """d 之前（不含 d）的最后一个交易日"""
+        d = to_date(d)
+        days, i = self._locate(d)
+        if i == 0:
+            raise ValueError(f"{d} 之前没有交易日缓存")
+        return days[i - 1]
+
+    def offset(self, d, n):
+        """
+        从 d 起第 n 个交易日，n 可为负数
+
+        d 不是交易日时，n>0 从 d 之前的最后一个交易日起算，n<0 从 d 之后的第一个交易日起算，
+        n=0 返回 d 及之后的第一个交易日。
+        """
+        d = to_date(d)
+        days, i = self._locate(d)
+        if n > 0 and not (i < len(days) and days[i] == d):
+            i -= 1
+        target = i + n
+        if target < 0:
+            raise ValueError(f"{d} 向前 {-n} 个交易日超出交易日历范围")
+        if target >= len(days):
+            self._extend(d, 2 * n + 30)
+            return self.offset(d, n)
+        return days[target]
+
+    def range(self, start, end):
+        """[start, end] 内的所有交易日"""
+        start, end = to_date(start), to_date(end)
+        if start > end:
+            return []
+        self.ensure(start, end)
+        first, last, days, pos = self._state
+        stop = pos[(end - first).days + 1] if end < last else len(days)
+        return days[pos[(start - first).days]:stop]
+
+    def last_n(self, end, n):
+        """截至 end（含）的最近 n 个交易日"""
+        end = to_date(end)
+        last = end if self.is_trading_day(end) else self.prev(end)
+        return self.range(self.offset(last, -(n - 1)), last)
+
+_calendar = None
+_calendar_lock = threading.Lock()
+
+def get_calendar():
+    """返回进程内共享的交易日历"""
+    global _calendar
+    with _calendar_lock:
+        if _calendar is None:
+            _calendar = TradingCalendar()
+        return _calendar
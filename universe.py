@@ -0,0 +1,77 @@
+import threading
+import logging
+import numpy as np
+import pandas as pd
+import rq_api
+
+# 未退市股票的 de_listed_date 为 '0000-00-00'，统一视为无穷远的日期
+_FAR_FUTURE = np.datetime64("2999-12-31", "D")
+
+def _to_day(values):
+    """日期（'YYYY-MM-DD'/'YYYYMMDD' 字符串、date、Timestamp）转为 datetime64[D]，无法解析的值为 NaT"""
+    text = pd.Series(values).astype(str).str.replace("-", "", regex=False).str[:8]
+    return pd.to_datetime(text, format="%Y%m%d", errors="coerce").values.astype("datetime64[D]")
+
+# ============== 股票池区间索引 ==============
+class UniverseIndex:
+    """
+    按 [listed_date, de_listed_date) 区间构建的股票池索引
+
+    与 rqdatac.all_instruments(type='CS', date=D) 的口径一致：上市日不晚于 D 且尚未退市的股票。
+    查询完全在内存中完成，不需要网络请求。
+    """
+
+    def __init__(self, instruments):
+        """
+        Args:
+            instruments (DataFrame): 至少包含 order_book_id, listed_date, de_listed_date 三列
+        """
+        df = instruments.dropna(subset=["order_book_id"]).drop_duplicates("order_book_id")
+        self.order_book_ids = df["order_book_id"].to_numpy()
+        listed = _to_day(df["listed_date"])
+        delisted = _to_day(df["de_listed_date"])
+        # 上市日未知的股票不会出现在任何日期的股票池中
+        self.listed = np.where(np.isnat(listed), _FAR_FUTURE, listed)
+        self.delisted = np.where(np.isnat(delisted), _FAR_FUTURE, delisted)
+
+    @classmethod
+    def from_rqdatac(cls):
+        """一次 all_instruments(date=None) 调用获取全部历史股票后构建"""
+        df = rq_api.all_instruments(type='CS', market='cn', date=None, job="universe")
+        return cls(df)
+
+    def __len__(self):
+        return len(self.order_book_ids)
+
+    def active(self, date):
+        """指定日期的股票池"""
+        d = _to_day([date])[0]
+        mask = (self.listed <= d) & (d < self.delisted)
+        return self.order_book_ids[mask].tolist()
+
+    def active_matrix(self, dates):
+        """
+        一次向量化计算多个日期的股票池
+
+        Returns:
+            ndarray: bool 矩阵，形状为 (len(dates), len(order_book_ids))
+        """
+        days = _to_day(dates)[:, None]
+        return (self.listed[None, :] <= days) & (days < self.delisted[None, :])
+
+    def active_range(self, dates):
+        """返回 {日期: 股票列表}，键保持传入的日期格式"""
+        mask = self.active_matrix(dates)
+        return {date: self.order_book_ids[row].tolist() for date, row in zip(dates, mask)}
+
+_universe = None
+_universe_lock = threading.Lock()
+
+def get_universe():
+    """返回进程内共享的股票池索引，由一次 all_instruments 调用构建（当天重复运行命中本地缓存）"""
+    global _universe
+    with _universe_lock:
+        if _universe is None:
+            _universe = UniverseIndex.from_rqdatac()
+            logging.info(f"🗂️ 股票池索引已构建，共 {len(_universe)} 只股票")
+        return _universe